@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing the per-endpoint retry policy and circuit breakers.
+
+Failed requests (connection errors, timeouts and server errors) are retried
+with an exponential backoff with jitter. When all the retries of a request are
+exhausted the failure is accounted in the circuit breaker of the endpoint, and
+after a configurable number of consecutive failures the breaker opens: every
+further request to that endpoint fails immediately for the rest of the run.
+"""
+
+import random
+import threading
+import typing
+
+from oslo_config import cfg
+from oslo_log import log
+
+from caso import exception
+
+opts = [
+    cfg.IntOpt(
+        "failure_threshold",
+        default=5,
+        min=0,
+        help="Number of consecutive failed requests to an OpenStack endpoint "
+        "(after retries) before cASO stops sending requests to it for the rest "
+        "of the run. Extractors using that endpoint will be skipped, and the "
+        "last run date of the affected projects will not be updated. Set to 0 "
+        "to disable the circuit breaker.",
+    ),
+    cfg.IntOpt(
+        "retries",
+        default=2,
+        min=0,
+        help="Number of times a request failing with a connection error, a "
+        "timeout or a server error is retried.",
+    ),
+    cfg.FloatOpt(
+        "retry_base_delay",
+        default=1.0,
+        min=0,
+        help="Base delay (in seconds) of the exponential backoff between "
+        "retries. The actual delay is chosen randomly (full jitter) between 0 "
+        "and retry_base_delay * 2^attempt.",
+    ),
+    cfg.FloatOpt(
+        "retry_max_delay",
+        default=30.0,
+        min=0,
+        help="Maximum delay (in seconds) between retries.",
+    ),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group="circuit_breaker")
+
+LOG = log.getLogger(__name__)
+
+
+def retry_delay(attempt):
+    """Get the delay before retrying a request, using full jitter.
+
+    :param attempt: Number of retries already done for the request.
+    """
+    ceiling = min(
+        CONF.circuit_breaker.retry_max_delay,
+        CONF.circuit_breaker.retry_base_delay * 2**attempt,
+    )
+    return random.uniform(0, ceiling)  # nosec
+
+
+class CircuitBreaker(object):
+    """Circuit breaker for an endpoint.
+
+    Once opened, the breaker stays open for the rest of the run.
+    """
+
+    def __init__(self, endpoint, threshold):
+        """Initialize a closed breaker for an endpoint."""
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.is_open = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Check if a request can be sent, raising if the breaker is open.
+
+        :raises caso.exception.CircuitOpenError: if the breaker is open.
+        """
+        if self.is_open:
+            raise exception.CircuitOpenError(
+                endpoint=self.endpoint, failures=self.consecutive_failures
+            )
+
+    def record_success(self):
+        """Account a successful request."""
+        with self._lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        """Account a failed request, opening the breaker if needed."""
+        with self._lock:
+            self.consecutive_failures += 1
+            self.total_failures += 1
+            if (
+                self.threshold
+                and not self.is_open
+                and self.consecutive_failures >= self.threshold
+            ):
+                self.is_open = True
+                LOG.error(
+                    f"Endpoint '{self.endpoint}' failed {self.consecutive_failures} "
+                    "consecutive times, no more requests will be sent to it "
+                    "during this run"
+                )
+
+
+_BREAKERS: typing.Dict[str, CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(endpoint):
+    """Get the circuit breaker for an endpoint, creating it if needed."""
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint, CONF.circuit_breaker.failure_threshold)
+            _BREAKERS[endpoint] = breaker
+        return breaker
+
+
+def total_failures():
+    """Get the number of failed requests accounted in all the breakers."""
+    with _BREAKERS_LOCK:
+        return sum(b.total_failures for b in _BREAKERS.values())
+
+
+def reset():
+    """Drop all the circuit breakers."""
+    with _BREAKERS_LOCK:
+        _BREAKERS.clear()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing the persistent endpoint discovery cache used by cASO.
+
+keystoneauth performs version discovery (i.e. it fetches the version document)
+for every endpoint that a session talks to, and caches the results in a
+dictionary attached to the session. cASO shares a single cache, keyed by
+endpoint URL, across all the sessions created during a run, and stores it in
+the spool directory so that discovery is only done again once the cached
+entries expire.
+"""
+
+import json
+import os
+import threading
+import time
+import typing
+
+from keystoneauth1 import discover
+from oslo_config import cfg
+from oslo_log import log
+
+opts = [
+    cfg.BoolOpt(
+        "enabled",
+        default=True,
+        help="Keep the endpoint version discovery results in the spool "
+        "directory, so that they are reused in the next runs. Discovery results "
+        "are always shared between all the projects during a run.",
+    ),
+    cfg.IntOpt(
+        "ttl",
+        default=86400,
+        min=1,
+        help="Number of seconds that the discovery results of an endpoint are "
+        "kept before discovery is done again.",
+    ),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group="discovery_cache")
+
+LOG = log.getLogger(__name__)
+
+CACHE_FILE = "discovery_cache.json"
+
+
+def _make_discover(url, data):
+    """Build a discovery object from cached version data, without fetching it."""
+    disc = discover.Discover.__new__(discover.Discover)
+    disc._url = url
+    disc._data = data
+    return disc
+
+
+class DiscoveryCache(dict):
+    """A discovery cache, keyed by endpoint URL, whose entries expire.
+
+    Objects of this class are passed as the ``discovery_cache`` of the
+    keystoneauth sessions, that use them as a plain dictionary.
+
+    :param path: File where the cache is stored, None to keep it in memory.
+    :param ttl: Seconds that an entry is valid for.
+    """
+
+    def __init__(self, path=None, ttl=86400, clock=time.time):
+        """Initialize an empty cache."""
+        super(DiscoveryCache, self).__init__()
+        self.path = path
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._timestamps: typing.Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _expired(self, url):
+        timestamp = self._timestamps.get(url, 0)
+        return self._clock() - timestamp >= self.ttl
+
+    def __getitem__(self, url):
+        """Get the discovery object for a URL, if it has not expired."""
+        with self._lock:
+            if url in self.keys() and self._expired(url):
+                super(DiscoveryCache, self).__delitem__(url)
+                self._timestamps.pop(url, None)
+            return super(DiscoveryCache, self).__getitem__(url)
+
+    def get(self, url, default=None):
+        """Get the discovery object for a URL, accounting hits and misses."""
+        try:
+            value = self[url]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def __contains__(self, url):
+        """Check if there is a valid discovery object for a URL."""
+        try:
+            self[url]
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, url, disc):
+        """Store a discovery object, refreshing its timestamp if it is new."""
+        with self._lock:
+            if dict.get(self, url) is not disc:
+                self._timestamps[url] = self._clock()
+            super(DiscoveryCache, self).__setitem__(url, disc)
+
+    def load(self):
+        """Load the non expired entries stored in the cache file."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as fd:
+                entries = json.load(fd)
+        except (OSError, ValueError) as e:
+            LOG.warning(f"Cannot read discovery cache '{self.path}', ignoring - {e}")
+            return
+
+        with self._lock:
+            for url, entry in entries.items():
+                try:
+                    timestamp = float(entry["timestamp"])
+                    data = entry["data"]
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if self._clock() - timestamp >= self.ttl:
+                    continue
+                super(DiscoveryCache, self).__setitem__(url, _make_discover(url, data))
+                self._timestamps[url] = timestamp
+        LOG.debug(f"Loaded {len(self)} endpoints from discovery cache '{self.path}'")
+
+    def save(self):
+        """Store the non expired entries in the cache file."""
+        if not self.path:
+            return
+        with self._lock:
+            entries = {}
+            for url, disc in self.items():
+                data = getattr(disc, "_data", None)
+                if data is None or self._expired(url):
+                    continue
+                entries[url] = {"timestamp": self._timestamps[url], "data": data}
+
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as fd:
+                json.dump(entries, fd)
+            os.replace(tmp, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            LOG.warning(f"Cannot write discovery cache '{self.path}' - {e}")
+            return
+        LOG.debug(f"Stored {len(entries)} endpoints in discovery cache '{self.path}'")
+
+
+_CACHE: typing.Optional[DiscoveryCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """Get the discovery cache shared by all the sessions of this run."""
+    global _CACHE
+
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            path = None
+            if CONF.discovery_cache.enabled:
+                path = os.path.join(CONF.spooldir, CACHE_FILE)
+            _CACHE = DiscoveryCache(path, CONF.discovery_cache.ttl)
+            _CACHE.load()
+        return _CACHE
+
+
+def save():
+    """Store the shared discovery cache in the spool directory."""
+    with _CACHE_LOCK:
+        cache = _CACHE
+    if cache is None:
+        return
+    LOG.info(f"Endpoint discovery cache: {cache.hits} hits, {cache.misses} misses")
+    cache.save()
+
+
+def reset():
+    """Drop the shared discovery cache, so that it is loaded again."""
+    global _CACHE
+
+    with _CACHE_LOCK:
+        _CACHE = None
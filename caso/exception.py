@@ -58,3 +58,32 @@ class LogstashConnectionError(CasoError):
     """An error with the Logstash server."""
 
     msg_fmt = "Cannot send data to logstash {host}:{port}, " "reason: {exception}"
+
+
+class CircuitOpenError(CasoError):
+    """An OpenStack endpoint has failed too many times during this run."""
+
+    msg_fmt = (
+        "Endpoint {endpoint} failed {failures} consecutive times, "
+        "not sending more requests to it during this run."
+    )
+
+
+class IncompleteExtractionError(CasoError):
+    """Some of the records of an extraction could not be obtained.
+
+    The records that could be obtained are passed in the ``records`` argument.
+    """
+
+    msg_fmt = "Could not extract the records of {failed} resources."
+
+    @property
+    def records(self):
+        """Get the records that could be obtained."""
+        return self.kwargs.get("records") or []
+
+
+class InvalidSpoolError(CasoError):
+    """A record spool file cannot be read."""
+
+    msg_fmt = "Cannot read record spool {path}: {reason}"
@@ -27,6 +27,13 @@ opts = [
     cfg.StrOpt(
         "service_name", default="$site_name", help="Service name within the site"
     ),
+    cfg.BoolOpt(
+        "strict_validation",
+        default=False,
+        help="Validate all the fields of the records built by the extractors. If "
+        "disabled, the records are built trusting the values that the extractors "
+        "have already normalised, which is much faster.",
+    ),
 ]
 
 CONF = cfg.CONF
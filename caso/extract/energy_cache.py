@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing the persistent cache of per-VM energy buckets for cASO.
+
+The energy consumed by each VM is stored in fixed, aligned time buckets (one
+hour by default) in a SQLite database in the spool directory. When a period is
+extracted again (reruns, backfills or overlapping extraction periods), the
+buckets that are fully contained in it are taken from the cache, and Prometheus
+is only queried for the missing buckets and for the edges of the period.
+
+Buckets are only cached once they are old enough for Prometheus to have all
+their samples. Every bucket is stored along with a fingerprint of the query
+settings, so that changing them invalidates the cached values. Buckets that
+have not been used for some time are evicted.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+import dateutil.parser
+from oslo_config import cfg
+from oslo_log import log
+
+from caso import utils
+
+opts = [
+    cfg.BoolOpt(
+        "enabled",
+        default=True,
+        help="Store the energy consumed by each VM in fixed time buckets in the "
+        "spool directory, so that Prometheus is not queried again for the "
+        "buckets that were already obtained (e.g. when extracting overlapping "
+        "periods again).",
+    ),
+    cfg.IntOpt(
+        "bucket_size",
+        default=3600,
+        min=60,
+        help="Size of the time buckets, in seconds. Buckets are aligned to "
+        "multiples of this size (since the epoch).",
+    ),
+    cfg.IntOpt(
+        "min_age",
+        default=900,
+        min=0,
+        help="Number of seconds that must have passed since the end of a bucket "
+        "before it is cached, so that late samples are not missed.",
+    ),
+    cfg.IntOpt(
+        "retention",
+        default=90,
+        min=1,
+        help="Number of days that a cached bucket is kept since it was last "
+        "used. Older buckets are evicted at the end of each run.",
+    ),
+    cfg.StrOpt(
+        "invalidate_before",
+        help="Drop the cached buckets that were obtained before this date, e.g. "
+        "after samples have been added to or fixed in Prometheus. If no time "
+        "zone is specified, UTC will be used.",
+    ),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group="energy_cache")
+
+LOG = log.getLogger(__name__)
+
+CACHE_FILE = "energy_cache.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    fingerprint TEXT NOT NULL,
+    vm_uuid TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    energy REAL NOT NULL,
+    covered REAL,
+    computed REAL NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (fingerprint, vm_uuid, start)
+)
+"""
+
+
+class Bucket(typing.NamedTuple):
+    """Energy consumed by a VM during a bucket."""
+
+    # Energy in Wh
+    energy: float
+    # Seconds covered by samples, None if unknown
+    covered: typing.Optional[float]
+
+
+def fingerprint(settings):
+    """Get the fingerprint of the settings used to obtain the buckets."""
+    data = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+
+def _to_epoch(dt):
+    return int(utils.utc_timestamp(dt))
+
+
+class EnergyCache(object):
+    """A persistent cache of the energy consumed by VMs in time buckets.
+
+    :param path: SQLite database where the cache is stored, None to keep it in
+                 memory.
+    :param bucket_size: Size of the buckets, in seconds.
+    :param min_age: Seconds since the end of a bucket before it is cached.
+    :param retention: Days that a bucket is kept since it was last used.
+    """
+
+    def __init__(
+        self, path=None, bucket_size=3600, min_age=900, retention=90, clock=time.time
+    ):
+        """Initialize the cache, opening its database."""
+        self.path = path
+        self.bucket_size = bucket_size
+        self.min_age = min_age
+        self.retention = retention
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+    def buckets(self, start, end):
+        """Get the start of the cacheable buckets that are inside a period.
+
+        :returns: A list of the (naive, UTC) start of the buckets that are fully
+                  contained in the period, and that are old enough.
+        """
+        size = self.bucket_size
+        first = -(-_to_epoch(start) // size) * size
+        last = min(_to_epoch(end), self._clock() - self.min_age) // size * size
+        return [utils.utc_from_timestamp(b) for b in range(first, int(last), size)]
+
+    def get(self, fingerprint, vm_uuid, starts):
+        """Get the cached buckets of a VM.
+
+        :returns: A dictionary with the Bucket of each of the given bucket
+                  starts that is in the cache.
+        """
+        if not starts:
+            return {}
+        epochs = {_to_epoch(s): s for s in starts}
+        where = (
+            "WHERE fingerprint = ? AND vm_uuid = ? "
+            f"AND start IN ({','.join('?' * len(epochs))})"
+        )
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT start, energy, covered FROM buckets {where}",
+                [fingerprint, vm_uuid, *epochs],
+            ).fetchall()
+            if rows:
+                self._db.execute(
+                    f"UPDATE buckets SET used = ? {where}",
+                    [self._clock(), fingerprint, vm_uuid, *epochs],
+                )
+                self._db.commit()
+            self.hits += len(rows)
+            self.misses += len(epochs) - len(rows)
+        return {
+            epochs[start]: Bucket(energy, covered) for start, energy, covered in rows
+        }
+
+    def store(self, fingerprint, vm_uuid, buckets):
+        """Store the buckets of a VM.
+
+        :param buckets: Dictionary with the Bucket for each bucket start.
+        """
+        if not buckets:
+            return
+        now = self._clock()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (fingerprint, vm_uuid, _to_epoch(s), b.energy, b.covered, now, now)
+                    for s, b in buckets.items()
+                ],
+            )
+            self._db.commit()
+
+    def invalidate(self, vm_uuid=None, computed_before=None):
+        """Drop cached buckets.
+
+        :param vm_uuid: Only drop the buckets of this VM.
+        :param computed_before: Only drop the buckets obtained before this
+                                (naive, UTC) date.
+        :returns: The number of buckets dropped.
+        """
+        query = "DELETE FROM buckets WHERE 1 = 1"
+        args: typing.List[typing.Any] = []
+        if vm_uuid is not None:
+            query += " AND vm_uuid = ?"
+            args.append(vm_uuid)
+        if computed_before is not None:
+            query += " AND computed < ?"
+            args.append(_to_epoch(computed_before))
+        with self._lock:
+            count = self._db.execute(query, args).rowcount
+            self._db.commit()
+        return count
+
+    def evict(self):
+        """Drop the buckets that have not been used within the retention period.
+
+        :returns: The number of buckets dropped.
+        """
+        limit = self._clock() - self.retention * 86400
+        with self._lock:
+            count = self._db.execute(
+                "DELETE FROM buckets WHERE used < ?", (limit,)
+            ).rowcount
+            self._db.commit()
+        return count
+
+    def close(self):
+        """Close the database of the cache."""
+        with self._lock:
+            self._db.close()
+
+
+_CACHE: typing.Optional[EnergyCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """Get the energy cache shared by all the extractors of this run.
+
+    :returns: The cache, or None if it is disabled or cannot be opened.
+    """
+    global _CACHE
+
+    if not CONF.energy_cache.enabled:
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            path = os.path.join(CONF.spooldir, CACHE_FILE)
+            try:
+                cache = EnergyCache(
+                    path,
+                    bucket_size=CONF.energy_cache.bucket_size,
+                    min_age=CONF.energy_cache.min_age,
+                    retention=CONF.energy_cache.retention,
+                )
+            except sqlite3.Error as e:
+                LOG.warning(f"Cannot open energy cache '{path}', not using it - {e}")
+                return None
+            invalidate_before = CONF.energy_cache.invalidate_before
+            if invalidate_before:
+                date = dateutil.parser.parse(invalidate_before)
+                if date.tzinfo is not None:
+                    date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                count = cache.invalidate(computed_before=date)
+                LOG.info(f"Dropped {count} energy buckets obtained before {date}")
+            _CACHE = cache
+        return _CACHE
+
+
+def save():
+    """Evict the old buckets of the shared cache and close it."""
+    global _CACHE
+
+    with _CACHE_LOCK:
+        cache = _CACHE
+        _CACHE = None
+    if cache is None:
+        return
+    try:
+        evicted = cache.evict()
+    except sqlite3.Error as e:
+        LOG.warning(f"Cannot evict buckets from the energy cache - {e}")
+        evicted = 0
+    LOG.info(
+        f"Energy bucket cache: {cache.hits} hits, {cache.misses} misses, "
+        f"{evicted} evicted"
+    )
+    cache.close()
+
+
+def reset():
+    """Close the shared energy cache, so that it is opened again."""
+    global _CACHE
+
+    with _CACHE_LOCK:
+        cache = _CACHE
+        _CACHE = None
+    if cache is not None:
+        cache.close()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing the integration of time series samples for cASO.
+
+Time series (e.g. power samples obtained from Prometheus) are integrated over
+their real timestamps. Samples that are further apart than a maximum gap are
+considered to be separated by missing data, that is not accounted for. Along
+with the integral we return the ratio of the period that is covered by samples.
+
+If NumPy is available the integration is vectorised, otherwise a pure Python
+implementation is used. Series can also be integrated incrementally, one sample
+at a time, with an :class:`Accumulator`, without keeping the samples in memory.
+"""
+
+import typing
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None  # type: ignore[assignment]
+
+METHODS = ("step", "trapezoid")
+
+
+class Integral(typing.NamedTuple):
+    """Result of the integration of a time series."""
+
+    value: float
+    # Ratio of the period covered by samples, None if unknown
+    coverage: typing.Optional[float]
+
+
+def _coverage(covered, duration):
+    if duration <= 0:
+        return 1.0 if covered > 0 else 0.0
+    return min(1.0, covered / duration)
+
+
+def _integrate_numpy(samples, step, max_gap, method):
+    data = numpy.array(samples, dtype=float)
+    times = data[:, 0]
+    values = data[:, 1]
+    gaps = numpy.diff(times)
+
+    if method == "trapezoid":
+        valid = gaps <= max_gap
+        areas = (values[:-1] + values[1:]) / 2 * gaps
+        return float(areas[valid].sum()), float(gaps[valid].sum())
+
+    widths = numpy.append(gaps, step)
+    widths = numpy.where(widths > max_gap, step, widths)
+    return float((values * widths).sum()), float(widths.sum())
+
+
+def _integrate_python(samples, step, max_gap, method):
+    times = [float(t) for t, _ in samples]
+    values = [float(v) for _, v in samples]
+    total = 0.0
+    covered = 0.0
+
+    if method == "trapezoid":
+        for i in range(len(samples) - 1):
+            gap = times[i + 1] - times[i]
+            if gap <= max_gap:
+                total += (values[i] + values[i + 1]) / 2 * gap
+                covered += gap
+        return total, covered
+
+    for i, value in enumerate(values):
+        width = times[i + 1] - times[i] if i + 1 < len(samples) else step
+        if width > max_gap:
+            width = step
+        total += value * width
+        covered += width
+    return total, covered
+
+
+def integrate(samples, step, duration, method="step", max_gap=None):
+    """Integrate a time series over its timestamps.
+
+    :param samples: List of ``(timestamp, value)`` pairs, sorted by timestamp,
+                    as returned by Prometheus (values may be strings).
+    :param step: Nominal interval between samples, in seconds.
+    :param duration: Duration of the period the samples belong to, in seconds,
+                     used to compute the coverage ratio.
+    :param method: ``step`` to hold each sample until the next one (or for
+                   ``step`` seconds, if it is the last one or the next one is
+                   further than ``max_gap``), or ``trapezoid`` to use the
+                   trapezoidal rule between consecutive samples that are not
+                   further apart than ``max_gap``.
+    :param max_gap: Maximum interval between two samples, in seconds, for them
+                    to be considered contiguous (defaults to twice the step).
+    :returns: An :class:`Integral` with the integral (in value·seconds) and the
+              coverage ratio.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown integration method '{method}'")
+    if not samples:
+        return Integral(0.0, 0.0)
+    if max_gap is None:
+        max_gap = 2 * step
+
+    if numpy is not None:
+        total, covered = _integrate_numpy(samples, step, max_gap, method)
+    else:
+        total, covered = _integrate_python(samples, step, max_gap, method)
+    return Integral(total, _coverage(covered, duration))
+
+
+class Partial(typing.NamedTuple):
+    """Partial integral of a run of consecutive samples of a time series."""
+
+    value: float
+    # Seconds covered between the samples of the run
+    covered: float
+    # First and last (timestamp, value) samples of the run
+    first: typing.Tuple[float, float]
+    last: typing.Tuple[float, float]
+
+
+def _pair(a, b, step, max_gap, method):
+    """Integrate the interval between two consecutive samples."""
+    gap = b[0] - a[0]
+    if method == "trapezoid":
+        if gap > max_gap:
+            return 0.0, 0.0
+        return (a[1] + b[1]) / 2 * gap, gap
+    width = gap if gap <= max_gap else step
+    return a[1] * width, width
+
+
+class Accumulator(object):
+    """Integrate a time series incrementally, one sample at a time.
+
+    Samples must be added in time order. Only the first and last samples are
+    kept, so the memory used does not depend on the number of samples.
+    """
+
+    def __init__(self, step, method="step", max_gap=None):
+        """Initialize an empty accumulator."""
+        if method not in METHODS:
+            raise ValueError(f"Unknown integration method '{method}'")
+        self.step = step
+        self.method = method
+        self.max_gap = 2 * step if max_gap is None else max_gap
+        self._value = 0.0
+        self._covered = 0.0
+        self._first = None
+        self._last = None
+
+    def add(self, timestamp, value):
+        """Add the next sample of the series."""
+        sample = (float(timestamp), float(value))
+        if self._last is None:
+            self._first = sample
+        else:
+            value, covered = _pair(
+                self._last, sample, self.step, self.max_gap, self.method
+            )
+            self._value += value
+            self._covered += covered
+        self._last = sample
+
+    def partial(self):
+        """Get the partial integral of the samples added, None if there are none."""
+        if self._last is None:
+            return None
+        return Partial(self._value, self._covered, self._first, self._last)
+
+
+def merge(partials, step, duration, method="step", max_gap=None):
+    """Join the partial integrals of non overlapping runs of a time series.
+
+    The result is the same as integrating all the samples of the runs at once
+    with :func:`integrate`.
+
+    :param partials: List of :class:`Partial` integrals, in any order.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown integration method '{method}'")
+    if max_gap is None:
+        max_gap = 2 * step
+
+    total = 0.0
+    covered = 0.0
+    previous = None
+    for partial in sorted(partials, key=lambda p: p.first[0]):
+        total += partial.value
+        covered += partial.covered
+        if previous is not None:
+            value, width = _pair(previous.last, partial.first, step, max_gap, method)
+            total += value
+            covered += width
+        previous = partial
+
+    if previous is None:
+        return Integral(0.0, 0.0)
+    if method == "step":
+        total += previous.last[1] * step
+        covered += step
+    return Integral(total, _coverage(covered, duration))
@@ -27,8 +27,15 @@ from oslo_config import cfg
 from oslo_log import log
 import six
 
+from caso import circuit_breaker
+from caso import discovery_cache
+from caso import exception
+from caso import http_pool
 from caso import keystone_client
 from caso import loading
+from caso import record
+from caso import response_cache
+from caso.extract import energy_cache
 
 from keystoneauth1.exceptions.catalog import EmptyCatalog
 from keystoneauth1.exceptions.http import Forbidden
@@ -95,6 +102,7 @@ cli_opts = [
 CONF = cfg.CONF
 
 CONF.register_cli_opts(cli_opts)
+CONF.import_opt("strict_validation", "caso.extract.base")
 
 LOG = log.getLogger(__name__)
 
@@ -117,6 +125,10 @@ class Manager(object):
         self._voms_map = {}
         self.keystone = self._get_keystone_client()
 
+        # Extractors that will not be used for the rest of the run, as one of
+        # the endpoints that they use is failing
+        self.skipped_extractors = set()
+
     @property
     def projects(self):
         """Get list of configured projects."""
@@ -303,15 +315,37 @@ class Manager(object):
                 continue
 
             record_count = 0
+            # Do not update the lastrun file if an extractor could not get the
+            # records because an endpoint is failing, so that they are extracted
+            # again in the next run.
+            advance_lastrun = True
             for extractor_name, extractor_cls in self.extractors:
+                if extractor_name in self.skipped_extractors:
+                    LOG.warning(
+                        f"Extractor {extractor_name}: skipping project "
+                        f"'{project}', as one of its endpoints is failing"
+                    )
+                    advance_lastrun = False
+                    continue
+
                 LOG.debug(
                     f"Extractor {extractor_name}: extracting records "
                     f"for project {project} "
                     f"({extract_from} to {extract_to})"
                 )
+                failures = circuit_breaker.total_failures()
                 try:
                     extractor = extractor_cls(project, vo)
-                    records = extractor.extract(extract_from, extract_to)
+                    try:
+                        records = extractor.extract(extract_from, extract_to)
+                    except exception.IncompleteExtractionError as e:
+                        LOG.error(
+                            f"Extractor {extractor_name}: {e} for project "
+                            f"'{project}', they will be extracted again in the "
+                            "next run"
+                        )
+                        records = e.records
+                        advance_lastrun = False
                     current_count = len(records)
                     record_count += current_count
                     all_records.extend(records)
@@ -322,16 +356,39 @@ class Manager(object):
                         f"'{project}' "
                         f"({extract_from} to {extract_to})"
                     )
+                except exception.CircuitOpenError as e:
+                    LOG.error(
+                        f"Extractor {extractor_name}: cannot extract records "
+                        f"for '{project}' ({e}), skipping this extractor for "
+                        "the rest of the run"
+                    )
+                    self.skipped_extractors.add(extractor_name)
+                    advance_lastrun = False
                 except Exception:
                     LOG.exception(
                         f"Extractor {extractor_name}: cannot "
                         f"extract records for '{project}', got "
                         "the following exception: "
                     )
+                    if circuit_breaker.total_failures() > failures:
+                        advance_lastrun = False
             LOG.info(
                 f"Extracted {record_count} records in total for "
                 f"project '{project}' "
                 f"({extract_from} to {extract_to})"
             )
-            self.write_lastrun(project, extract_to)
+            if advance_lastrun:
+                self.write_lastrun(project, extract_to)
+            else:
+                LOG.warning(
+                    f"Not updating the lastrun file for project '{project}', "
+                    "as some of its records could not be extracted"
+                )
+        # Extractors may give compact records, that are only built into full records
+        # once all the records have been extracted
+        record.validate_records(all_records, trusted=not CONF.strict_validation)
+        http_pool.log_stats()
+        discovery_cache.save()
+        response_cache.save()
+        energy_cache.save()
         return all_records
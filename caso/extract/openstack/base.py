@@ -26,6 +26,7 @@ import novaclient.client
 from oslo_config import cfg
 from oslo_log import log
 
+from caso import exception
 from caso.extract import base
 from caso import keystone_client
 
@@ -124,10 +125,16 @@ class BaseOpenStackExtractor(base.BaseProjectExtractor):
         return self.keystone.projects.get(self.project).id
 
     def _get_keystone_user(self, uuid):
-        """Get the Keystone username for a given uuid."""
+        """Get the Keystone username for a given uuid.
+
+        :raises caso.exception.CircuitOpenError: if Keystone has failed too many
+                                                 times during this run.
+        """
         try:
             user = self.keystone_unscoped.users.get(user=uuid)
             return user.name
+        except exception.CircuitOpenError:
+            raise
         except keystoneauth1.exceptions.http.Forbidden as e:
             LOG.error(f"Unauthorized to get user {uuid}")
             LOG.exception(e)
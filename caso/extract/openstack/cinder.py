@@ -56,9 +56,9 @@ class CinderExtractor(base.BaseOpenStackExtractor):
         active_duration_delta = extract_to - vol_created
         ms = active_duration_delta.microseconds
         td = datetime.timedelta(microseconds=ms)
-        active_duration = (active_duration_delta - td).total_seconds()
+        active_duration = int((active_duration_delta - td).total_seconds())
 
-        r = record.StorageRecord(
+        r = record.CompactStorageRecord(
             uuid=volume.id,
             site_name=CONF.site_name,
             name=volume.name,
@@ -82,6 +82,11 @@ CONF.register_opts(accelerator_opts, group="accelerator")
 LOG = log.getLogger(__name__)
 
 
+def _to_ascii(value):
+    """Remove the non-ascii characters of a string."""
+    return value.encode("ascii", errors="ignore").decode("ascii")
+
+
 class NovaExtractor(base.BaseOpenStackExtractor):
     """An OpenStack Compute (Nova) record extractor for cASO."""
 
@@ -129,14 +134,14 @@ class NovaExtractor(base.BaseOpenStackExtractor):
             if duration < 0:
                 # something weird happened, but don't send negative records
                 continue
-            month_record = record.AcceleratorRecord(
+            month_record = record.CompactAcceleratorRecord(
                 measurement_month=month.month,
                 measurement_year=month.year,
                 uuid=server_record.uuid,
                 fqan=server_record.fqan,
                 compute_service=server_record.compute_service,
                 site_name=server_record.site_name,
-                count=acc_count,
+                count=int(acc_count),
                 available_duration=int(duration),
                 accelerator_type=acc_type,
                 user_dn=server_record.user_dn,
@@ -228,11 +233,14 @@ class NovaExtractor(base.BaseOpenStackExtractor):
         floating_ips = self._count_ips_on_server(server)
 
         # Filter out non-ascii characters for APEL compatibility.
-        vm_name = server.name.encode("ascii", errors="ignore")
-        local_user_id = server.user_id.encode("ascii", errors="ignore")
-        global_username = user.encode("ascii", errors="ignore") if user else None
+        vm_name = _to_ascii(server.name)
+        local_user_id = _to_ascii(server.user_id)
+        global_username = _to_ascii(user) if user else None
+
+        if bench_value is not None:
+            bench_value = float(bench_value)
 
-        r = record.CloudRecord(
+        r = record.CompactCloudRecord(
             uuid=server.id,
             site_name=CONF.site_name,
             name=vm_name,
@@ -16,16 +16,33 @@
 
 """Energy Consumption extractor for cASO."""
 
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import functools
 import operator
+import re
+import threading
+import time
+import typing
 import uuid
 from datetime import timedelta
 
 import dateutil.parser
 import prometheus_api_client
+import requests
 from oslo_config import cfg
 from oslo_log import log
 
+from caso import exception
+from caso import http_pool
 from caso import record
+from caso import utils
+from caso.extract import energy_cache
+from caso.extract import integration
+from caso.extract import streaming
 from caso.extract.openstack import base
 
 CONF = cfg.CONF
@@ -51,6 +68,17 @@ opts = [
         default=["type_instance:scaph_process_power_microwatts"],
         help="List of label filters as key:value pairs to filter the metric.",
     ),
+    cfg.ListOpt(
+        "metrics",
+        default=[],
+        help="Names of the power metrics whose energy is added up in the "
+        "records, e.g. 'scaphandre,ipmi,dcgm'. Each metric is configured in a "
+        "[prometheus_metric_<name>] section, and its contribution is reported "
+        "separately in the records. All the metrics are obtained in the same "
+        "run, sharing the server listing and the Prometheus client. If empty, "
+        "the metric configured in this section (prometheus_metric_name, "
+        "vm_uuid_label_name and labels) is used.",
+    ),
     cfg.IntOpt(
         "prometheus_step_seconds",
         default=30,
@@ -66,6 +94,97 @@ opts = [
         default=1.0,
         help="CPU normalization factor to apply to energy measurements.",
     ),
+    cfg.IntOpt(
+        "vm_batch_size",
+        default=1,
+        min=1,
+        help="Number of VMs whose energy consumption is obtained with a single "
+        "Prometheus query. The query matches the VM UUID label with a regular "
+        "expression and aggregates the results by that label. Set to 1 to send "
+        "a query per VM.",
+    ),
+    cfg.StrOpt(
+        "integration_mode",
+        default="client",
+        choices=[
+            (
+                "client",
+                "Download the raw power samples and integrate them in cASO. "
+                "Useful to validate the other modes.",
+            ),
+            (
+                "sum_over_time",
+                "Let Prometheus integrate the samples, with an instant query "
+                "using sum_over_time over a subquery with the configured step. "
+                "Gives the same results as the client mode.",
+            ),
+            (
+                "avg_over_time",
+                "Let Prometheus compute the average power with an instant query "
+                "using avg_over_time, multiplied by the duration of the period. "
+                "Does not depend on the sampling frequency.",
+            ),
+        ],
+        help="How the energy consumption is integrated from the power samples. "
+        "The server side modes get a single value per VM and period from "
+        "Prometheus, instead of all the samples.",
+    ),
+    cfg.StrOpt(
+        "integration_method",
+        default="step",
+        choices=[
+            (
+                "step",
+                "Each sample holds its value until the next one. Gives the "
+                "same results as summing the samples for regular series.",
+            ),
+            ("trapezoid", "Trapezoidal rule between consecutive samples."),
+        ],
+        help="Method used to integrate the raw power samples over their "
+        "timestamps, when integration_mode is 'client'.",
+    ),
+    cfg.IntOpt(
+        "max_sample_gap",
+        min=1,
+        help="Maximum interval (in seconds) between two power samples for them "
+        "to be considered contiguous. Longer intervals are considered missing "
+        "data, and are not accounted. Defaults to twice prometheus_step_seconds.",
+    ),
+    cfg.BoolOpt(
+        "stream_responses",
+        default=True,
+        help="Decode the responses to the range queries (in the 'client' "
+        "integration mode) as they are received, integrating the samples on the "
+        "fly, so that the memory used does not depend on the size of the "
+        "responses.",
+    ),
+    cfg.IntOpt(
+        "max_concurrent_queries",
+        default=4,
+        min=1,
+        help="Maximum number of queries (for different VMs, batches of VMs or "
+        "time chunks) sent concurrently to Prometheus.",
+    ),
+    cfg.IntOpt(
+        "query_timeout",
+        default=60,
+        min=1,
+        help="Timeout (in seconds) of each Prometheus query.",
+    ),
+    cfg.IntOpt(
+        "query_retries",
+        default=2,
+        min=0,
+        help="Number of times a failed Prometheus query is retried. If a query "
+        "still fails, no record is generated for the VMs that it covers.",
+    ),
+    cfg.FloatOpt(
+        "query_retry_delay",
+        default=1.0,
+        min=0,
+        help="Delay (in seconds) before retrying a failed Prometheus query, "
+        "doubled on every retry.",
+    ),
 ]
 
 CONF.import_opt("site_name", "caso.extract.base")
@@ -73,6 +192,127 @@ CONF.register_opts(opts, group="prometheus")
 
 LOG = log.getLogger(__name__)
 
+# Size of the chunks in which streamed responses are read
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Factors converting the supported power units to µW
+_UNITS = {"microwatts": 1.0, "milliwatts": 1_000.0, "watts": 1_000_000.0}
+
+
+def get_metric_opts(metric_name: str) -> typing.List[cfg.Opt]:
+    """Get the configuration options for a power metric.
+
+    :param metric_name: Name of the metric, as listed in [prometheus] metrics.
+    :returns: List of configuration options for the metric.
+    """
+    return [
+        cfg.StrOpt(
+            "metric_name",
+            default="prometheus_value",
+            help=f"Name of the Prometheus metric with the power of the VMs for "
+            f"the '{metric_name}' metric.",
+        ),
+        cfg.StrOpt(
+            "vm_uuid_label_name",
+            help="Name of the label that matches the VM UUID in this metric. "
+            "Defaults to the one in the [prometheus] section.",
+        ),
+        cfg.ListOpt(
+            "labels",
+            default=[],
+            help="List of label filters as key:value pairs to filter the metric.",
+        ),
+        cfg.StrOpt(
+            "unit",
+            default="microwatts",
+            choices=list(_UNITS),
+            help="Unit of the power values of the metric.",
+        ),
+    ]
+
+
+def register_metric_opts(metric_names: typing.List[str]):
+    """Register configuration options for the specified power metrics.
+
+    :param metric_names: List of metric names to register options for.
+    """
+    for metric_name in metric_names:
+        group_name = f"prometheus_metric_{metric_name}"
+        CONF.register_opts(get_metric_opts(metric_name), group=group_name)
+
+
+class Metric(typing.NamedTuple):
+    """A Prometheus metric with the power consumed by the VMs."""
+
+    # Name the energy obtained from the metric is attributed to
+    name: str
+    metric: str
+    uuid_label: str
+    labels: typing.Dict[str, str]
+    # Factor converting the values of the metric to µW
+    scale: float
+
+
+class Segment(typing.NamedTuple):
+    """Part of the extraction period of a VM that is queried on its own."""
+
+    start: datetime.datetime
+    end: datetime.datetime
+    # Whether the segment is a bucket to be stored in the energy cache
+    bucket: bool
+
+
+_CLIENT: typing.Optional[prometheus_api_client.PrometheusConnect] = None
+_SESSION: typing.Optional[requests.Session] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_prometheus_client():
+    """Get the Prometheus client shared by all the extractors during a run.
+
+    The client uses its own pooled HTTP session (as the SSL verification
+    settings for Prometheus may differ from the OpenStack ones), whose
+    connections are kept alive and reused for all the VMs and projects, and
+    accounted in the connection statistics of :mod:`caso.http_pool`.
+    """
+    global _CLIENT, _SESSION
+
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            url = CONF.prometheus.prometheus_endpoint
+            session = http_pool.create_session()
+            session.verify = CONF.prometheus.prometheus_verify_ssl
+            client = prometheus_api_client.PrometheusConnect(
+                url=url,
+                disable_ssl=not CONF.prometheus.prometheus_verify_ssl,
+                session=session,
+            )
+            # The client mounts its own (non pooled) adapter for its URL, in
+            # order to retry failed requests, replace it with a pooled one
+            # keeping the same retry policy.
+            retries = session.get_adapter(url).max_retries
+            session.mount(url, http_pool.get_adapter(max_retries=retries))
+            _CLIENT = client
+            _SESSION = session
+        return _CLIENT
+
+
+def get_prometheus_session():
+    """Get the pooled HTTP session used by the shared Prometheus client."""
+    get_prometheus_client()
+    return _SESSION
+
+
+def reset_prometheus_client():
+    """Drop the shared Prometheus client, closing its connections."""
+    global _CLIENT, _SESSION
+
+    with _CLIENT_LOCK:
+        if _SESSION is not None:
+            _SESSION.close()
+        _CLIENT = None
+        _SESSION = None
+
 
 class EnergyConsumptionExtractor(base.BaseOpenStackExtractor):
     """Extractor for VM energy consumption from Prometheus."""
@@ -91,33 +331,78 @@ class EnergyConsumptionExtractor(base.BaseOpenStackExtractor):
             flavors[flavor.id]["extra"] = flavor.get_keys()
         return flavors
 
-    def _get_servers(self):
-        """Get all servers for the project, paginated."""
+    def _list_servers(self, search_opts=None):
+        """List the servers of the project, paginated."""
         servers = []
         limit = 200
         marker = None
 
         while True:
-            batch = self.nova.servers.list(limit=limit, marker=marker)
+            batch = self.nova.servers.list(
+                search_opts=search_opts, limit=limit, marker=marker
+            )
             servers.extend(batch)
             if len(batch) < limit:
                 break
             marker = batch[-1].id
+        return servers
+
+    def _get_servers(self, extract_from, extract_to):
+        """Get the servers of the project that existed during the period.
+
+        :returns: A list of servers sorted by creation date, and a dictionary
+                  with the part of the extraction period during which each
+                  server existed.
+        """
+        servers = {server.id: server for server in self._list_servers()}
+        # Deleted servers are only listed when asking for the changes since a
+        # date, so we get those that were deleted during the period
+        for server in self._list_servers({"changes-since": extract_from}):
+            if server.status.upper() == "DELETED":
+                servers.setdefault(server.id, server)
+
+        alive = []
+        windows = {}
+        for server in servers.values():
+            window = self._get_server_window(server, extract_from, extract_to)
+            if window is None:
+                LOG.debug(
+                    f"VM {server.name} ({server.id}) did not exist during the "
+                    "extraction period, skipping"
+                )
+                continue
+            alive.append(server)
+            windows[str(server.id)] = window
 
         # Sort by creation date
-        servers = sorted(servers, key=operator.attrgetter("created"))
-        return servers
+        alive = sorted(alive, key=operator.attrgetter("created"))
+        return alive, windows
+
+    @staticmethod
+    def _get_server_window(server, extract_from, extract_to):
+        """Get the part of the extraction period during which a server existed.
+
+        :returns: A (start, end) tuple, or None if the server did not exist
+                  during the extraction period.
+        """
+        start = dateutil.parser.parse(server.created).replace(tzinfo=None)
+        end = extract_to
+        if server.status.upper() == "DELETED":
+            deleted_at = getattr(server, "OS-SRV-USG:terminated_at", None)
+            deleted_at = deleted_at or server.updated
+            end = min(end, dateutil.parser.parse(deleted_at).replace(tzinfo=None))
+        start = max(start, extract_from)
+        if start >= end:
+            return None
+        return start, end
 
     def _get_prometheus_client(self):
-        """Create and return a Prometheus client based on configuration."""
-        return prometheus_api_client.PrometheusConnect(
-            url=CONF.prometheus.prometheus_endpoint,
-            disable_ssl=not CONF.prometheus.prometheus_verify_ssl,
-        )
+        """Get the Prometheus client shared by all the extractors."""
+        return get_prometheus_client()
 
-    def _build_label_selector(self, vm_uuid):
+    def _get_label_filters(self, label_filters):
         labels = {}
-        for label_filter in CONF.prometheus.labels:
+        for label_filter in label_filters:
             if ":" in label_filter:
                 key, value = label_filter.split(":", 1)
                 labels[key.strip()] = value.strip()
@@ -125,9 +410,52 @@ class EnergyConsumptionExtractor(base.BaseOpenStackExtractor):
                 LOG.warning(
                     f"Invalid label filter '{label_filter}', expected 'key:value'."
                 )
-        labels[CONF.prometheus.vm_uuid_label_name] = vm_uuid
+        return labels
+
+    def _get_metrics(self):
+        """Get the power metrics whose energy has to be obtained."""
+        if not CONF.prometheus.metrics:
+            return [
+                Metric(
+                    CONF.prometheus.prometheus_metric_name,
+                    CONF.prometheus.prometheus_metric_name,
+                    CONF.prometheus.vm_uuid_label_name,
+                    self._get_label_filters(CONF.prometheus.labels),
+                    1.0,
+                )
+            ]
+
+        register_metric_opts(CONF.prometheus.metrics)
+        metrics = []
+        for name in CONF.prometheus.metrics:
+            group = CONF[f"prometheus_metric_{name}"]
+            metrics.append(
+                Metric(
+                    name,
+                    group.metric_name,
+                    group.vm_uuid_label_name or CONF.prometheus.vm_uuid_label_name,
+                    self._get_label_filters(group.labels),
+                    _UNITS[group.unit],
+                )
+            )
+        return metrics
+
+    def _build_label_selector(self, metric, vm_uuid):
+        labels = dict(metric.labels)
+        labels[metric.uuid_label] = vm_uuid
         return ",".join(f'{k}="{v}"' for k, v in labels.items())
 
+    def _build_batch_label_selector(self, metric, vm_uuids):
+        """Build a label selector matching all the given VMs."""
+        labels = [f'{k}="{v}"' for k, v in metric.labels.items()]
+        # Escape regex metacharacters (twice, as PromQL strings are unescaped
+        # before the regular expression is compiled)
+        regex = "|".join(
+            re.sub(r"([.^$*+?()\[\]{}|\\])", r"\\\\\1", vm_uuid) for vm_uuid in vm_uuids
+        )
+        labels.append(f'{metric.uuid_label}=~"{regex}"')
+        return ",".join(labels)
+
     def _split_time_chunks(self, start, end, step_seconds, max_points=11_000):
         """Yield non-overlapping (chunk_start, chunk_end) tuples."""
         while start < end:
@@ -137,50 +465,683 @@ class EnergyConsumptionExtractor(base.BaseOpenStackExtractor):
             yield start, min(chunk_end, end)
             start = chunk_end + timedelta(seconds=step_seconds)  # avoid overlapping
 
-    def _energy_consumed_wh(self, vm_uuid, extract_from, extract_to):
-        """Compute energy (Wh) from Prometheus in chunks for a VM."""
-        prom = self._get_prometheus_client()
-        label_selector = self._build_label_selector(vm_uuid)
-        factor = CONF.prometheus.prometheus_step_seconds / 3600 / 1_000_000  # µW·s → Wh
+    def _retrying(self, func, description):
+        """Run a query, retrying it if it fails.
+
+        :param func: Function running the query.
+        :param description: Description of the query, for the log messages.
+        """
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if attempt >= CONF.prometheus.query_retries:
+                    raise
+                delay = CONF.prometheus.query_retry_delay * 2**attempt
+                LOG.warning(
+                    f"Error querying Prometheus for {description}, retrying in "
+                    f"{delay:.1f}s: {e}"
+                )
+                time.sleep(delay)
+                attempt += 1
+
+    def _query_range(self, prom, query, start, end, target, step=None):
+        """Run a range query, retrying it if it fails.
+
+        :param step: Query resolution, in seconds (defaults to the configured
+                     step between samples).
+        """
+        LOG.debug("Querying Prometheus chunk for %s [%s → %s]", target, start, end)
+        return self._retrying(
+            lambda: prom.custom_query_range(
+                query=query,
+                start_time=utils.as_utc(start),
+                end_time=utils.as_utc(end),
+                step=step or CONF.prometheus.prometheus_step_seconds,
+                timeout=CONF.prometheus.query_timeout,
+            ),
+            f"{target} [{start} → {end}]",
+        )
+
+    def _stream_range(self, prom, query, start, end, target, accumulate):
+        """Run a range query, decoding its response as it is received.
+
+        :param accumulate: Function consuming the iterator of the samples of
+                           the response (see :func:`streaming.iter_samples`),
+                           whose result is returned.
+        """
+        session = get_prometheus_session()
+        params = {
+            "query": query,
+            "start": round(utils.utc_timestamp(start)),
+            "end": round(utils.utc_timestamp(end)),
+            "step": CONF.prometheus.prometheus_step_seconds,
+        }
+
+        def run():
+            response = session.get(
+                f"{prom.url}/api/v1/query_range",
+                params=params,
+                headers=prom.headers,
+                auth=prom.auth,
+                timeout=CONF.prometheus.query_timeout,
+                stream=True,
+            )
+            with contextlib.closing(response):
+                if response.status_code != 200:
+                    raise prometheus_api_client.PrometheusApiClientException(
+                        f"HTTP Status Code {response.status_code} "
+                        f"({response.content!r})"
+                    )
+                chunks = response.iter_content(_STREAM_CHUNK_SIZE)
+                return accumulate(streaming.iter_samples(chunks))
+
+        LOG.debug("Streaming Prometheus chunk for %s [%s → %s]", target, start, end)
+        return self._retrying(run, f"{target} [{start} → {end}]")
+
+    def _query_instant(self, prom, query, at, target):
+        """Run an instant query, retrying it if it fails."""
+        return self._retrying(
+            lambda: prom.custom_query(
+                query=query,
+                params={
+                    "time": utils.utc_timestamp(at),
+                    "timeout": f"{CONF.prometheus.query_timeout}s",
+                },
+                timeout=CONF.prometheus.query_timeout,
+            ),
+            f"{target} at {at}",
+        )
+
+    def _build_range_query(self, metric, vm_uuids, batched):
+        """Build the range query getting the power samples of some VMs.
+
+        Batched queries match several VMs, whose series are split by the VM
+        UUID label. The series are not aggregated, as each of them has to be
+        integrated on its own (with its own gaps) before adding them up.
+        """
+        if not batched:
+            label_selector = self._build_label_selector(metric, vm_uuids[0])
+        else:
+            label_selector = self._build_batch_label_selector(metric, vm_uuids)
+        return f"{metric.metric}{{{label_selector}}}"
+
+    def _build_integration_query(self, metric, label_selector, duration):
+        """Build an instant query integrating the energy in Prometheus.
+
+        :param label_selector: Label selector for the VMs to query.
+        :param duration: Duration of the integration period, in seconds.
+        :returns: A tuple with the query and the factor that converts its
+                  results to Wh.
+        """
+        selector = f"{metric.metric}{{{label_selector}}}"
+        step = CONF.prometheus.prometheus_step_seconds
+        if CONF.prometheus.integration_mode == "avg_over_time":
+            inner = f"avg_over_time({selector}[{duration}s])"
+        else:
+            inner = f"sum_over_time({selector}[{duration}s:{step}s])"
+        query = f"sum by ({metric.uuid_label}) ({inner})"
+        return query, self._integration_factor(metric, duration)
+
+    def _integration_factor(self, metric, duration):
+        """Get the factor converting the result of an integration query to Wh."""
+        if CONF.prometheus.integration_mode == "avg_over_time":
+            return duration * metric.scale / 3600 / 1_000_000  # µW → Wh
+        step = CONF.prometheus.prometheus_step_seconds
+        return step * metric.scale / 3600 / 1_000_000  # µW·s → Wh
+
+    def _collect_series(self, metric, results, vm_uuids, batched):
+        """Join the samples of each series returned in the chunks of a query.
+
+        :returns: A dictionary with the list of series (lists of samples sorted
+                  by time) of each VM.
+        """
+        label_name = metric.uuid_label
+        samples = collections.defaultdict(list)
+        for result in results:
+            for series in result:
+                metric = series.get("metric", {})
+                samples[tuple(sorted(metric.items()))].extend(series.get("values", []))
+
+        vm_series: typing.Dict[str, typing.List] = {u: [] for u in vm_uuids}
+        for key, values in samples.items():
+            vm_uuid = dict(key).get(label_name) if batched else vm_uuids[0]
+            if vm_uuid not in vm_series:
+                LOG.warning(f"Got Prometheus series for unexpected VM {vm_uuid}")
+                continue
+            # Chunks may be completed in any order
+            vm_series[vm_uuid].append(sorted(values, key=lambda v: float(v[0])))
+        return vm_series
+
+    def _integrate_energy(self, series, duration, scale=1.0):
+        """Integrate the energy (Wh) of the power series of a VM.
+
+        :param series: List of power series (lists of samples) of the VM.
+        :param duration: Duration of the extraction period, in seconds.
+        :param scale: Factor converting the values of the series to µW.
+        :returns: An Integral with the energy, and the highest coverage ratio of
+                  the series.
+        """
         energy_wh = 0.0
+        coverage = 0.0
+        for samples in series:
+            integral = integration.integrate(
+                samples,
+                CONF.prometheus.prometheus_step_seconds,
+                duration,
+                method=CONF.prometheus.integration_method,
+                max_gap=CONF.prometheus.max_sample_gap,
+            )
+            energy_wh += integral.value * scale / 3600 / 1_000_000  # µW·s → Wh
+            coverage = max(coverage, integral.coverage)
+        return integration.Integral(energy_wh, coverage)
 
-        query = f"{CONF.prometheus.prometheus_metric_name}{{{label_selector}}}"
+    def _integrated_energies(self, metric, result, vm_uuids, factor):
+        """Get the energy of each VM from the result of an integration query."""
+        label_name = metric.uuid_label
+        energies = dict.fromkeys(vm_uuids, 0.0)
+        for series in result:
+            vm_uuid = series.get("metric", {}).get(label_name)
+            if vm_uuid not in energies:
+                LOG.warning(f"Got Prometheus series for unexpected VM {vm_uuid}")
+                continue
+            _, value = series.get("value", (None, 0))
+            energies[vm_uuid] += float(value) * factor
+        # The sample coverage is not known when Prometheus does the integration
+        return {k: integration.Integral(v, None) for k, v in energies.items()}
 
-        for chunk_start, chunk_end in self._split_time_chunks(
-            extract_from, extract_to, CONF.prometheus.prometheus_step_seconds
-        ):
-            LOG.debug(
-                "Querying Prometheus chunk for VM %s [%s → %s]",
-                vm_uuid,
-                chunk_start,
-                chunk_end,
+    def _cache_fingerprint(self, cache, metric):
+        """Get the fingerprint of the settings that the energy depends on."""
+        return energy_cache.fingerprint(
+            {
+                "endpoint": CONF.prometheus.prometheus_endpoint,
+                "metric": metric.metric,
+                "uuid_label": metric.uuid_label,
+                "labels": metric.labels,
+                "scale": metric.scale,
+                "step": CONF.prometheus.prometheus_step_seconds,
+                "mode": CONF.prometheus.integration_mode,
+                "method": CONF.prometheus.integration_method,
+                "max_gap": CONF.prometheus.max_sample_gap,
+                "bucket_size": cache.bucket_size,
+            }
+        )
+
+    def _plan_segments(self, cache, fingerprint, vm_uuid, start, end):
+        """Split the period of a VM in the segments that have to be queried.
+
+        :returns: A tuple with the list of segments to query, and a dictionary
+                  with the buckets of the period that are cached.
+        """
+        if cache is None:
+            return [Segment(start, end, False)], {}
+
+        size = timedelta(seconds=cache.bucket_size)
+        starts = cache.buckets(start, end)
+        cached = cache.get(fingerprint, vm_uuid, starts)
+        segments = []
+        cursor = start
+        for bucket_start in starts:
+            if cursor < bucket_start:
+                segments.append(Segment(cursor, bucket_start, False))
+            if bucket_start not in cached:
+                segments.append(Segment(bucket_start, bucket_start + size, True))
+            cursor = bucket_start + size
+        if cursor < end:
+            segments.append(Segment(cursor, end, False))
+        return segments, cached
+
+    @staticmethod
+    def _merge_segments(segments):
+        """Merge overlapping or contiguous segments into (start, end) ranges."""
+        ranges: typing.List[typing.List] = []
+        for segment in sorted(segments):
+            if ranges and segment.start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], segment.end)
+            else:
+                ranges.append([segment.start, segment.end])
+        return [tuple(r) for r in ranges]
+
+    def _submit_queries(
+        self, executor, prom, metric, vm_uuids, batched, segments, accumulate=None
+    ):
+        """Submit the queries needed to get the energy of some VMs.
+
+        :param segments: Segments of the period to query.
+        :param accumulate: Function integrating the samples of the responses to
+                           raw sample queries as they are received, or None
+                           to get the whole responses.
+        :returns: A list of (key, future) tuples, one per query. The key is the
+                  segment of an instant query, the (start, end) range of a
+                  range query over buckets, or None for raw sample queries.
+        """
+        target = f"{len(vm_uuids)} VMs" if batched else f"VM {vm_uuids[0]}"
+        target = f"{metric.name} of {target}"
+        if CONF.prometheus.integration_mode == "client":
+            query = self._build_range_query(metric, vm_uuids, batched)
+            futures = []
+            for start, end in self._merge_segments(segments):
+                for chunk_start, chunk_end in self._split_time_chunks(
+                    start, end, CONF.prometheus.prometheus_step_seconds
+                ):
+                    if accumulate is None:
+                        future = executor.submit(
+                            self._query_range,
+                            prom,
+                            query,
+                            chunk_start,
+                            chunk_end,
+                            target,
+                        )
+                    else:
+                        future = executor.submit(
+                            self._stream_range,
+                            prom,
+                            query,
+                            chunk_start,
+                            chunk_end,
+                            target,
+                            accumulate,
+                        )
+                    futures.append((None, future))
+            return futures
+
+        if batched:
+            label_selector = self._build_batch_label_selector(metric, vm_uuids)
+        else:
+            label_selector = self._build_label_selector(metric, vm_uuids[0])
+
+        futures = []
+        buckets = []
+        for segment in segments:
+            duration = int((segment.end - segment.start).total_seconds())
+            if segment.bucket:
+                buckets.append(segment)
+            elif duration > 0:
+                query, _ = self._build_integration_query(
+                    metric, label_selector, duration
+                )
+                future = executor.submit(
+                    self._query_instant, prom, query, segment.end, target
+                )
+                futures.append((segment, future))
+
+        # Contiguous buckets are obtained with a single range query, evaluating
+        # the integration over a bucket at the end of each of them.
+        if buckets:
+            size = buckets[0].end - buckets[0].start
+            query, _ = self._build_integration_query(
+                metric, label_selector, int(size.total_seconds())
             )
+            for start, end in self._merge_segments(buckets):
+                future = executor.submit(
+                    self._query_range,
+                    prom,
+                    query,
+                    start + size,
+                    end,
+                    target,
+                    step=int(size.total_seconds()),
+                )
+                futures.append(((start, end), future))
+        return futures
 
-            try:
-                result = prom.custom_query_range(
-                    query=query,
-                    start_time=chunk_start,
-                    end_time=chunk_end,
-                    step=CONF.prometheus.prometheus_step_seconds,
+    def _slice_series(self, series, segment, closed):
+        """Get the samples of some series that belong to a segment.
+
+        :param series: List of (timestamps, samples) tuples.
+        :param closed: Whether the samples at the end of the segment belong to
+                       it (i.e. it is the last segment of the period).
+        """
+        low = utils.utc_timestamp(segment.start)
+        high = utils.utc_timestamp(segment.end)
+        sliced = []
+        for times, samples in series:
+            first = bisect.bisect_left(times, low)
+            if closed:
+                last = bisect.bisect_right(times, high)
+            else:
+                last = bisect.bisect_left(times, high)
+            if first < last:
+                sliced.append(samples[first:last])
+        return sliced
+
+    def _client_parts(self, metric, results, vm_uuids, batched, segments, windows):
+        """Integrate the raw samples of each segment of some VMs.
+
+        :returns: A dictionary with the Bucket of each segment of each VM.
+        """
+        vm_series = self._collect_series(metric, results, vm_uuids, batched)
+        parts = {}
+        for vm_uuid, series in vm_series.items():
+            series = [([float(t) for t, _ in s], s) for s in series]
+            _, vm_end = windows[vm_uuid]
+            parts[vm_uuid] = {}
+            for segment in segments[vm_uuid]:
+                duration = (segment.end - segment.start).total_seconds()
+                sliced = self._slice_series(series, segment, segment.end == vm_end)
+                integral = self._integrate_energy(sliced, duration, scale=metric.scale)
+                parts[vm_uuid][segment] = energy_cache.Bucket(
+                    integral.value, integral.coverage * duration
                 )
+        return parts
+
+    def _accumulate_samples(
+        self, samples, metric, vm_uuids, batched, segments, windows
+    ):
+        """Integrate the samples of a streamed response as they are decoded.
+
+        :param samples: Iterator of (metric, timestamp, value) samples.
+        :returns: A dictionary with the Partial integral of each series of each
+                  segment of the VMs, keyed by (VM, series labels, segment).
+        """
+        label_name = metric.uuid_label
+        step = CONF.prometheus.prometheus_step_seconds
+        bounds = {}
+        for vm_uuid in vm_uuids:
+            vm_segments = sorted(segments[vm_uuid])
+            bounds[vm_uuid] = (
+                [utils.utc_timestamp(segment.start) for segment in vm_segments],
+                vm_segments,
+                windows[vm_uuid][1],
+            )
+
+        accumulators = {}
+        unexpected = set()
+        series = None
+        for sample_metric, timestamp, value in samples:
+            if sample_metric is not series:
+                series = sample_metric
+                labels = tuple(sorted(series.items()))
+                vm_uuid = series.get(label_name) if batched else vm_uuids[0]
+            if vm_uuid not in bounds:
+                if vm_uuid not in unexpected:
+                    LOG.warning(f"Got Prometheus series for unexpected VM {vm_uuid}")
+                    unexpected.add(vm_uuid)
+                continue
+
+            starts, vm_segments, vm_end = bounds[vm_uuid]
+            index = bisect.bisect_right(starts, timestamp) - 1
+            if index < 0:
+                continue
+            segment = vm_segments[index]
+            end = utils.utc_timestamp(segment.end)
+            if timestamp > end or (timestamp == end and segment.end != vm_end):
+                continue
+
+            key = (vm_uuid, labels, segment)
+            accumulator = accumulators.get(key)
+            if accumulator is None:
+                accumulator = integration.Accumulator(
+                    step,
+                    method=CONF.prometheus.integration_method,
+                    max_gap=CONF.prometheus.max_sample_gap,
+                )
+                accumulators[key] = accumulator
+            accumulator.add(timestamp, value)
+        return {key: acc.partial() for key, acc in accumulators.items()}
+
+    def _merge_parts(self, metric, results, vm_uuids, segments):
+        """Join the partial integrals of the streamed responses of some VMs.
+
+        :returns: A dictionary with the Bucket of each segment of each VM.
+        """
+        partials = collections.defaultdict(list)
+        for result in results:
+            for key, partial in result.items():
+                partials[key].append(partial)
+
+        series = collections.defaultdict(list)
+        for (vm_uuid, _, segment), runs in partials.items():
+            series[(vm_uuid, segment)].append(runs)
+
+        parts = {}
+        for vm_uuid in vm_uuids:
+            parts[vm_uuid] = {}
+            for segment in segments[vm_uuid]:
+                duration = (segment.end - segment.start).total_seconds()
+                energy_wh = 0.0
+                coverage = 0.0
+                for runs in series.get((vm_uuid, segment), []):
+                    integral = integration.merge(
+                        runs,
+                        CONF.prometheus.prometheus_step_seconds,
+                        duration,
+                        method=CONF.prometheus.integration_method,
+                        max_gap=CONF.prometheus.max_sample_gap,
+                    )
+                    # µW·s → Wh
+                    energy_wh += integral.value * metric.scale / 3600 / 1_000_000
+                    coverage = max(coverage, integral.coverage)
+                parts[vm_uuid][segment] = energy_cache.Bucket(
+                    energy_wh, coverage * duration
+                )
+        return parts
+
+    def _server_parts(self, metric, results, vm_uuids, segments):
+        """Get the energy of each segment of some VMs from integration queries.
+
+        :returns: A dictionary with the Bucket of each segment of each VM.
+        """
+        label_name = metric.uuid_label
+        values: typing.Dict[str, typing.Dict] = {u: {} for u in vm_uuids}
+        for key, result in results:
+            if isinstance(key, Segment):
+                duration = int((key.end - key.start).total_seconds())
+                factor = self._integration_factor(metric, duration)
+                for vm_uuid, energy in self._integrated_energies(
+                    metric, result, vm_uuids, factor
+                ).items():
+                    values[vm_uuid][key] = energy.value
+                continue
+
+            # Range query over buckets, with a value at the end of each one
+            buckets = {
+                utils.utc_timestamp(segment.end): segment
+                for vm_uuid in vm_uuids
+                for segment in segments[vm_uuid]
+                if segment.bucket and key[0] <= segment.start < key[1]
+            }
+            if not buckets:
+                continue
+            first = next(iter(buckets.values()))
+            factor = self._integration_factor(
+                metric, int((first.end - first.start).total_seconds())
+            )
+            for series in result:
+                vm_uuid = series.get("metric", {}).get(label_name)
+                if vm_uuid not in values:
+                    LOG.warning(f"Got Prometheus series for unexpected VM {vm_uuid}")
+                    continue
+                for t, value in series.get("values", []):
+                    segment = buckets.get(float(t))
+                    if segment is not None:
+                        energy = values[vm_uuid].get(segment, 0.0)
+                        values[vm_uuid][segment] = energy + float(value) * factor
+
+        # The sample coverage is not known when Prometheus does the integration
+        return {
+            vm_uuid: {
+                segment: energy_cache.Bucket(values[vm_uuid].get(segment, 0.0), None)
+                for segment in segments[vm_uuid]
+            }
+            for vm_uuid in vm_uuids
+        }
+
+    def _gather_energies(self, metric, futures, vm_uuids, batched, segments, windows):
+        """Get the energy of each segment of some VMs from their queries.
+
+        :param segments: Dictionary with the segments queried for each VM.
+        :param windows: Dictionary with the period of each VM.
+        :returns: A dictionary with the Bucket of each segment of each VM, or
+                  None for the VMs whose queries failed.
+        """
+        results = []
+        for key, future in futures:
+            try:
+                results.append((key, future.result()))
             except Exception as e:
                 LOG.error(
-                    "Error querying Prometheus for chunk [%s → %s]: %s",
-                    chunk_start,
-                    chunk_end,
+                    "Error querying Prometheus %s for %s: %s",
+                    metric.name,
+                    ", ".join(vm_uuids),
                     e,
                 )
-                continue
+                return dict.fromkeys(vm_uuids)
 
-            for series in result:
-                for _, value in series.get("values", []):
-                    energy_wh += float(value) * factor
+        if CONF.prometheus.integration_mode != "client":
+            return self._server_parts(metric, results, vm_uuids, segments)
+        results = [result for _, result in results]
+        if CONF.prometheus.stream_responses:
+            return self._merge_parts(metric, results, vm_uuids, segments)
+        return self._client_parts(metric, results, vm_uuids, batched, segments, windows)
 
-        LOG.debug(f"VM {vm_uuid} total energy consumed: {energy_wh:.4f} Wh")
-        return energy_wh
+    def _get_energies(self, servers, windows):
+        """Get the energy (Wh) consumed by each of the servers, per metric.
 
-    def _build_energy_record(self, server, energy_value, extract_from, extract_to):
-        """Build an EnergyRecord for a VM."""
+        Each VM is only queried for the part of the extraction period during
+        which it existed. If the energy cache is enabled, the buckets of that
+        period that are cached are not queried, and the buckets that are
+        obtained are stored in the cache. The queries for all the metrics, VMs
+        (or batches of VMs) and time chunks are run concurrently, with at most
+        max_concurrent_queries queries in flight.
+
+        :param servers: List of servers, sorted by creation date.
+        :param windows: Dictionary with the period to query for each server.
+
+        :returns: A dictionary with the energy consumed by each VM, as a
+                  dictionary with an Integral of the energy of each metric,
+                  along with its sample coverage ratio (if known), or None if
+                  the energy could not be obtained for any of the metrics.
+        """
+        batch_size = CONF.prometheus.vm_batch_size
+        batched = batch_size > 1
+        vm_uuids = [str(server.id) for server in servers]
+        batches = []
+        for start in range(0, len(vm_uuids), batch_size):
+            end = start + batch_size
+            batches.append(vm_uuids[start:end])
+
+        metrics = self._get_metrics()
+        cache = energy_cache.get_cache()
+        fingerprints = {}
+        segments: typing.Dict[str, typing.Dict] = {}
+        cached: typing.Dict[str, typing.Dict] = {}
+        for metric in metrics:
+            fingerprint = self._cache_fingerprint(cache, metric) if cache else None
+            fingerprints[metric.name] = fingerprint
+            segments[metric.name] = {}
+            cached[metric.name] = {}
+            for vm_uuid in vm_uuids:
+                (
+                    segments[metric.name][vm_uuid],
+                    cached[metric.name][vm_uuid],
+                ) = self._plan_segments(cache, fingerprint, vm_uuid, *windows[vm_uuid])
+
+        prom = self._get_prometheus_client()
+        parts: typing.Dict[str, typing.Dict] = {m.name: {} for m in metrics}
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=CONF.prometheus.max_concurrent_queries
+        ) as executor:
+            pending = []
+            for batch in batches:
+                for metric in metrics:
+                    metric_segments = segments[metric.name]
+                    batch_segments = {s for u in batch for s in metric_segments[u]}
+                    if not batch_segments:
+                        LOG.debug(
+                            f"Energy consumption ({metric.name}) for "
+                            f"{', '.join(batch)} is cached"
+                        )
+                        parts[metric.name].update({u: {} for u in batch})
+                        continue
+                    LOG.debug(
+                        f"Querying energy consumption ({metric.name}) for "
+                        f"{', '.join(batch)} ({len(batch_segments)} segments)"
+                    )
+                    accumulate = None
+                    if CONF.prometheus.stream_responses:
+                        accumulate = functools.partial(
+                            self._accumulate_samples,
+                            metric=metric,
+                            vm_uuids=batch,
+                            batched=batched,
+                            segments=metric_segments,
+                            windows=windows,
+                        )
+                    futures = self._submit_queries(
+                        executor,
+                        prom,
+                        metric,
+                        batch,
+                        batched,
+                        sorted(batch_segments),
+                        accumulate=accumulate,
+                    )
+                    pending.append((metric, batch, futures))
+
+            for metric, batch, futures in pending:
+                parts[metric.name].update(
+                    self._gather_energies(
+                        metric, futures, batch, batched, segments[metric.name], windows
+                    )
+                )
+
+        energies: typing.Dict[str, typing.Optional[typing.Dict]] = {}
+        for vm_uuid in vm_uuids:
+            vm_start, vm_end = windows[vm_uuid]
+            energies[vm_uuid] = {}
+            for metric in metrics:
+                vm_parts = parts[metric.name][vm_uuid]
+                if vm_parts is None:
+                    energies[vm_uuid] = None
+                    continue
+                vm_cached = cached[metric.name][vm_uuid]
+                if cache is not None:
+                    cache.store(
+                        fingerprints[metric.name],
+                        vm_uuid,
+                        {s.start: b for s, b in vm_parts.items() if s.bucket},
+                    )
+                energy = self._combine_buckets(
+                    list(vm_parts.values()) + list(vm_cached.values()),
+                    (vm_end - vm_start).total_seconds(),
+                )
+                if energies[vm_uuid] is not None:
+                    energies[vm_uuid][metric.name] = energy
+                coverage = energy.coverage
+                LOG.debug(
+                    f"VM {vm_uuid} energy consumed ({metric.name}): "
+                    f"{energy.value:.4f} Wh (coverage "
+                    f"{'unknown' if coverage is None else format(coverage, '.0%')}, "
+                    f"{len(vm_cached)} cached buckets)"
+                )
+        return energies
+
+    @staticmethod
+    def _combine_buckets(buckets, duration):
+        """Add up the energy of the buckets of a VM.
+
+        :returns: An Integral with the energy and the coverage ratio of the
+                  period, or None if it is not known for any of the buckets.
+        """
+        energy = sum(b.energy for b in buckets)
+        if any(b.covered is None for b in buckets):
+            return integration.Integral(energy, None)
+        covered = sum(b.covered for b in buckets)
+        if duration <= 0:
+            return integration.Integral(energy, 1.0 if covered > 0 else 0.0)
+        return integration.Integral(energy, min(1.0, covered / duration))
+
+    def _build_energy_record(
+        self, server, energy_value, extract_from, extract_to, energy_by_metric=None
+    ):
+        """Build an EnergyRecord for a VM.
+
+        :param energy_by_metric: Dictionary with the energy (Wh) obtained from
+                                 each metric, if several metrics are configured.
+        """
         vm_uuid = str(server.id)
         vm_status = server.status.lower()
 
@@ -219,6 +1180,11 @@ class EnergyConsumptionExtractor(base.BaseOpenStackExtractor):
         # Apply CPU normalization factor to energy value
         cpu_normalization_factor = CONF.prometheus.cpu_normalization_factor
         energy_wh = energy_value * cpu_normalization_factor
+        if energy_by_metric is not None:
+            energy_by_metric = {
+                name: value * cpu_normalization_factor
+                for name, value in energy_by_metric.items()
+            }
 
         # Work is defined as CPU time (in seconds) per Wh of energy consumed,
         # which gives an indication of how much CPU time
@@ -238,6 +1204,7 @@ class EnergyConsumptionExtractor(base.BaseOpenStackExtractor):
             start_exec_time=start_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
             end_exec_time=end_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
             energy_wh=energy_wh,
+            energy_wh_by_metric=energy_by_metric,
             work=work,
             efficiency=efficiency,
             wall_clock_time_s=wall_clock_time_s,
@@ -257,6 +1224,8 @@ class EnergyConsumptionExtractor(base.BaseOpenStackExtractor):
         :param extract_from: Start of the extraction period (datetime)
         :param extract_to: End of the extraction period (datetime)
         :return: List of EnergyRecord objects with energy consumption data for each VM
+        :raises caso.exception.IncompleteExtractionError: if the energy of some
+            VMs could not be obtained, with the records of the other VMs.
         """
         extract_from = extract_from.replace(tzinfo=None)
         extract_to = extract_to.replace(tzinfo=None)
@@ -264,23 +1233,42 @@ class EnergyConsumptionExtractor(base.BaseOpenStackExtractor):
         records = []
 
         LOG.debug(f"Getting servers for project {self.project}")
-        servers = self._get_servers()
+        servers, windows = self._get_servers(extract_from, extract_to)
         LOG.info(
             f"Found {len(servers)} VMs for project {self.project}, querying Prometheus"
         )
 
+        energies = self._get_energies(servers, windows)
+
+        failed = 0
         for server in servers:
             vm_uuid = str(server.id)
             vm_name = server.name
-            LOG.debug(f"Querying energy consumption for VM {vm_name} ({vm_uuid})")
 
-            energy_value = self._energy_consumed_wh(vm_uuid, extract_from, extract_to)
+            energy = energies.get(vm_uuid)
+            if energy is None:
+                LOG.error(
+                    f"Could not get energy data for VM {vm_name} ({vm_uuid}), "
+                    "skipping"
+                )
+                failed += 1
+                continue
+
+            energy_value = sum(integral.value for integral in energy.values())
             if energy_value <= 0:
                 LOG.debug(f"No energy data for VM {vm_name} ({vm_uuid}), skipping")
                 continue
 
+            # The contribution of each metric is only reported when several
+            # metrics are configured
+            energy_by_metric = None
+            if CONF.prometheus.metrics:
+                energy_by_metric = {k: v.value for k, v in energy.items()}
+
+            # The VM is only queried while it existed, but its record covers
+            # the extraction period, as the records of the other extractors
             energy_record = self._build_energy_record(
-                server, energy_value, extract_from, extract_to
+                server, energy_value, extract_from, extract_to, energy_by_metric
             )
             if energy_record is None:
                 continue
@@ -292,4 +1280,6 @@ class EnergyConsumptionExtractor(base.BaseOpenStackExtractor):
             records.append(energy_record)
 
         LOG.info(f"Extracted {len(records)} energy records for project {self.project}")
+        if failed:
+            raise exception.IncompleteExtractionError(failed=failed, records=records)
         return records
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing a streaming decoder of Prometheus range query responses.
+
+The responses to range queries (``matrix`` results) are decoded as they are
+received, yielding their samples one by one, instead of materialising the whole
+JSON document as nested Python lists. Only the part of the response that has
+not been decoded yet is kept in memory, so the memory used does not depend on
+the size of the response.
+"""
+
+import codecs
+import json
+import re
+
+# A [timestamp, "value"] sample, as encoded by Prometheus
+_SAMPLE = re.compile(r'\[\s*(-?[0-9][0-9.eE+-]*)\s*,\s*"([^"\\]*)"\s*\]')
+# Longest sample that is matched with the regular expression above, longer
+# ones are decoded as generic JSON values.
+_MAX_SAMPLE = 128
+_WHITESPACE = " \t\n\r"
+
+
+class _Reader(object):
+    """Incremental reader of a JSON document received in chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read the next chunk, dropping the part of the buffer already read."""
+        if self.eof:
+            return False
+        try:
+            chunk = self._decoder.decode(next(self._chunks))
+        except StopIteration:
+            chunk = self._decoder.decode(b"", final=True)
+            self.eof = True
+        pos = self.pos
+        self.buf = self.buf[pos:] + chunk
+        self.pos = 0
+        return True
+
+    def ensure(self, size):
+        """Read chunks until there are size characters to read, or the end."""
+        while len(self.buf) - self.pos < size and self.fill():
+            pass
+
+    def peek(self):
+        """Get the next non whitespace character, without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of Prometheus response")
+
+    def next(self):
+        """Consume the next non whitespace character."""
+        char = self.peek()
+        self.pos += 1
+        return char
+
+    def expect(self, char):
+        """Consume the next non whitespace character, checking it."""
+        found = self.next()
+        if found != char:
+            raise ValueError(
+                f"Invalid Prometheus response, expected '{char}' but got '{found}'"
+            )
+
+    def value(self):
+        """Decode the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def keys(self):
+        """Iterate over the keys of an object, after its opening brace.
+
+        The value of each key must be consumed before getting the next key.
+        """
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            char = self.next()
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError(f"Invalid Prometheus response, unexpected '{char}'")
+
+    def items(self):
+        """Iterate over the items of an array, after its opening bracket.
+
+        Each item must be consumed before getting the next one.
+        """
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.next()
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Invalid Prometheus response, unexpected '{char}'")
+
+    def sample(self):
+        """Decode the next [timestamp, "value"] sample."""
+        self.peek()
+        self.ensure(_MAX_SAMPLE)
+        match = _SAMPLE.match(self.buf, self.pos)
+        if match is None:
+            timestamp, value = self.value()
+        else:
+            timestamp, value = match.groups()
+            self.pos = match.end()
+        return float(timestamp), float(value)
+
+
+def _iter_series(reader):
+    """Iterate over the samples of the series of a matrix result."""
+    reader.expect("[")
+    for _ in reader.items():
+        reader.expect("{")
+        metric = None
+        pending = []
+        for key in reader.keys():
+            if key == "metric":
+                metric = reader.value()
+                for timestamp, value in pending:
+                    yield metric, timestamp, value
+                pending = []
+            elif key == "values":
+                reader.expect("[")
+                for _ in reader.items():
+                    sample = reader.sample()
+                    if metric is None:
+                        # Samples are kept until the labels are known
+                        pending.append(sample)
+                    else:
+                        yield (metric,) + sample
+            else:
+                reader.value()
+        for timestamp, value in pending:
+            yield {}, timestamp, value
+
+
+def iter_samples(chunks):
+    """Iterate over the samples of a Prometheus range query response.
+
+    :param chunks: Iterable with the chunks (bytes) of the response body.
+    :returns: An iterator of ``(metric, timestamp, value)`` tuples, where
+              ``metric`` is the dictionary with the labels of the series, and
+              the samples of each series are in time order.
+    :raises ValueError: If the response cannot be decoded, or it is not
+                        successful.
+    """
+    reader = _Reader(chunks)
+    reader.expect("{")
+    for key in reader.keys():
+        if key == "data":
+            reader.expect("{")
+            for data_key in reader.keys():
+                if data_key == "result":
+                    yield from _iter_series(reader)
+                else:
+                    reader.value()
+        elif key == "status":
+            status = reader.value()
+            if status != "success":
+                raise ValueError(f"Prometheus query failed with status '{status}'")
+        else:
+            reader.value()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing the shared HTTP connection pool used by cASO.
+
+All the HTTP sessions created by cASO during a run share a single
+``requests.Session`` (and therefore a single set of connection pools), so that
+connections and TLS sessions to the OpenStack APIs are reused across projects
+and extractors instead of being established again for every client.
+"""
+
+import collections
+import socket
+import threading
+import typing
+
+import requests
+import requests.adapters
+import urllib3.connection
+import urllib3.connectionpool
+import urllib3.util
+from oslo_config import cfg
+from oslo_log import log
+
+opts = [
+    cfg.IntOpt(
+        "pool_connections",
+        default=10,
+        min=1,
+        help="Number of per-host connection pools to keep. This should be at "
+        "least the number of different API endpoints that cASO talks to.",
+    ),
+    cfg.IntOpt(
+        "pool_maxsize",
+        default=10,
+        min=1,
+        help="Maximum number of connections to keep open in each per-host "
+        "connection pool.",
+    ),
+    cfg.BoolOpt(
+        "tcp_keepalive",
+        default=True,
+        help="Enable TCP keep-alive on the pooled connections, so that idle "
+        "connections are kept open between requests.",
+    ),
+    cfg.IntOpt(
+        "tcp_keepalive_idle",
+        default=60,
+        min=1,
+        help="Seconds a connection must be idle before TCP keep-alive probes "
+        "are sent.",
+    ),
+    cfg.IntOpt(
+        "tcp_keepalive_interval",
+        default=15,
+        min=1,
+        help="Seconds between TCP keep-alive probes.",
+    ),
+    cfg.IntOpt(
+        "tcp_keepalive_count",
+        default=4,
+        min=1,
+        help="Number of unanswered TCP keep-alive probes before the "
+        "connection is dropped.",
+    ),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group="http")
+
+LOG = log.getLogger(__name__)
+
+
+class ConnectionStats(object):
+    """Thread safe per-endpoint counters for the shared connection pool."""
+
+    def __init__(self):
+        """Initialize empty counters."""
+        self._lock = threading.Lock()
+        self._stats: typing.Dict[str, typing.Dict[str, int]] = collections.defaultdict(
+            lambda: {"requests": 0, "connections": 0, "tls_handshakes": 0}
+        )
+
+    def _incr(self, endpoint, key):
+        with self._lock:
+            self._stats[endpoint][key] += 1
+
+    def record_request(self, endpoint):
+        """Account a request sent to an endpoint."""
+        self._incr(endpoint, "requests")
+
+    def record_connection(self, endpoint, tls=False):
+        """Account a new connection (and TLS handshake) to an endpoint."""
+        self._incr(endpoint, "connections")
+        if tls:
+            self._incr(endpoint, "tls_handshakes")
+
+    def get(self):
+        """Get a copy of the counters, as a dictionary keyed by endpoint."""
+        with self._lock:
+            return {k: dict(v) for k, v in self._stats.items()}
+
+    def reset(self):
+        """Reset all the counters."""
+        with self._lock:
+            self._stats.clear()
+
+
+STATS = ConnectionStats()
+
+
+def _endpoint(host, port):
+    return f"{host}:{port}"
+
+
+class _CountingHTTPConnection(urllib3.connection.HTTPConnection):
+    def connect(self):
+        super(_CountingHTTPConnection, self).connect()
+        STATS.record_connection(_endpoint(self.host, self.port))
+
+
+class _CountingHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def connect(self):
+        super(_CountingHTTPSConnection, self).connect()
+        STATS.record_connection(_endpoint(self.host, self.port), tls=True)
+
+
+class _CountingHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+def _socket_options():
+    """Get the socket options to use for the pooled connections."""
+    socket_options = list(urllib3.connection.HTTPConnection.default_socket_options)
+    if not CONF.http.tcp_keepalive:
+        return socket_options
+
+    socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # Not all the platforms support tuning the keep-alive parameters
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        socket_options.append(
+            (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, CONF.http.tcp_keepalive_idle)
+        )
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        socket_options.append(
+            (
+                socket.IPPROTO_TCP,
+                socket.TCP_KEEPINTVL,
+                CONF.http.tcp_keepalive_interval,
+            )
+        )
+    if hasattr(socket, "TCP_KEEPCNT"):
+        socket_options.append(
+            (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, CONF.http.tcp_keepalive_count)
+        )
+    return socket_options
+
+
+class PooledHTTPAdapter(requests.adapters.HTTPAdapter):
+    """HTTP adapter with keep-alive tuning and per-endpoint accounting."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Initialize the pool manager, using our counting connection pools."""
+        kwargs.setdefault("socket_options", _socket_options())
+        super(PooledHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs):
+        """Send a request, accounting it for its endpoint."""
+        parsed = urllib3.util.parse_url(request.url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        STATS.record_request(_endpoint(parsed.host, port))
+        return super(PooledHTTPAdapter, self).send(request, *args, **kwargs)
+
+
+def get_adapter(**kwargs):
+    """Get a new pooled HTTP adapter with the configured pool sizes."""
+    kwargs.setdefault("pool_connections", CONF.http.pool_connections)
+    kwargs.setdefault("pool_maxsize", CONF.http.pool_maxsize)
+    return PooledHTTPAdapter(**kwargs)
+
+
+_SESSION: typing.Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
+
+def create_session():
+    """Create a new ``requests.Session`` using a pooled HTTP adapter."""
+    session = requests.Session()
+    adapter = get_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """Get the ``requests.Session`` shared by all the cASO HTTP clients."""
+    global _SESSION
+
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = create_session()
+        return _SESSION
+
+
+def close_session():
+    """Close the shared session, dropping all the pooled connections."""
+    global _SESSION
+
+    with _SESSION_LOCK:
+        if _SESSION is not None:
+            _SESSION.close()
+            _SESSION = None
+
+
+def get_stats():
+    """Get the per-endpoint connection statistics for the shared pool."""
+    return STATS.get()
+
+
+def log_stats():
+    """Log the per-endpoint connection statistics for the shared pool."""
+    for endpoint, stats in sorted(get_stats().items()):
+        LOG.info(
+            f"HTTP endpoint {endpoint}: {stats['requests']} requests over "
+            f"{stats['connections']} connections "
+            f"({stats['tls_handshakes']} TLS handshakes)"
+        )
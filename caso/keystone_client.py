@@ -16,13 +16,28 @@
 
 """Module containing the management of Keystone Clients for cASO."""
 
+import time
+import typing
+import urllib.parse
+
 from keystoneauth1 import exceptions
 from keystoneauth1 import loading
+from keystoneauth1.loading import session as session_loading
+from keystoneauth1 import session as ks_session
 from keystoneclient.v3 import client as ks_client_v3
 from oslo_config import cfg
+from oslo_log import log
+
+from caso import circuit_breaker
+from caso import discovery_cache
+from caso import http_pool
+from caso import ratelimit
+from caso import response_cache
 
 CONF = cfg.CONF
 
+LOG = log.getLogger(__name__)
+
 CFG_GROUP = "keystone_auth"
 
 loading.register_auth_conf_options(CONF, CFG_GROUP)
@@ -34,6 +49,146 @@ opts += loading.get_session_conf_options()
 opts += loading.get_auth_plugin_conf_options("password")
 
 
+def _get_service_type(url, endpoint_filter):
+    """Get the service type (or endpoint, if unknown) a request is sent to."""
+    service_type = (endpoint_filter or {}).get("service_type")
+    if service_type:
+        return service_type
+    # Requests to absolute URLs (i.e. authentication and version discovery) do not
+    # carry a service type, so we limit them per endpoint
+    return urllib.parse.urlparse(url).netloc or "unknown"
+
+
+class Session(ks_session.Session):
+    """A keystoneauth session with per-service limits, retries and breakers.
+
+    Requests are sent through the limiter of the service they target. Requests
+    answered with HTTP 429 or 503 make the service limiter back off (honouring
+    the Retry-After header) and are retried. Requests failing with connection
+    errors, timeouts or other server errors are retried with jitter, and
+    accounted in the circuit breaker of the service once the retries are
+    exhausted. Each failure is only retried by one of the two, so that the
+    number of requests sent for a request is bounded by the larger of both
+    retry limits.
+
+    Requests listing slowly changing catalogues are served from the response
+    cache when possible.
+    """
+
+    def request(self, url, method, **kwargs):
+        """Send a request, limiting its rate and retrying it on failures.
+
+        :raises caso.exception.CircuitOpenError: if the endpoint has failed too
+                                                 many times during this run.
+        """
+        if response_cache.is_cacheable(url, method):
+            return self._cached_request(url, method, **kwargs)
+        return self._retried_request(url, method, **kwargs)
+
+    def _cached_request(self, url, method, **kwargs):
+        """Send a catalogue request, serving or revalidating a cached response."""
+        cache = response_cache.get_cache()
+        project_id = self.get_project_id() if self.auth else None
+        key = cache.make_key(url, project_id, **kwargs)
+
+        resp = cache.get_fresh(key)
+        if resp is not None:
+            return resp
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.update(cache.conditional_headers(key))
+        resp = self._retried_request(url, method, headers=headers, **kwargs)
+        if resp.status_code == 304:
+            cached = cache.not_modified(key, resp.request)
+            if cached is not None:
+                return cached
+        elif resp.status_code == 200:
+            cache.store(key, resp)
+        return resp
+
+    def _retried_request(self, url, method, **kwargs):
+        """Send a request, retrying it on failures."""
+        service_type = _get_service_type(url, kwargs.get("endpoint_filter"))
+        breaker = circuit_breaker.get_breaker(service_type)
+        breaker.check()
+
+        attempt = 0
+        while True:
+            try:
+                resp = self._limited_request(service_type, url, method, **kwargs)
+            except (exceptions.ConnectionError, exceptions.HttpServerError) as e:
+                failure: typing.Optional[Exception] = e
+                resp = None
+            else:
+                failure = None
+                if resp.status_code < 500:
+                    breaker.record_success()
+                    return resp
+
+            # Throttled requests (HTTP 503) were already retried by the limiter
+            status = resp.status_code if resp is not None else None
+            status = getattr(failure, "http_status", status)
+            throttled = status in ratelimit.THROTTLE_STATUS_CODES
+            if throttled or attempt >= CONF.circuit_breaker.retries:
+                breaker.record_failure()
+                if failure is not None:
+                    raise failure
+                return resp
+
+            delay = circuit_breaker.retry_delay(attempt)
+            LOG.warning(
+                f"Request {method} {url} to '{service_type}' failed "
+                f"({failure or f'HTTP {resp.status_code}'}), retrying in "
+                f"{delay:.1f}s"
+            )
+            time.sleep(delay)
+            attempt += 1
+
+    def _limited_request(self, service_type, url, method, **kwargs):
+        """Send a request through the limiter of its service."""
+        limiter = ratelimit.get_limiter(service_type)
+        kwargs.setdefault("rate_semaphore", limiter)
+        raise_exc = kwargs.pop("raise_exc", True)
+
+        attempt = 0
+        while True:
+            resp = super(Session, self).request(url, method, raise_exc=False, **kwargs)
+            if resp.status_code not in ratelimit.THROTTLE_STATUS_CODES:
+                limiter.succeeded()
+                break
+            if attempt >= CONF.rate_limit.max_retries:
+                LOG.warning(
+                    f"Giving up after {attempt} retries of throttled request "
+                    f"{method} {resp.url} (HTTP {resp.status_code})"
+                )
+                break
+            limiter.throttled(resp.headers.get("Retry-After"), attempt=attempt)
+            attempt += 1
+
+        if raise_exc and resp.status_code >= 400:
+            raise exceptions.from_response(resp, method, url)
+        return resp
+
+
+class _SessionLoader(session_loading.Session):
+    """Session loader that builds our own rate limited sessions."""
+
+    @property
+    def plugin_class(self):
+        return Session
+
+
+def _load_session(conf, auth_plugin):
+    """Load a session for an auth plugin, using the shared pool and caches."""
+    return _SessionLoader().load_from_conf_options(
+        conf,
+        CFG_GROUP,
+        auth=auth_plugin,
+        session=http_pool.get_session(),
+        discovery_cache=discovery_cache.get_cache(),
+    )
+
+
 def get_session(conf, project, system_scope=None):
     """Get an auth session."""
     # First try using project_id
@@ -42,7 +197,7 @@ def get_session(conf, project, system_scope=None):
     auth_plugin = loading.load_auth_from_conf_options(
         conf, CFG_GROUP, project_id=project, system_scope=system_scope
     )
-    sess = loading.load_session_from_conf_options(conf, CFG_GROUP, auth=auth_plugin)
+    sess = _load_session(conf, auth_plugin)
     try:
         sess.get_token()
     except exceptions.Unauthorized:
@@ -50,7 +205,7 @@ def get_session(conf, project, system_scope=None):
         auth_plugin = loading.load_auth_from_conf_options(
             conf, CFG_GROUP, project_name=project, project_id=None
         )
-        sess = loading.load_session_from_conf_options(conf, CFG_GROUP, auth=auth_plugin)
+        sess = _load_session(conf, auth_plugin)
     return sess
 
 
@@ -26,6 +26,7 @@ from oslo_log import log
 import caso.extract.manager
 from caso import loading
 import caso.messenger
+from caso import spool
 from caso import utils
 
 opts = [
@@ -58,6 +59,20 @@ cli_opts = [
         help="Extract records but do not push records to SSM. This "
         "will not update the last run date.",
     ),
+    cfg.BoolOpt(
+        "checkpoint",
+        default=False,
+        help="Store the extracted records in a binary spool file in the spool "
+        "directory (records.spool) before pushing them, so that they can be "
+        "pushed again later with the replay option.",
+    ),
+    cfg.StrOpt(
+        "replay",
+        help="Push the records stored in this spool file (see the checkpoint "
+        "option) instead of extracting them from OpenStack, even if they were "
+        "already delivered (see the delivery_index section). This will not "
+        "update the last run date.",
+    ),
 ]
 
 CONF = cfg.CONF
@@ -67,6 +82,8 @@ CONF.register_cli_opts(cli_opts)
 
 LOG = log.getLogger(__name__)
 
+CHECKPOINT_FILE = "records.spool"
+
 
 class Manager(object):
     """cASO manager class to deal with the main functionality."""
@@ -107,17 +124,31 @@ class Manager(object):
 
         This method runs the main cASo functionality, namely:
             - Gets the global lock
-            - Gets all records from the configured extractors
+            - Gets all records from the configured extractors (or from the spool
+              file to replay), storing them in a spool file if requested
             - Pushes all the records to the messengers
         """
-        self._load_managers()
+        if CONF.replay:
+            # Do not load the extractors, as OpenStack is not contacted
+            self.messenger = caso.messenger.Manager()
+        else:
+            self._load_managers()
 
         @lockutils.synchronized(
             "caso_should_not_run_in_parallel", lock_path=self.lock_path, external=True
         )
         def synchronized():
-            records = self.extractor_manager.get_records()
+            if CONF.replay:
+                records = spool.read(CONF.replay)
+                LOG.info(f"Replaying {len(records)} records from '{CONF.replay}'")
+            else:
+                records = self.extractor_manager.get_records()
+                if CONF.checkpoint:
+                    path = os.path.join(CONF.spooldir, CHECKPOINT_FILE)
+                    count = spool.write(path, records)
+                    LOG.info(f"Stored {count} records in '{path}'")
             if not CONF.dry_run:
-                self.messenger.push_to_all(records)
+                # Replayed records are pushed again even if they were delivered
+                self.messenger.push_to_all(records, skip_delivered=not CONF.replay)
 
         return synchronized()
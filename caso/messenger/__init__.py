@@ -23,8 +23,9 @@ from oslo_config import cfg
 from oslo_log import log
 import six
 
-import caso.record
+import caso.record_batch
 from caso import loading
+from caso.messenger import delivery_index
 
 CONF = cfg.CONF
 
@@ -81,44 +82,46 @@ def register_messenger_opts(messenger_names: typing.Optional[typing.List[str]] =
 
 
 # Mapping from record type names to record classes
-RECORD_TYPE_MAP: typing.Dict[str, type] = {
-    "cloud": caso.record.CloudRecord,
-    "ip": caso.record.IPRecord,
-    "accelerator": caso.record.AcceleratorRecord,
-    "storage": caso.record.StorageRecord,
-    "energy": caso.record.EnergyRecord,
-}
+RECORD_TYPE_MAP: typing.Dict[str, type] = caso.record_batch.RECORD_TYPES
 
 
 @six.add_metaclass(abc.ABCMeta)
 class BaseMessenger(object):
     """Base class for all messengers."""
 
+    # Messengers that handle a caso.record_batch.RecordBatch (a container that
+    # groups the records by their type, and has no slicing) set this to True to
+    # get the records as a batch instead of as a list.
+    accepts_batches = False
+
     @abc.abstractmethod
     def push(self, records):
         """Push the records."""
 
 
 def _filter_records(
-    records: typing.List,
+    records: typing.Union[typing.List, caso.record_batch.RecordBatch],
     record_types: typing.Optional[typing.List[str]],
-) -> typing.List:
+) -> typing.Union[typing.List, caso.record_batch.RecordBatch]:
     """Filter records based on allowed record types.
 
-    :param records: List of records to filter.
+    :param records: List or batch of records to filter. The records of a batch
+                    are selected by their type, without scanning them.
     :param record_types: List of allowed record type names. If None or empty,
                          all records are returned.
-    :returns: Filtered list of records.
+    :returns: Filtered list or batch of records.
     """
     if not record_types:
         return records
 
-    allowed_classes = tuple(
-        RECORD_TYPE_MAP[rt] for rt in record_types if rt in RECORD_TYPE_MAP
-    )
-    if not allowed_classes:
+    allowed_types = [rt for rt in record_types if rt in RECORD_TYPE_MAP]
+    if not allowed_types:
         return records
 
+    if isinstance(records, caso.record_batch.RecordBatch):
+        return records.select(allowed_types)
+
+    allowed_classes = tuple(RECORD_TYPE_MAP[rt] for rt in allowed_types)
     return [r for r in records if isinstance(r, allowed_classes)]
 
 
@@ -151,15 +154,55 @@ class Manager(object):
                     if record_types:
                         self.messenger_record_types[messenger_name] = list(record_types)
 
-    def push_to_all(self, records):
-        """Push records to all the configured messengers."""
+    def push_to_all(self, records, skip_delivered=True):
+        """Push records to all the configured messengers.
+
+        Each messenger gets a list with the records of the types it publishes,
+        in the order in which they were given. The messengers that accept
+        batches get them grouped by their type instead, grouping them only
+        once. If the delivery index is enabled, the records that were already
+        delivered to a messenger are not pushed to it again.
+
+        :param skip_delivered: Whether to skip the records that were already
+                               delivered, otherwise all the records are pushed
+                               (e.g. when replaying them), although they are
+                               still added to the delivery index.
+        """
+        index = delivery_index.get_index()
+        digests: typing.Dict[int, bytes] = {}
+        batch = None
         try:
+            records = list(records)
             for ext in self.mgr:
                 messenger_name = ext.name
                 record_types = self.messenger_record_types.get(messenger_name)
-                filtered_records = _filter_records(records, record_types)
+                if isinstance(ext.obj, BaseMessenger) and ext.obj.accepts_batches:
+                    if batch is None:
+                        batch = caso.record_batch.RecordBatch(records)
+                    filtered_records = _filter_records(batch, record_types)
+                else:
+                    filtered_records = _filter_records(records, record_types)
+                if index is not None and filtered_records:
+                    if skip_delivered:
+                        count = len(filtered_records)
+                        filtered_records, pending = index.skip_delivered(
+                            messenger_name, filtered_records, digests
+                        )
+                        if len(filtered_records) < count:
+                            LOG.info(
+                                "Skipping %d records already delivered to "
+                                "messenger %s",
+                                count - len(filtered_records),
+                                messenger_name,
+                            )
+                    else:
+                        pending = delivery_index.record_digests(
+                            filtered_records, digests
+                        )
                 if filtered_records:
                     ext.obj.push(filtered_records)
+                    if index is not None:
+                        index.add(messenger_name, pending)
                 else:
                     LOG.debug(
                         "No records to push to messenger %s "
@@ -171,3 +214,5 @@ class Manager(object):
             # Capture exception so that we can continue working
             LOG.error("Something happeneded when pushing records.")
             LOG.exception(e)
+        finally:
+            delivery_index.save()
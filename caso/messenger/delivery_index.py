@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing the index of the records delivered to the messengers.
+
+Completed servers and volumes are extracted again every time they show up in
+an extraction period (overlapping periods, backfills or reruns after a failed
+push), producing the same records. A hash of the contents of every record
+pushed to a messenger (except the time at which it was measured) is stored in a
+SQLite database in the spool directory, so that the records that were already
+delivered to a messenger are not published to it again.
+
+The hashes are only stored once the messenger has pushed the records without
+errors. Hashes that have not been seen for some time are evicted.
+"""
+
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+import dateutil.parser
+from oslo_config import cfg
+from oslo_log import log
+
+import caso.record_batch
+
+opts = [
+    cfg.BoolOpt(
+        "enabled",
+        default=True,
+        help="Store a hash of the records delivered to each messenger in the "
+        "spool directory, so that records that have not changed since they "
+        "were delivered (e.g. completed servers extracted again in overlapping "
+        "periods) are not published again to the same messenger.",
+    ),
+    cfg.IntOpt(
+        "retention",
+        default=90,
+        min=1,
+        help="Number of days that the hash of a delivered record is kept since "
+        "the record was last extracted. Older hashes are evicted at the end of "
+        "each run.",
+    ),
+    cfg.StrOpt(
+        "invalidate_before",
+        help="Forget the records that were delivered before this date, so that "
+        "they are published again (e.g. after a messenger lost them). If no "
+        "time zone is specified, UTC will be used.",
+    ),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group="delivery_index")
+
+LOG = log.getLogger(__name__)
+
+INDEX_FILE = "delivery_index.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS delivered (
+    messenger TEXT NOT NULL,
+    digest BLOB NOT NULL,
+    delivered REAL NOT NULL,
+    seen REAL NOT NULL,
+    PRIMARY KEY (messenger, digest)
+) WITHOUT ROWID
+"""
+
+# Number of hashes looked up in each query, below the lowest default limit of
+# variables in a SQLite statement (999)
+_CHUNK_SIZE = 900
+
+
+def _chunks(items, size):
+    it = iter(items)
+    return iter(lambda: list(itertools.islice(it, size)), [])
+
+
+# Fields (by their JSON key) of the records of each type with the time at which
+# they were measured, that changes every time they are extracted although their
+# usage does not. The IP records are not included, as their usage is the count
+# of IPs at the time they were measured.
+_MEASURE_TIME_FIELDS = {
+    "storage": ("CreateTime",),
+}
+
+
+def record_digest(record) -> bytes:
+    """Get a stable hash of the contents of a record.
+
+    The hash covers the type of the record and all its fields (except the time
+    at which the record was measured), as they are serialised to JSON, so
+    records with the same identity and usage have the same hash across runs.
+    """
+    name = caso.record_batch.record_type(record) or type(record).__name__
+    fields = record.as_dict()
+    for key in _MEASURE_TIME_FIELDS.get(name, ()):
+        fields.pop(key, None)
+    data = json.dumps(fields, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(f"{name}\n{data}".encode("utf-8"), digest_size=16).digest()
+
+
+def record_digests(records, digests=None) -> typing.List[bytes]:
+    """Get the hashes of some records.
+
+    :param digests: Dictionary where the hashes of the records are cached, by
+                    the id of the records, so that they are only computed once
+                    for all the messengers.
+    """
+    if digests is None:
+        digests = {}
+    record_digests = []
+    for r in records:
+        digest = digests.get(id(r))
+        if digest is None:
+            digest = digests[id(r)] = record_digest(r)
+        record_digests.append(digest)
+    return record_digests
+
+
+class DeliveryIndex(object):
+    """A persistent index of the hashes of the records delivered to messengers.
+
+    :param path: SQLite database where the index is stored, None to keep it in
+                 memory.
+    :param retention: Days that a hash is kept since its record was last seen.
+    """
+
+    def __init__(self, path=None, retention=90, clock=time.time):
+        """Initialize the index, opening its database."""
+        self.path = path
+        self.retention = retention
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.delivered = 0
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+    def seen(self, messenger, digests):
+        """Get the hashes that were already delivered to a messenger.
+
+        The hashes that are found are marked as seen, so that they are kept
+        while their records are still being extracted.
+
+        :returns: A set with the given hashes that were delivered.
+        """
+        found = set()
+        now = self._clock()
+        with self._lock:
+            for chunk in _chunks(digests, _CHUNK_SIZE):
+                where = (
+                    "WHERE messenger = ? "
+                    f"AND digest IN ({','.join('?' * len(chunk))})"
+                )
+                rows = self._db.execute(
+                    f"SELECT digest FROM delivered {where}", [messenger, *chunk]
+                ).fetchall()
+                if rows:
+                    self._db.execute(
+                        f"UPDATE delivered SET seen = ? {where}",
+                        [now, messenger, *chunk],
+                    )
+                found.update(row[0] for row in rows)
+            self._db.commit()
+            self.skipped += len(found)
+        return found
+
+    def add(self, messenger, digests):
+        """Store the hashes of the records delivered to a messenger."""
+        now = self._clock()
+        rows = [(messenger, d, now, now) for d in digests]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO delivered VALUES (?, ?, ?, ?)", rows
+            )
+            self._db.commit()
+            self.delivered += len(rows)
+
+    def skip_delivered(self, messenger, records, digests=None):
+        """Drop the records that were already delivered to a messenger.
+
+        :param records: List or batch of records.
+        :param digests: Dictionary where the hashes of the records are cached,
+                        by the id of the records, so that they are only
+                        computed once for all the messengers.
+        :returns: A tuple with the records (as a list or a batch, as they were
+                  given) that were not delivered, and a list of their hashes.
+        """
+        hashes = record_digests(records, digests)
+        delivered = self.seen(messenger, hashes)
+        pending = [(r, d) for r, d in zip(records, hashes) if d not in delivered]
+        kept = [r for r, _ in pending]
+        if isinstance(records, caso.record_batch.RecordBatch):
+            kept = caso.record_batch.RecordBatch(kept)
+        return kept, [d for _, d in pending]
+
+    def invalidate(self, messenger=None, delivered_before=None):
+        """Forget delivered records.
+
+        :param messenger: Only forget the records delivered to this messenger.
+        :param delivered_before: Only forget the records delivered before this
+                                 (naive, UTC) date.
+        :returns: The number of records forgotten.
+        """
+        query = "DELETE FROM delivered WHERE 1 = 1"
+        args: typing.List[typing.Any] = []
+        if messenger is not None:
+            query += " AND messenger = ?"
+            args.append(messenger)
+        if delivered_before is not None:
+            query += " AND delivered < ?"
+            args.append(
+                delivered_before.replace(tzinfo=datetime.timezone.utc).timestamp()
+            )
+        with self._lock:
+            count = self._db.execute(query, args).rowcount
+            self._db.commit()
+        return count
+
+    def evict(self):
+        """Forget the records that have not been seen within the retention period.
+
+        :returns: The number of records forgotten.
+        """
+        limit = self._clock() - self.retention * 86400
+        with self._lock:
+            count = self._db.execute(
+                "DELETE FROM delivered WHERE seen < ?", (limit,)
+            ).rowcount
+            self._db.commit()
+        return count
+
+    def close(self):
+        """Close the database of the index."""
+        with self._lock:
+            self._db.close()
+
+
+_INDEX: typing.Optional[DeliveryIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_index():
+    """Get the delivery index shared by all the messengers of this run.
+
+    :returns: The index, or None if it is disabled or cannot be opened.
+    """
+    global _INDEX
+
+    if not CONF.delivery_index.enabled:
+        return None
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            path = os.path.join(CONF.spooldir, INDEX_FILE)
+            try:
+                index = DeliveryIndex(path, retention=CONF.delivery_index.retention)
+            except sqlite3.Error as e:
+                LOG.warning(f"Cannot open delivery index '{path}', not using it - {e}")
+                return None
+            invalidate_before = CONF.delivery_index.invalidate_before
+            if invalidate_before:
+                date = dateutil.parser.parse(invalidate_before)
+                if date.tzinfo is not None:
+                    date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                count = index.invalidate(delivered_before=date)
+                LOG.info(f"Forgot {count} records delivered before {date}")
+            _INDEX = index
+        return _INDEX
+
+
+def save():
+    """Evict the old hashes of the shared index and close it."""
+    global _INDEX
+
+    with _INDEX_LOCK:
+        index = _INDEX
+        _INDEX = None
+    if index is None:
+        return
+    try:
+        evicted = index.evict()
+    except sqlite3.Error as e:
+        LOG.warning(f"Cannot evict records from the delivery index - {e}")
+        evicted = 0
+    LOG.info(
+        f"Delivery index: {index.skipped} records already delivered were skipped, "
+        f"{index.delivered} delivered, {evicted} evicted"
+    )
+    index.close()
+
+
+def reset():
+    """Close the shared delivery index, so that it is opened again."""
+    global _INDEX
+
+    with _INDEX_LOCK:
+        index = _INDEX
+        _INDEX = None
+    if index is not None:
+        index.close()
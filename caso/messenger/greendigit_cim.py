@@ -15,7 +15,6 @@
 
 """Messenger to publish EnergyRecord objects to GreenDIGIT CIM Service."""
 
-import json
 import socket
 import ssl
 from urllib.parse import urlparse
@@ -129,10 +128,7 @@ class GreenDIGITEnergyMessenger(caso.messenger.BaseMessenger):
             "Content-Type": "application/json",
         }
 
-        payload = [
-            json.loads(r.model_dump_json(by_alias=True, exclude_none=True))
-            for r in records
-        ]
+        payload = [r.as_dict() for r in records]
 
         resp = requests.post(
             self.publish_url, headers=headers, json=payload, timeout=60
@@ -20,7 +20,6 @@ import socket
 
 from oslo_config import cfg
 from oslo_log import log
-import six
 
 from caso import exception
 import caso.messenger
@@ -51,8 +50,8 @@ class LogstashMessenger(caso.messenger.BaseMessenger):
         """Push records to logstash using tcp."""
         try:
             self.sock.connect((self.host, self.port))
-            for _, record in six.iteritems(records):
-                self.sock.sendall(record.as_json() + "\n")
+            for record in records:
+                self.sock.sendall(record.as_json().encode("utf-8") + b"\n")
         except socket.error as e:
             raise exception.LogstashConnectionError(
                 host=self.host, port=self.port, exception=e
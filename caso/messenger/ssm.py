@@ -17,6 +17,8 @@
 """Module containing the APEL SSM Messenger."""
 
 import json
+import os
+import sqlite3
 import typing
 import warnings
 
@@ -30,6 +32,8 @@ from oslo_log import log
 import caso.exception
 import caso.messenger
 import caso.record
+import caso.record_batch
+import caso.summary
 from caso import utils
 
 LOG = log.getLogger(__name__)
@@ -43,20 +47,48 @@ opts = [
     cfg.IntOpt(
         "max_size", default=100, help="Maximum number of records to send per message"
     ),
+    cfg.StrOpt(
+        "cloud_messages",
+        default="records",
+        choices=[
+            ("records", "Publish a cloud record for each VM."),
+            (
+                "summaries",
+                "Publish cloud summary records, aggregating the cloud records "
+                "by site, month, VO, user, status, image and benchmark.",
+            ),
+            ("both", "Publish both the cloud records and their summaries."),
+        ],
+        help="Messages to publish for the cloud records.",
+    ),
+    cfg.IntOpt(
+        "summary_months",
+        default=3,
+        min=1,
+        help="Number of months, including the current one, whose usage of each "
+        "VM is kept in the spool directory to publish the cloud summaries of "
+        "the whole months. The summaries of older months are not published.",
+    ),
 ]
 
 CONF = cfg.CONF
 
 CONF.register_opts(opts, group="ssm")
+CONF.import_opt("spooldir", "caso.manager")
 
 
 __all__ = ["SSMMessenger", "SSMMessengerV04"]
 
+SUMMARY_FILE = "cloud_summaries.sqlite"
+
 
 class SSMMessenger(caso.messenger.BaseMessenger):
     """SSM Messenger that pushes formatted messages to a dirq instance."""
 
+    accepts_batches = True
+
     version_cloud = "0.4"
+    version_cloud_summary = "0.4"
     version_ip = "0.2"
     version_accelerator = "0.1"
     version_storage = None  # FIXME: this cannot have a none version
@@ -77,40 +109,54 @@ class SSMMessenger(caso.messenger.BaseMessenger):
         message += f"{aux}\n"
         self.queue.add(message.encode("utf-8"))
 
+    def _push_message_cloud_summary(self, entries: typing.List[str]):
+        """Push a compute summary message, following the CloudSummaryRecord."""
+        message = f"APEL-cloud-summary-message: v{self.version_cloud_summary}\n"
+        aux = "\n%%\n".join(entries)
+        message += f"{aux}\n"
+        self.queue.add(message.encode("utf-8"))
+
     def _push_message_json(
         self,
-        entries: typing.List[str],
+        entries: typing.List[typing.Dict[str, typing.Any]],
         msg_type: str,
         version: str,
     ):
-        """Push a JSON message with a UsageRecords list."""
+        """Push a JSON message with a UsageRecords list.
+
+        The entries are the records already serialized as dicts, so that each
+        record is encoded to JSON only once, together with the whole message.
+        """
         message = {
             "Type": msg_type,
             "Version": version,
-            "UsageRecords": [json.loads(r) for r in entries],
+            "UsageRecords": entries,
         }
         self.queue.add(json.dumps(message))
 
-    def _push_message_ip(self, entries: typing.List[str]):
+    def _push_message_ip(self, entries: typing.List[typing.Dict[str, typing.Any]]):
         """Push an IP message."""
         self._push_message_json(entries, "APEL Public IP message", self.version_ip)
 
-    def _push_message_accelerator(self, entries: typing.List[str]):
+    def _push_message_accelerator(
+        self, entries: typing.List[typing.Dict[str, typing.Any]]
+    ):
         """Push an accelerator message."""
         self._push_message_json(
             entries, "APEL-accelerator-message", self.version_accelerator
         )
 
-    def _push_message_storage(self, entries):
-        """Push a storage message."""
-        ETree.register_namespace(
-            "sr", "http://eu-emi.eu/namespaces/2011/02/storagerecord"
+    def _push_message_storage(self, records: typing.List[caso.record.StorageRecord]):
+        """Push a storage message, built straight from the storage records.
+
+        The elements of the records are added to the document as they are built,
+        instead of rendering each record on its own and parsing it again.
+        """
+        root = ETree.Element(
+            "sr:StorageUsageRecords",
+            attrib={"xmlns:sr": caso.record.STORAGE_RECORD_NAMESPACE},
         )
-        root = ETree.Element("sr:StorageUsageRecords")
-        for record in entries:
-            # We are not parsing XML so this is safe
-            sr = ETree.fromstring(record)  # nosec
-            root.append(sr)
+        root.extend(record.ssm_element() for record in records)
         self.queue.add(ETree.tostring(root))
 
     def _push(self, entries_cloud, entries_ip, entries_accelerator, entries_storage):
@@ -118,6 +164,9 @@ class SSMMessenger(caso.messenger.BaseMessenger):
 
         This method gets lists of messages to be pushed in smaller chucks as per GGUS
         ticket 143436: https://ggus.eu/index.php?mode=ticket_info&ticket_id=143436
+
+        Storage records are rendered when their messages are built, so that only
+        the document of a chunk is kept in memory at a time.
         """
         for i in range(0, len(entries_cloud), CONF.ssm.max_size):
             entries = entries_cloud[i : i + CONF.ssm.max_size]  # noqa(E203)
@@ -135,6 +184,42 @@ class SSMMessenger(caso.messenger.BaseMessenger):
             entries = entries_storage[i : i + CONF.ssm.max_size]  # noqa(E203)
             self._push_message_storage(entries)
 
+    def _cloud_summaries(self, cloud_records):
+        """Get the summaries of the whole months of some cloud records.
+
+        The usage of the records is added to the store of the spool directory,
+        and the summaries of their months are built from all the usage stored,
+        as APEL replaces the summaries of a month that were published before.
+
+        :param cloud_records: Batch with the cloud records, whose usage is read
+                              from its columns.
+        """
+        path = os.path.join(CONF.spooldir, SUMMARY_FILE)
+        try:
+            store = caso.summary.CloudSummaryStore(path, CONF.ssm.summary_months)
+        except sqlite3.Error as e:
+            raise caso.exception.CasoError(
+                f"Cannot open the cloud summaries '{path}' - {e}"
+            )
+        try:
+            months = store.update(cloud_records)
+            summaries = store.summaries(months)
+            store.evict()
+        finally:
+            store.close()
+        if store.skipped:
+            LOG.warning(
+                f"Not publishing the summaries of {store.skipped} cloud records "
+                f"older than {CONF.ssm.summary_months} months"
+            )
+        return summaries
+
+    def _push_summaries(self, entries_cloud_summary):
+        """Push the summary messages, dividing them into smaller chunks."""
+        for i in range(0, len(entries_cloud_summary), CONF.ssm.max_size):
+            entries = entries_cloud_summary[i : i + CONF.ssm.max_size]  # noqa(E203)
+            self._push_message_cloud_summary(entries)
+
     def push(self, records):
         """Push all records to SSM.
 
@@ -144,29 +229,36 @@ class SSMMessenger(caso.messenger.BaseMessenger):
             - Accelerator records
             - Storage records
 
-        This method will iterate over all the records, transforming them into the
-        correct messages, then pushing it.
+        This method will group the records by their type (unless they are already
+        given as a batch), transforming them into the correct messages, then pushing
+        them. Depending on the ``cloud_messages`` option, the cloud records are
+        pushed as they are, aggregated into cloud summary records of their whole
+        months (see _cloud_summaries), or both.
         """
         if not records:
             return
 
+        batch = caso.record_batch.RecordBatch(records)
+        if not set(batch.record_types) <= {"cloud", "ip", "accelerator", "storage"}:
+            raise caso.exception.CasoError("Unexpected record format!")
+
+        cloud_records = batch.records("cloud")
         entries_cloud = []
-        entries_ip = []
-        entries_accelerator = []
-        entries_storage = []
-        for record in records:
-            if isinstance(record, caso.record.CloudRecord):
-                entries_cloud.append(record.ssm_message())
-            elif isinstance(record, caso.record.IPRecord):
-                entries_ip.append(record.ssm_message())
-            elif isinstance(record, caso.record.AcceleratorRecord):
-                entries_accelerator.append(record.ssm_message())
-            elif isinstance(record, caso.record.StorageRecord):
-                entries_storage.append(record.ssm_message())
-            else:
-                raise caso.exception.CasoError("Unexpected record format!")
+        if CONF.ssm.cloud_messages in ("records", "both"):
+            entries_cloud = [r.ssm_message() for r in cloud_records]
+        entries_ip = [r.ssm_usage_record() for r in batch.records("ip")]
+        entries_accelerator = [
+            r.ssm_usage_record() for r in batch.records("accelerator")
+        ]
+        entries_storage = batch.records("storage")
 
         self._push(entries_cloud, entries_ip, entries_accelerator, entries_storage)
+        if cloud_records and CONF.ssm.cloud_messages in ("summaries", "both"):
+            entries_cloud_summary = [
+                s.ssm_message() for s in self._cloud_summaries(batch.select(["cloud"]))
+            ]
+            if entries_cloud_summary:
+                self._push_summaries(entries_cloud_summary)
 
 
 class SSMMessengerV04(SSMMessenger):
@@ -18,16 +18,23 @@
 
 import itertools
 
+import caso.circuit_breaker
+import caso.discovery_cache
 import caso.extract.base
+import caso.extract.energy_cache
 import caso.extract.manager
 import caso.extract.openstack.nova
 import caso.extract.prometheus
+import caso.http_pool
 import caso.keystone_client
 import caso.loading
 import caso.manager
 import caso.messenger
+import caso.messenger.delivery_index
 import caso.messenger.logstash
 import caso.messenger.ssm
+import caso.ratelimit
+import caso.response_cache
 
 
 def list_opts():
@@ -44,9 +51,16 @@ def list_opts():
         ),
         ("accelerator", caso.extract.openstack.nova.accelerator_opts),
         ("benchmark", caso.extract.openstack.nova.benchmark_opts),
+        ("circuit_breaker", caso.circuit_breaker.opts),
+        ("delivery_index", caso.messenger.delivery_index.opts),
+        ("discovery_cache", caso.discovery_cache.opts),
+        ("energy_cache", caso.extract.energy_cache.opts),
+        ("http", caso.http_pool.opts),
         ("keystone_auth", caso.keystone_client.opts),
         ("logstash", caso.messenger.logstash.opts),
         ("prometheus", caso.extract.prometheus.opts),
+        ("rate_limit", caso.ratelimit.opts),
+        ("response_cache", caso.response_cache.opts),
         ("ssm", caso.messenger.ssm.opts),
     ]
 
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing the per-service rate and concurrency limiters for cASO.
+
+Each OpenStack service type gets a limiter, made of a token bucket (limiting the
+request rate) and a semaphore (limiting the number of requests in flight). The
+limiters are used as the ``rate_semaphore`` of the keystoneauth sessions, and
+adapt their rate when the service answers with HTTP 429 or 503.
+"""
+
+import collections
+import datetime
+import email.utils
+import threading
+import time
+import typing
+
+from oslo_config import cfg
+from oslo_log import log
+
+opts = [
+    cfg.FloatOpt(
+        "requests_per_second",
+        default=0,
+        min=0,
+        help="Maximum number of requests per second sent to each OpenStack "
+        "service. Set to 0 to disable rate limiting.",
+    ),
+    cfg.IntOpt(
+        "burst",
+        default=10,
+        min=1,
+        help="Number of requests that can be sent in a burst, before the "
+        "requests_per_second limit applies.",
+    ),
+    cfg.IntOpt(
+        "max_concurrency",
+        default=0,
+        min=0,
+        help="Maximum number of concurrent requests to each OpenStack service. "
+        "Set to 0 to disable concurrency limiting.",
+    ),
+    cfg.DictOpt(
+        "service_requests_per_second",
+        default={},
+        help="Per-service overrides of requests_per_second, as service_type:value "
+        "pairs (e.g. 'compute:5,identity:10'). The service type is the one used "
+        "by the OpenStack clients (compute, identity, image, network, volumev3).",
+    ),
+    cfg.DictOpt(
+        "service_max_concurrency",
+        default={},
+        help="Per-service overrides of max_concurrency, as service_type:value "
+        "pairs (e.g. 'compute:4').",
+    ),
+    cfg.IntOpt(
+        "max_retries",
+        default=3,
+        min=0,
+        help="Number of times a request is retried when the service answers "
+        "with HTTP 429 (Too Many Requests) or 503 (Service Unavailable).",
+    ),
+    cfg.FloatOpt(
+        "max_backoff",
+        default=60,
+        min=0,
+        help="Maximum number of seconds to wait before retrying a throttled "
+        "request, even if the service asks for a longer Retry-After.",
+    ),
+    cfg.FloatOpt(
+        "backoff_factor",
+        default=0.5,
+        min=0.01,
+        max=1,
+        help="Factor applied to the request rate of a service each time it "
+        "answers with HTTP 429 or 503. The rate recovers progressively as "
+        "requests succeed again.",
+    ),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group="rate_limit")
+
+LOG = log.getLogger(__name__)
+
+THROTTLE_STATUS_CODES = frozenset([429, 503])
+
+# Minimum rate (requests per second) that adaptive backoff can reach
+_MIN_RATE = 0.1
+# Rate increase applied on every successful request after a backoff
+_RECOVERY_FACTOR = 1.05
+# Number of recent requests used to estimate the rate of unlimited services
+_RATE_WINDOW = 50
+
+
+def parse_retry_after(value, now=None):
+    """Parse a Retry-After header value, returning the seconds to wait.
+
+    :param value: The header value, either a number of seconds or a HTTP date.
+    :param now: Current time as epoch, used for HTTP dates (defaults to now).
+    :returns: Seconds to wait (float), or None if the value cannot be parsed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    now = time.time() if now is None else now
+    return max(0.0, date.timestamp() - now)
+
+
+class TokenBucket(object):
+    """A thread safe token bucket.
+
+    :param rate: Tokens added per second, None or 0 means unlimited.
+    :param burst: Maximum number of tokens in the bucket.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic, sleep=time.sleep):
+        """Initialize a full bucket."""
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.burst = burst
+        self.rate = rate or None
+        self._tokens = float(burst)
+        self._last = clock()
+
+    def set_rate(self, rate):
+        """Change the rate of the bucket."""
+        with self._lock:
+            self._refill()
+            self.rate = rate or None
+
+    def _refill(self):
+        now = self._clock()
+        if self.rate:
+            self._tokens = min(
+                float(self.burst), self._tokens + (now - self._last) * self.rate
+            )
+        self._last = now
+
+    def acquire(self):
+        """Take a token from the bucket, waiting until one is available."""
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class ServiceLimiter(object):
+    """Rate and concurrency limiter for an OpenStack service.
+
+    Objects of this class are context managers, so that they can be used as the
+    ``rate_semaphore`` of a keystoneauth session: entering waits for a slot and
+    a token, exiting frees the slot.
+    """
+
+    def __init__(
+        self,
+        service_type,
+        rate,
+        burst,
+        concurrency,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        """Initialize the limiter for a service."""
+        self.service_type = service_type
+        self.max_rate = rate or None
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(rate, burst, clock=clock, sleep=sleep)
+        self._semaphore = (
+            threading.BoundedSemaphore(concurrency) if concurrency else None
+        )
+        self._paused_until = 0.0
+        self._recent: typing.Deque[float] = collections.deque(maxlen=_RATE_WINDOW)
+        # Rate limit in place after a backoff, None if not backing off
+        self._adaptive_rate: typing.Optional[float] = None
+        # Rate at which we stop backing off
+        self._recovered_rate: typing.Optional[float] = None
+
+    @property
+    def rate(self):
+        """Get the current request rate limit (None if unlimited)."""
+        return self._bucket.rate
+
+    def __enter__(self):
+        """Wait until a request can be sent to the service."""
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        try:
+            while True:
+                with self._lock:
+                    wait = self._paused_until - self._clock()
+                if wait <= 0:
+                    break
+                self._sleep(wait)
+            self._bucket.acquire()
+        except BaseException:
+            if self._semaphore is not None:
+                self._semaphore.release()
+            raise
+        with self._lock:
+            self._recent.append(self._clock())
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Free the concurrency slot taken for the request."""
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def _observed_rate(self):
+        if len(self._recent) < 2:
+            return None
+        elapsed = self._recent[-1] - self._recent[0]
+        if elapsed <= 0:
+            return None
+        return (len(self._recent) - 1) / elapsed
+
+    def throttled(self, retry_after=None, attempt=0):
+        """Back off after the service answered with HTTP 429 or 503.
+
+        :param retry_after: Value of the Retry-After header, if any.
+        :param attempt: Number of times this request was already retried, used
+                        to compute an exponential backoff when the service does
+                        not send a Retry-After header.
+        :returns: Seconds that the service will be paused.
+        """
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = float(2**attempt)
+        delay = min(delay, CONF.rate_limit.max_backoff)
+
+        with self._lock:
+            current = self.rate or self._observed_rate()
+            if current:
+                if self._recovered_rate is None:
+                    self._recovered_rate = self.max_rate or current
+                new_rate = max(_MIN_RATE, current * CONF.rate_limit.backoff_factor)
+                self._adaptive_rate = new_rate
+                self._bucket.set_rate(new_rate)
+            self._paused_until = max(self._paused_until, self._clock() + delay)
+
+        LOG.warning(
+            f"Service '{self.service_type}' is throttling requests, pausing for "
+            f"{delay:.1f}s (rate limit: {self.rate or 'unlimited'} req/s)"
+        )
+        return delay
+
+    def succeeded(self):
+        """Progressively recover the request rate after a backoff."""
+        with self._lock:
+            if self._adaptive_rate is None:
+                return
+            new_rate = self._adaptive_rate * _RECOVERY_FACTOR
+            if new_rate >= self._recovered_rate:
+                self._adaptive_rate = None
+                self._recovered_rate = None
+                self._bucket.set_rate(self.max_rate)
+                LOG.debug(f"Service '{self.service_type}' request rate recovered")
+            else:
+                self._adaptive_rate = new_rate
+                self._bucket.set_rate(new_rate)
+
+
+_LIMITERS: typing.Dict[str, ServiceLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def _service_value(overrides, service_type, default, cast):
+    value = overrides.get(service_type)
+    if value is None:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        LOG.warning(
+            f"Invalid rate limit value '{value}' for service '{service_type}', "
+            f"using {default}"
+        )
+        return default
+
+
+def get_limiter(service_type):
+    """Get the limiter for a service type, creating it if needed."""
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(service_type)
+        if limiter is None:
+            group = CONF.rate_limit
+            rate = _service_value(
+                group.service_requests_per_second,
+                service_type,
+                group.requests_per_second,
+                float,
+            )
+            concurrency = _service_value(
+                group.service_max_concurrency,
+                service_type,
+                group.max_concurrency,
+                int,
+            )
+            limiter = ServiceLimiter(service_type, rate, group.burst, concurrency)
+            _LIMITERS[service_type] = limiter
+        return limiter
+
+
+def reset():
+    """Drop all the limiters, so that they are built again from the config."""
+    with _LIMITERS_LOCK:
+        _LIMITERS.clear()
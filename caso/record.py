@@ -19,7 +19,10 @@
 import abc
 import datetime
 import enum
+import functools
 import json
+import math
+import types
 import typing
 import uuid as m_uuid
 
@@ -27,12 +30,16 @@ import uuid as m_uuid
 import xml.etree.ElementTree as ETree  # nosec
 
 import pydantic
+import pydantic_core
 
 import caso
 from oslo_log import log
 
 LOG = log.getLogger(__name__)
 
+# Namespace of the EMI StAR storage records
+STORAGE_RECORD_NAMESPACE = "http://eu-emi.eu/namespaces/2011/02/storagerecord"
+
 
 class _BaseRecord(pydantic.BaseModel, abc.ABC):
     """This is the base cASO record object."""
@@ -48,6 +55,17 @@ class _BaseRecord(pydantic.BaseModel, abc.ABC):
         """Render record as the expected SSM message."""
         raise NotImplementedError("Method not implemented")
 
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        """Get the record as a dict of JSON values, by alias and without Nones."""
+        return _json_record(self)
+
+    def as_json(self) -> str:
+        """Serialize the record to JSON, by alias and excluding None values."""
+        # NOTE: the JSON is not built from the serialization plan, as the
+        # serializer that pydantic compiles for the model is faster than dumping
+        # the values of the plan.
+        return self.model_dump_json(by_alias=True, exclude_none=True)
+
 
 class _ValidCloudStatus(str, enum.Enum):
     """This is a private class to enum valid cloud statuses."""
@@ -61,9 +79,9 @@ class _ValidCloudStatus(str, enum.Enum):
     unknown = "unknown"
 
 
-def map_cloud_fields(value: str) -> str:
-    """Map object fields to Cloud Accounting Record fields."""
-    d = {
+# Keys of the Cloud Accounting Record fields, by attribute
+_CLOUD_ALIASES = types.MappingProxyType(
+    {
         "uuid": "VMUUID",
         "site_name": "SiteName",
         "name": "MachineName",
@@ -91,7 +109,199 @@ def map_cloud_fields(value: str) -> str:
         "compute_service": "CloudComputeService",
         "cloud_type": "CloudType",
     }
-    return d.get(value, value)
+)
+
+
+def map_cloud_fields(value: str) -> str:
+    """Map object fields to Cloud Accounting Record fields."""
+    return _CLOUD_ALIASES.get(value, value)
+
+
+# Keys of the durations that are reported as at least 1 second
+_SSM_MIN_ONE = frozenset(["CpuDuration", "WallDuration"])
+
+
+class SerializationPlan(typing.NamedTuple):
+    """How the records of a class are serialized, built once for each class.
+
+    The fields are read from the ``__dict__`` of the records, and the values of
+    the computed fields are obtained at once with a single accessor, without
+    looking them up on every record that is serialized.
+    """
+
+    # Read-only mapping of the attributes of the fields to their keys
+    aliases: typing.Mapping[str, str]
+    # Fields that are serialized, in the order of the model, as (attribute,
+    # key) tuples, followed by the computed ones
+    fields: typing.Tuple[typing.Tuple[str, str], ...]
+    computed_fields: typing.Tuple[typing.Tuple[str, str], ...]
+    # Accessor that gets a tuple with the values of the computed fields
+    computed_values: typing.Callable[[typing.Any], tuple]
+    # Fields rendered in the "key: value" lines of the SSM messages, sorted by
+    # the key, as (attribute, "key: " prefix, at least one, computed index)
+    # tuples, where the index is None for the fields that are not computed
+    ssm_fields: typing.Tuple[typing.Tuple[str, str, bool, typing.Optional[int]], ...]
+
+
+def _computed_values_getter(getters):
+    """Get an accessor calling the getters of the computed fields."""
+    if not getters:
+        return lambda record: ()
+    return lambda record: tuple([getter(record) for getter in getters])
+
+
+@functools.lru_cache(maxsize=None)
+def serialization_plan(cls) -> SerializationPlan:
+    """Get the serialization plan of a record class.
+
+    The fields (including the computed ones) that are not excluded from the
+    serialization are serialized by their alias. The values of the computed
+    fields are obtained with the ``_computed_values`` method of the class if it
+    has one, or calling the getters of their properties.
+    """
+    fields = tuple(
+        (name, field.alias or name)
+        for name, field in cls.model_fields.items()
+        if not field.exclude
+    )
+    computed_fields = tuple(
+        (name, field.alias or name) for name, field in cls.model_computed_fields.items()
+    )
+    computed_values = getattr(cls, "_computed_values", None)
+    if computed_values is None:
+        computed_values = _computed_values_getter(
+            [f.wrapped_property.fget for f in cls.model_computed_fields.values()]
+        )
+
+    ssm_fields: typing.List[typing.Tuple[str, str, typing.Optional[int]]] = [
+        (name, key, None) for name, key in fields
+    ]
+    ssm_fields.extend((name, key, i) for i, (name, key) in enumerate(computed_fields))
+    ssm_fields.sort(key=lambda field: f"{field[1]}: ")
+    return SerializationPlan(
+        aliases=types.MappingProxyType(dict(fields + computed_fields)),
+        fields=fields,
+        computed_fields=computed_fields,
+        computed_values=computed_values,
+        ssm_fields=tuple(
+            (name, f"{key}: ", key in _SSM_MIN_ONE, index)
+            for name, key, index in ssm_fields
+        ),
+    )
+
+
+def _json_float(value: float) -> typing.Optional[float]:
+    # Non finite floats are serialized as JSON nulls, as in model_dump_json
+    return value if math.isfinite(value) else None
+
+
+def _json_value(value) -> typing.Any:
+    """Convert a field value to the value it has in the JSON of the record."""
+    convert = _JSON_CONVERTERS.get(type(value))
+    if convert is not None:
+        return convert(value)
+    if isinstance(value, enum.Enum):
+        return _json_value(value.value)
+    if isinstance(value, dict):
+        return {_json_value(k): _json_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    if isinstance(value, float):
+        return _json_float(value)
+    return pydantic_core.to_jsonable_python(value)
+
+
+def _json_same(value):
+    return value
+
+
+# Converters of the field values of the most common types
+_JSON_CONVERTERS: typing.Dict[type, typing.Callable[[typing.Any], typing.Any]] = {
+    str: _json_same,
+    int: _json_same,
+    bool: _json_same,
+    float: _json_float,
+    m_uuid.UUID: str,
+}
+
+
+def _json_record(record: pydantic.BaseModel) -> typing.Dict[str, typing.Any]:
+    """Get the JSON values of a record, by alias and excluding None values."""
+    plan = serialization_plan(type(record))
+    values = record.__dict__
+    serialized_record = {}
+    for name, key in plan.fields:
+        value = values[name]
+        if value is None:
+            continue
+        value_type = type(value)
+        if value_type is not str and value_type is not int:
+            value = _JSON_CONVERTERS.get(value_type, _json_value)(value)
+        serialized_record[key] = value
+    for (_, key), value in zip(plan.computed_fields, plan.computed_values(record)):
+        if value is not None:
+            serialized_record[key] = _json_value(value)
+    return serialized_record
+
+
+def _ssm_float(value: float) -> str:
+    # Non finite floats are serialized as JSON nulls
+    return repr(value) if math.isfinite(value) else "None"
+
+
+def _ssm_value(value) -> str:
+    """Render a field value as it is after a JSON round trip."""
+    if isinstance(value, enum.Enum):
+        value = value.value
+    render = _SSM_RENDERERS.get(type(value))
+    if render is not None:
+        return render(value)
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float):
+        return _ssm_float(value)
+    return str(json.loads(pydantic.TypeAdapter(type(value)).dump_json(value)))
+
+
+# Renderers of the field values of the most common types
+_SSM_RENDERERS: typing.Dict[type, typing.Callable[[typing.Any], str]] = {
+    str: str,
+    int: str,
+    float: _ssm_float,
+    m_uuid.UUID: str,
+}
+
+
+def _ssm_key_value_message(record: pydantic.BaseModel) -> str:
+    """Render a record as the "key: value" lines of an SSM message."""
+    # NOTE(aloga): do not iter over the dictionary returned by record.dict() as this
+    # is just a dictionary representation of the object, where no serialization is
+    # done. The lines are rendered from the field values as they would be after
+    # serializing the record to JSON (by alias, excluding None values) and
+    # loading it again, without doing the round trip.
+    plan = serialization_plan(type(record))
+    values = record.__dict__
+    computed = plan.computed_values(record)
+    lines = []
+    for name, prefix, at_least_one, index in plan.ssm_fields:
+        value = values[name] if index is None else computed[index]
+        if value is None:
+            continue
+        # CPU and Wall duration may be 0 as we are converting float to int when
+        # creating the record, here we impose at least 1 second to avoid reporting
+        # no cpu time
+        if at_least_one and value == 0:
+            value = 1
+        lines.append(prefix + _SSM_RENDERERS.get(type(value), _ssm_value)(value))
+    return "\n".join(lines)
+
+
+def _private(record: pydantic.BaseModel) -> typing.Dict[str, typing.Any]:
+    """Get the private attributes of a record, without pydantic's __getattr__."""
+    # Records with private attributes always have them initialized
+    return record.__pydantic_private__  # type: ignore[return-value]
 
 
 class CloudRecord(_BaseRecord):
@@ -122,6 +332,9 @@ class CloudRecord(_BaseRecord):
     # Make these fields private, and deal with them as properties. This is done as  all
     # the accounting infrastructure needs start and end times as integers, but it is
     # easier for us to maintain them as datetime objects internally.
+    # NOTE: pydantic looks up private attributes through a slow __getattr__, so the
+    # getters below read them from __pydantic_private__ (see _private), as they are
+    # called for every record that is rendered.
     _start_time: datetime.datetime
     _end_time: typing.Optional[datetime.datetime] = None
 
@@ -150,7 +363,7 @@ class CloudRecord(_BaseRecord):
     @property
     def start_time(self) -> datetime.datetime:
         """Get start time."""
-        return self._start_time
+        return _private(self)["_start_time"]
 
     @start_time.setter
     def start_time(self, start_time: datetime.datetime) -> None:
@@ -164,15 +377,12 @@ class CloudRecord(_BaseRecord):
     @property
     def start_time_epoch(self) -> int:
         """Get start time as epoch."""
-        return int(self._start_time.timestamp())
+        return int(self.start_time.timestamp())
 
     @property
     def end_time(self) -> typing.Optional[datetime.datetime]:
         """Get end time."""
-        if self._end_time is not None:
-            return self._end_time
-        else:
-            return None
+        return _private(self)["_end_time"]
 
     @end_time.setter
     def end_time(self, end_time: datetime.datetime) -> None:
@@ -183,8 +393,9 @@ class CloudRecord(_BaseRecord):
     @property
     def end_time_epoch(self) -> typing.Optional[int]:
         """Get end time as epoch."""
-        if self.end_time:
-            return int(self.end_time.timestamp())
+        end_time = self.end_time
+        if end_time:
+            return int(end_time.timestamp())
         else:
             return 0
 
@@ -192,12 +403,12 @@ class CloudRecord(_BaseRecord):
     @property
     def wall_duration(self) -> typing.Optional[int]:
         """Get wall duration."""
-        duration = None
-        if self._wall_duration is not None:
-            duration = self._wall_duration
-        elif self.end_time:
-            aux = self.end_time - self.start_time
-            duration = int(aux.total_seconds())
+        duration = _private(self)["_wall_duration"]
+        if duration is None:
+            end_time = self.end_time
+            if end_time:
+                aux = end_time - self.start_time
+                duration = int(aux.total_seconds())
         return duration
 
     @wall_duration.setter
@@ -209,11 +420,11 @@ class CloudRecord(_BaseRecord):
     @property
     def cpu_duration(self) -> typing.Optional[int]:
         """Get CPU duration."""
-        duration = None
-        if self._cpu_duration is not None:
-            duration = self._cpu_duration
-        elif self.wall_duration is not None and self.cpu_count:
-            duration = self.wall_duration * self.cpu_count
+        duration = _private(self)["_cpu_duration"]
+        if duration is None and self.cpu_count:
+            wall_duration = self.wall_duration
+            if wall_duration is not None:
+                duration = wall_duration * self.cpu_count
         return duration
 
     @cpu_duration.setter
@@ -221,25 +432,34 @@ class CloudRecord(_BaseRecord):
         """Set the CPU duration."""
         self._cpu_duration = value
 
+    def _computed_values(self) -> tuple:
+        """Get the values of the computed fields, in the order of the model.
+
+        The values are the same as those of the properties above, but they are
+        evaluated together when the record is serialized, so that the wall
+        duration is only calculated once.
+        """
+        private = _private(self)
+        start_time = private["_start_time"]
+        end_time = private["_end_time"]
+        wall_duration = private["_wall_duration"]
+        if wall_duration is None and end_time:
+            wall_duration = int((end_time - start_time).total_seconds())
+        cpu_duration = private["_cpu_duration"]
+        if cpu_duration is None and wall_duration is not None:
+            cpu_count = self.__dict__["cpu_count"]
+            if cpu_count:
+                cpu_duration = wall_duration * cpu_count
+        return (
+            int(start_time.timestamp()),
+            int(end_time.timestamp()) if end_time else 0,
+            wall_duration,
+            cpu_duration,
+        )
+
     def ssm_message(self):
         """Render record as the expected SSM message."""
-        opts = {
-            "by_alias": True,
-            "exclude_none": True,
-        }
-        # NOTE(aloga): do not iter over the dictionary returned by record.dict() as this
-        # is just a dictionary representation of the object, where no serialization is
-        # done. In order to get objects correctly serialized we need to convert to JSON,
-        # then reload the model
-        serialized_record = json.loads(self.model_dump_json(**opts))
-        # CPU and Wall duration may be 0 as we are converting float to int when creating
-        # the record, here we impose at least 1 second to avoid reporting no cpu time
-        for f in ["CpuDuration", "WallDuration"]:
-            if f in serialized_record and serialized_record[f] == 0:
-                serialized_record[f] = 1
-        aux = [f"{k}: {v}" for k, v in serialized_record.items()]
-        aux.sort()
-        return "\n".join(aux)
+        return _ssm_key_value_message(self)
 
     model_config = dict(
         alias_generator=map_cloud_fields,
@@ -248,9 +468,87 @@ class CloudRecord(_BaseRecord):
     )
 
 
-def map_ip_fields(field: str) -> str:
-    """Map object fields to accounting Public IP Usage record fields."""
-    d = {
+# Keys of the Cloud Accounting Summary Record fields, by attribute
+_CLOUD_SUMMARY_ALIASES = types.MappingProxyType(
+    {
+        "site_name": "SiteName",
+        "compute_service": "CloudComputeService",
+        "month": "Month",
+        "year": "Year",
+        "user_dn": "GlobalUserName",
+        "fqan": "VO",
+        "status": "Status",
+        "cloud_type": "CloudType",
+        "image_id": "ImageId",
+        "earliest_start_time": "EarliestStartTime",
+        "latest_start_time": "LatestStartTime",
+        "wall_duration": "WallDuration",
+        "cpu_duration": "CpuDuration",
+        "cpu_count": "CpuCount",
+        "public_ip_count": "PublicIPCount",
+        "memory": "Memory",
+        "disk": "Disk",
+        "benchmark_type": "BenchmarkType",
+        "benchmark_value": "Benchmark",
+        "number_of_vms": "NumberOfVMs",
+    }
+)
+
+
+def map_cloud_summary_fields(value: str) -> str:
+    """Map object fields to Cloud Accounting Summary Record fields."""
+    return _CLOUD_SUMMARY_ALIASES.get(value, value)
+
+
+class CloudSummaryRecord(_BaseRecord):
+    """The CloudSummaryRecord class holds the usage of a group of cloud records.
+
+    This class is versioned, following the Cloud Accounting Summary Record
+    versions. The durations and resources are the sums of those of the records
+    in the group, and the start times are given as epochs.
+    """
+
+    version: str = pydantic.Field("0.4", exclude=True)
+
+    month: int
+    year: int
+
+    user_dn: typing.Optional[str] = None
+    fqan: str
+
+    status: _ValidCloudStatus
+
+    image_id: typing.Optional[str] = None
+
+    earliest_start_time: int
+    latest_start_time: int
+
+    wall_duration: int = 0
+    cpu_duration: int = 0
+    cpu_count: int = 0
+    public_ip_count: int = 0
+    memory: int = 0
+    disk: int = 0
+
+    benchmark_value: typing.Optional[float] = None
+    benchmark_type: typing.Optional[str] = None
+
+    number_of_vms: int = 0
+
+    def ssm_message(self):
+        """Render record as the expected SSM message."""
+        return _ssm_key_value_message(self)
+
+    model_config = dict(
+        alias_generator=map_cloud_summary_fields,
+        populate_by_name=True,
+        extra="forbid",
+    )
+
+
+# Keys of the Public IP Usage Record fields, by attribute
+_IP_ALIASES = types.MappingProxyType(
+    {
         "measure_time_epoch": "MeasurementTime",
         "site_name": "SiteName",
         "cloud_type": "CloudType",
@@ -262,7 +560,12 @@ def map_ip_fields(field: str) -> str:
         "public_ip_count": "IPCount",
         "compute_service": "CloudComputeService",
     }
-    return d.get(field, field)
+)
+
+
+def map_ip_fields(field: str) -> str:
+    """Map object fields to accounting Public IP Usage record fields."""
+    return _IP_ALIASES.get(field, field)
 
 
 class IPRecord(_BaseRecord):
@@ -312,11 +615,11 @@ class IPRecord(_BaseRecord):
 
     def ssm_message(self):
         """Render record as the expected SSM message."""
-        opts = {
-            "by_alias": True,
-            "exclude_none": True,
-        }
-        return self.model_dump_json(**opts)
+        return self.as_json()
+
+    def ssm_usage_record(self) -> typing.Dict[str, typing.Any]:
+        """Get the record as an entry of the UsageRecords of an SSM message."""
+        return self.as_dict()
 
     model_config = dict(
         alias_generator=map_ip_fields,
@@ -325,9 +628,9 @@ class IPRecord(_BaseRecord):
     )
 
 
-def map_accelerator_fields(field: str) -> str:
-    """Map object fields to accounting Accelerator Usage Record fields."""
-    d = {
+# Keys of the Accelerator Usage Record fields, by attribute
+_ACCELERATOR_ALIASES = types.MappingProxyType(
+    {
         "measurement_month": "MeasurementMonth",
         "measurement_year": "MeasurementYear",
         "associated_record_type": "AssociatedRecordType",
@@ -346,7 +649,12 @@ def map_accelerator_fields(field: str) -> str:
         "compute_service": "CloudComputeService",
         "cloud_type": "CloudType",
     }
-    return d.get(field, field)
+)
+
+
+def map_accelerator_fields(field: str) -> str:
+    """Map object fields to accounting Accelerator Usage Record fields."""
+    return _ACCELERATOR_ALIASES.get(field, field)
 
 
 class AcceleratorRecord(_BaseRecord):
@@ -394,11 +702,11 @@ class AcceleratorRecord(_BaseRecord):
 
     def ssm_message(self):
         """Render record as the expected SSM message."""
-        opts = {
-            "by_alias": True,
-            "exclude_none": True,
-        }
-        return self.model_dump_json(**opts)
+        return self.as_json()
+
+    def ssm_usage_record(self) -> typing.Dict[str, typing.Any]:
+        """Get the record as an entry of the UsageRecords of an SSM message."""
+        return self.as_dict()
 
     model_config = dict(
         alias_generator=map_accelerator_fields,
@@ -407,9 +715,9 @@ class AcceleratorRecord(_BaseRecord):
     )
 
 
-def map_storage_fields(field: str) -> str:
-    """Map object fields to accounting EMI StAR record values."""
-    d = {
+# Keys of the EMI StAR record fields, by attribute
+_STORAGE_ALIASES = types.MappingProxyType(
+    {
         "uuid": "VolumeUUID",
         "name": "RecordName",
         "user_id": "LocalUser",
@@ -429,7 +737,12 @@ def map_storage_fields(field: str) -> str:
         "cloud_type": "CloudType",
         "volume_creation_epoch": "VolumeCreationTime",
     }
-    return d.get(field, field)
+)
+
+
+def map_storage_fields(field: str) -> str:
+    """Map object fields to accounting EMI StAR record values."""
+    return _STORAGE_ALIASES.get(field, field)
 
 
 class StorageRecord(_BaseRecord):
@@ -528,10 +841,13 @@ class StorageRecord(_BaseRecord):
         """Get volume creation time as epoch."""
         return int(self._volume_creation.timestamp())
 
-    def ssm_message(self):
-        """Render record as the expected SSM message."""
-        ns = {"xmlns:sr": "http://eu-emi.eu/namespaces/2011/02/storagerecord"}
-        sr = ETree.Element("sr:StorageUsageRecord", attrib=ns)
+    def ssm_element(self) -> ETree.Element:
+        """Build the sr:StorageUsageRecord element of the record.
+
+        The element does not declare the sr namespace, so that it can be added
+        to a sr:StorageUsageRecords document that declares it.
+        """
+        sr = ETree.Element("sr:StorageUsageRecord")
         ETree.SubElement(
             sr,
             "sr:RecordIdentity",
@@ -553,6 +869,12 @@ class StorageRecord(_BaseRecord):
         ETree.SubElement(sr, "sr:EndTime").text = self.measure_time.isoformat()
         capacity = str(int(self.capacity * 1073741824))  # 1 GiB = 2^30
         ETree.SubElement(sr, "sr:ResourceCapacityUsed").text = capacity
+        return sr
+
+    def ssm_message(self):
+        """Render record as the expected SSM message."""
+        sr = self.ssm_element()
+        sr.set("xmlns:sr", STORAGE_RECORD_NAMESPACE)
         return ETree.tostring(sr)
 
     model_config = dict(
@@ -562,13 +884,14 @@ class StorageRecord(_BaseRecord):
     )
 
 
-def map_energy_fields(field: str) -> str:
-    """Map object fields to accounting Energy Usage Record fields."""
-    d = {
+# Keys of the Energy Usage Record fields, by attribute
+_ENERGY_ALIASES = types.MappingProxyType(
+    {
         "exec_unit_id": "ExecUnitID",
         "start_exec_time": "StartExecTime",
         "end_exec_time": "EndExecTime",
         "energy_wh": "EnergyWh",
+        "energy_wh_by_metric": "EnergyWhByMetric",
         "work": "Work",
         "efficiency": "Efficiency",
         "wall_clock_time_s": "WallClockTime_s",
@@ -582,7 +905,12 @@ def map_energy_fields(field: str) -> str:
         "cloud_type": "CloudType",
         "compute_service": "CloudComputeService",
     }
-    return d.get(field, field)
+)
+
+
+def map_energy_fields(field: str) -> str:
+    """Map object fields to accounting Energy Usage Record fields."""
+    return _ENERGY_ALIASES.get(field, field)
 
 
 class EnergyRecord(_BaseRecord):
@@ -598,6 +926,8 @@ class EnergyRecord(_BaseRecord):
     start_exec_time: str
     end_exec_time: str
     energy_wh: float
+    # Energy (Wh) obtained from each power metric, if several are used
+    energy_wh_by_metric: typing.Optional[typing.Dict[str, float]] = None
     work: float
     efficiency: float
     wall_clock_time_s: int
@@ -610,14 +940,307 @@ class EnergyRecord(_BaseRecord):
 
     def ssm_message(self):
         """Render record as the expected SSM message."""
-        opts = {
-            "by_alias": True,
-            "exclude_none": True,
-        }
-        return self.model_dump_json(**opts)
+        return self.as_json()
+
+    def ssm_usage_record(self) -> typing.Dict[str, typing.Any]:
+        """Get the record as an entry of the UsageRecords of an SSM message."""
+        return self.as_dict()
 
     model_config = dict(
         alias_generator=map_energy_fields,
         populate_by_name=True,
         extra="forbid",
     )
+
+
+class CompactRecord(object):
+    """Base class of the compact records, used while the records are extracted.
+
+    A compact record keeps the values of the fields of a record in slots, as they
+    are given, without validating them nor computing any derived value, so that it
+    is much cheaper to create, to update and to keep in memory than the full
+    record. The full record is built with :meth:`to_record`, either validating the
+    values, or trusting that they have already been normalised by the extractor.
+    """
+
+    __slots__: typing.Tuple[str, ...] = ()
+
+    # Class of the full record, fields that are set through its properties once it
+    # has been created, and types that trusted values are converted to if they are
+    # given with a different type. The rest of attributes are got from the full
+    # record class.
+    record_class: typing.ClassVar[typing.Type[_BaseRecord]]
+    _property_fields: typing.ClassVar[typing.Tuple[str, ...]] = ()
+    _conversions: typing.ClassVar[typing.Dict[str, typing.Callable]] = {}
+    _init_fields: typing.ClassVar[typing.Tuple[str, ...]] = ()
+    _defaults: typing.ClassVar[typing.Dict[str, typing.Any]] = {}
+    _model_values: typing.ClassVar[typing.Dict[str, typing.Any]] = {}
+    _model_fields: typing.ClassVar[typing.Tuple[str, ...]] = ()
+    _private_fields: typing.ClassVar[typing.Tuple[typing.Tuple[str, str], ...]] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        """Get the fields and their default values from the full record class."""
+        super().__init_subclass__(**kwargs)
+        model_fields = cls.record_class.model_fields
+        defaults = {
+            name: field.default
+            for name, field in model_fields.items()
+            if not field.is_required()
+        }
+        for name, attr in cls.record_class.__private_attributes__.items():
+            if attr.default is not pydantic_core.PydanticUndefined:
+                defaults[name.lstrip("_")] = attr.default
+        cls._defaults = {k: v for k, v in defaults.items() if k in cls.__slots__}
+        cls._init_fields = tuple(
+            name for name in cls.__slots__ if name not in cls._property_fields
+        )
+
+        # Values of the fields of the full record, in their order, with the default
+        # values of the fields that are not kept in the compact record
+        cls._model_values = {name: defaults.get(name) for name in model_fields}
+        cls._model_fields = tuple(n for n in model_fields if n in cls.__slots__)
+        cls._private_fields = tuple(
+            (name, name.lstrip("_")) for name in cls.record_class.__private_attributes__
+        )
+
+    def __init__(self, **kwargs: typing.Any):
+        """Initialize the record with the values of its fields."""
+        values = dict(self._defaults, **kwargs)
+        try:
+            for name, value in values.items():
+                setattr(self, name, value)
+        except AttributeError:
+            unexpected = values.keys() - set(self.__slots__)
+            raise TypeError(
+                f"{type(self).__name__} got unexpected fields: "
+                f"{', '.join(sorted(unexpected))}"
+            ) from None
+        if len(values) != len(self.__slots__):
+            missing = set(self.__slots__) - values.keys()
+            raise TypeError(
+                f"{type(self).__name__} is missing the fields: "
+                f"{', '.join(sorted(missing))}"
+            )
+
+    def __repr__(self):
+        """Get a representation of the record, with the values of its fields."""
+        fields = ", ".join(f"{n}={getattr(self, n)!r}" for n in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def to_record(self, trusted: bool = False) -> _BaseRecord:
+        """Build the full record.
+
+        :param trusted: Trust the values of the fields, instead of validating them.
+                        They must already have the types of the fields of the full
+                        record, except for the conversions of the compact record.
+        :raises pydantic.ValidationError: If the values are not valid.
+        """
+        if trusted:
+            return self._to_trusted_record()
+
+        record = self.record_class(
+            **{name: getattr(self, name) for name in self._init_fields}
+        )
+        for name in self._property_fields:
+            value = getattr(self, name)
+            if value is not None:
+                setattr(record, name, value)
+        return record
+
+    def _to_trusted_record(self) -> _BaseRecord:
+        values = dict(self._model_values)
+        for name in self._model_fields:
+            values[name] = getattr(self, name)
+        for name, conversion in self._conversions.items():
+            value = values[name]
+            if value is not None and type(value) is not conversion:
+                values[name] = conversion(value)
+
+        # NOTE: this is what pydantic's model_construct() does, but looking up the
+        # aliases and the defaults of every field makes model_construct() slower
+        # than validating the values, so the record is built directly.
+        record = self.record_class.__new__(self.record_class)
+        object.__setattr__(record, "__dict__", values)
+        object.__setattr__(record, "__pydantic_fields_set__", set(self._model_fields))
+        object.__setattr__(record, "__pydantic_extra__", None)
+        object.__setattr__(
+            record,
+            "__pydantic_private__",
+            {name: getattr(self, field) for name, field in self._private_fields},
+        )
+        return record
+
+
+class CompactCloudRecord(CompactRecord):
+    """Compact representation of a :class:`CloudRecord`."""
+
+    __slots__ = (
+        "uuid",
+        "name",
+        "user_id",
+        "user_dn",
+        "group_id",
+        "fqan",
+        "status",
+        "image_id",
+        "public_ip_count",
+        "cpu_count",
+        "memory",
+        "disk",
+        "start_time",
+        "end_time",
+        "suspend_duration",
+        "wall_duration",
+        "cpu_duration",
+        "benchmark_value",
+        "benchmark_type",
+        "site_name",
+        "cloud_type",
+        "compute_service",
+    )
+
+    record_class = CloudRecord
+    _property_fields = ("wall_duration", "cpu_duration")
+    _conversions = {"uuid": m_uuid.UUID, "status": _ValidCloudStatus}
+
+    uuid: typing.Union[str, m_uuid.UUID]
+    name: typing.Union[str, bytes]
+    user_id: typing.Union[str, bytes]
+    user_dn: typing.Optional[typing.Union[str, bytes]]
+    group_id: str
+    fqan: str
+    status: str
+    image_id: typing.Optional[str]
+    public_ip_count: int
+    cpu_count: int
+    memory: int
+    disk: int
+    start_time: datetime.datetime
+    end_time: typing.Optional[datetime.datetime]
+    suspend_duration: typing.Optional[int]
+    wall_duration: typing.Optional[int]
+    cpu_duration: typing.Optional[int]
+    benchmark_value: typing.Optional[float]
+    benchmark_type: typing.Optional[str]
+    site_name: str
+    cloud_type: str
+    compute_service: str
+
+
+class CompactAcceleratorRecord(CompactRecord):
+    """Compact representation of an :class:`AcceleratorRecord`."""
+
+    __slots__ = (
+        "uuid",
+        "user_dn",
+        "fqan",
+        "count",
+        "available_duration",
+        "active_duration",
+        "measurement_month",
+        "measurement_year",
+        "associated_record_type",
+        "accelerator_type",
+        "cores",
+        "model",
+        "benchmark_value",
+        "benchmark_type",
+        "site_name",
+        "cloud_type",
+        "compute_service",
+    )
+
+    record_class = AcceleratorRecord
+    _property_fields = ("active_duration",)
+    _conversions = {"uuid": m_uuid.UUID}
+
+    uuid: typing.Union[str, m_uuid.UUID]
+    user_dn: typing.Optional[typing.Union[str, bytes]]
+    fqan: str
+    count: int
+    available_duration: int
+    active_duration: typing.Optional[int]
+    measurement_month: int
+    measurement_year: int
+    associated_record_type: str
+    accelerator_type: str
+    cores: typing.Optional[int]
+    model: str
+    benchmark_value: typing.Optional[float]
+    benchmark_type: typing.Optional[str]
+    site_name: str
+    cloud_type: str
+    compute_service: str
+
+
+class CompactStorageRecord(CompactRecord):
+    """Compact representation of a :class:`StorageRecord`."""
+
+    __slots__ = (
+        "uuid",
+        "name",
+        "user_id",
+        "user_dn",
+        "group_id",
+        "fqan",
+        "active_duration",
+        "attached_duration",
+        "attached_to",
+        "measure_time",
+        "start_time",
+        "volume_creation",
+        "storage_type",
+        "status",
+        "capacity",
+        "site_name",
+        "cloud_type",
+        "compute_service",
+    )
+
+    record_class = StorageRecord
+    _conversions = {"uuid": m_uuid.UUID}
+
+    uuid: typing.Union[str, m_uuid.UUID]
+    name: str
+    user_id: str
+    user_dn: typing.Optional[str]
+    group_id: str
+    fqan: str
+    active_duration: typing.Union[int, float]
+    attached_duration: typing.Optional[float]
+    attached_to: typing.Optional[str]
+    measure_time: datetime.datetime
+    start_time: datetime.datetime
+    volume_creation: datetime.datetime
+    storage_type: typing.Optional[str]
+    status: str
+    capacity: int
+    site_name: str
+    cloud_type: str
+    compute_service: str
+
+
+def validate_records(records: typing.List, trusted: bool = False) -> typing.List:
+    """Replace the compact records of a list with full records.
+
+    The records are replaced in place, so that the compact records can be freed as
+    soon as their full records are built. Records that are not valid are logged and
+    dropped, other records are kept as they are.
+
+    :param records: List of records, that may contain compact records.
+    :param trusted: Trust the values of the compact records, instead of validating
+                    them (see :meth:`CompactRecord.to_record`).
+    :returns: The same list, with full records only.
+    """
+    invalid = False
+    for i, r in enumerate(records):
+        if isinstance(r, CompactRecord):
+            try:
+                records[i] = r.to_record(trusted)
+            except (pydantic.ValidationError, TypeError, ValueError) as e:
+                LOG.error(f"Dropping record {r!r}, as it is not valid: {e}")
+                records[i] = None
+                invalid = True
+    if invalid:
+        records[:] = [r for r in records if r is not None]
+    return records
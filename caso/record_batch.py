@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing a container of records grouped by their type.
+
+A :class:`RecordBatch` groups the records by their type once, so that the
+records of a type can be selected without scanning all the records again. The
+times and durations of the records are available as typed columns
+(:class:`array.array` objects), that are built when they are first requested.
+As they implement the buffer protocol, they can be handed to NumPy or Arrow
+without copying them (e.g. with ``numpy.frombuffer``).
+
+If NumPy is available the aggregates of the columns are vectorised, otherwise
+a pure Python implementation is used.
+"""
+
+import array
+import typing
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None  # type: ignore[assignment]
+
+import caso.record
+
+# Record types, by the name used to configure them
+RECORD_TYPES: typing.Dict[str, type] = {
+    "cloud": caso.record.CloudRecord,
+    "ip": caso.record.IPRecord,
+    "accelerator": caso.record.AcceleratorRecord,
+    "storage": caso.record.StorageRecord,
+    "energy": caso.record.EnergyRecord,
+}
+
+_TYPE_NAMES = {cls: name for name, cls in RECORD_TYPES.items()}
+
+# Columns of each record type, with the type code of their arrays. Values that
+# are not set (None) are stored as zeros.
+COLUMNS: typing.Dict[str, typing.Dict[str, str]] = {
+    "cloud": {
+        "start_time_epoch": "q",
+        "end_time_epoch": "q",
+        "wall_duration": "q",
+        "cpu_duration": "q",
+        "cpu_count": "q",
+        "memory": "q",
+        "disk": "q",
+        "public_ip_count": "q",
+    },
+    "ip": {
+        "measure_time_epoch": "q",
+        "public_ip_count": "q",
+    },
+    "accelerator": {
+        "available_duration": "q",
+        "active_duration": "q",
+        "count": "q",
+    },
+    "storage": {
+        "start_time_epoch": "q",
+        "measure_time_epoch": "q",
+        "active_duration": "q",
+        "attached_duration": "d",
+        "capacity": "q",
+    },
+    "energy": {
+        "energy_wh": "d",
+        "work": "d",
+        "efficiency": "d",
+        "wall_clock_time_s": "q",
+        "cpu_duration_s": "q",
+        "suspend_duration_s": "q",
+    },
+}
+
+
+def record_type(record) -> typing.Optional[str]:
+    """Get the name of the type of a record, or None if it is not known."""
+    try:
+        return _TYPE_NAMES[type(record)]
+    except KeyError:
+        pass
+    for name, cls in RECORD_TYPES.items():
+        if isinstance(record, cls):
+            return name
+    return None
+
+
+class RecordBatch(object):
+    """Records grouped by their type, with typed columns of their values.
+
+    The batch keeps the order of the records of each type, and the types are
+    iterated in the order in which they were first found. Records of unknown
+    types are kept under the ``None`` type.
+
+    :param records: Iterable with the records, or another batch, whose groups
+                    and columns are shared without copying them.
+    """
+
+    def __init__(self, records: typing.Iterable = ()):
+        """Group the records by their type."""
+        self._groups: typing.Dict[typing.Optional[str], typing.List] = {}
+        self._columns: typing.Dict[typing.Tuple[str, str], array.array] = {}
+        if isinstance(records, RecordBatch):
+            self._groups.update(records._groups)
+            self._columns = records._columns
+            return
+
+        for record in records:
+            name = record_type(record)
+            group = self._groups.get(name)
+            if group is None:
+                group = self._groups[name] = []
+            group.append(record)
+
+    def __len__(self):
+        """Get the number of records."""
+        return sum(len(group) for group in self._groups.values())
+
+    def __iter__(self):
+        """Iterate over the records, grouped by their type."""
+        for group in self._groups.values():
+            yield from group
+
+    def __repr__(self):
+        """Get a representation of the batch, with its number of records."""
+        counts = ", ".join(f"{k}={len(v)}" for k, v in self._groups.items())
+        return f"{type(self).__name__}({counts})"
+
+    @property
+    def record_types(self) -> typing.List[typing.Optional[str]]:
+        """Get the types of the records in the batch."""
+        return list(self._groups)
+
+    def records(self, record_type: typing.Optional[str]) -> typing.List:
+        """Get the records of a type.
+
+        The list is not copied, so it must not be modified.
+        """
+        return self._groups.get(record_type, [])
+
+    def select(self, record_types: typing.Iterable[str]) -> "RecordBatch":
+        """Get a batch with the records of some types, without copying them."""
+        batch = RecordBatch(self)
+        record_types = set(record_types)
+        batch._groups = {k: v for k, v in self._groups.items() if k in record_types}
+        return batch
+
+    def column(self, record_type: str, name: str) -> array.array:
+        """Get a column with the values of the records of a type.
+
+        The column is built the first time it is requested, and it is shared
+        by the batches selected from this one, so it must not be modified.
+
+        :raises KeyError: If the record type does not have the column.
+        """
+        typecode = COLUMNS[record_type][name]
+        key = (record_type, name)
+        column = self._columns.get(key)
+        if column is None:
+            zero = 0.0 if typecode == "d" else 0
+            column = array.array(typecode)
+            for record in self.records(record_type):
+                value = getattr(record, name)
+                column.append(zero if value is None else value)
+            self._columns[key] = column
+        return column
+
+    def sum(self, record_type: str, name: str) -> typing.Union[int, float]:
+        """Get the sum of a column of the records of a type."""
+        column = self.column(record_type, name)
+        if numpy is not None:
+            return numpy.frombuffer(column, dtype=column.typecode).sum().item()
+        return sum(column)
+
+    def min(self, record_type: str, name: str) -> typing.Union[int, float, None]:
+        """Get the minimum of a column of the records of a type, if any."""
+        column = self.column(record_type, name)
+        if not column:
+            return None
+        if numpy is not None:
+            return numpy.frombuffer(column, dtype=column.typecode).min().item()
+        return min(column)
+
+    def max(self, record_type: str, name: str) -> typing.Union[int, float, None]:
+        """Get the maximum of a column of the records of a type, if any."""
+        column = self.column(record_type, name)
+        if not column:
+            return None
+        if numpy is not None:
+            return numpy.frombuffer(column, dtype=column.typecode).max().item()
+        return max(column)
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing the response cache for slowly changing OpenStack catalogues.
+
+Catalogue like resources (flavors and their extra specs, images, the Keystone
+project list) rarely change between runs. Responses to those requests are kept
+in a cache, together with their validators: the ``ETag`` and ``Last-Modified``
+headers when the service sends them, and a hash of the content otherwise.
+
+Fresh responses are served locally. Once they get old they are revalidated with
+a conditional request (``If-None-Match`` / ``If-Modified-Since``), so that an
+unchanged catalogue is not downloaded again if the service supports it. Without
+an ``ETag`` or a ``Last-Modified`` header, the date in which the cached response
+was downloaded is sent in the ``If-Modified-Since`` header.
+"""
+
+import email.utils
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import typing
+
+import requests
+import requests.structures
+from oslo_config import cfg
+from oslo_log import log
+
+opts = [
+    cfg.BoolOpt(
+        "enabled",
+        default=True,
+        help="Cache the responses to the requests that list slowly changing "
+        "catalogues (see url_patterns), and store them in the spool directory "
+        "so that they are revalidated instead of downloaded in the next runs.",
+    ),
+    cfg.IntOpt(
+        "max_age",
+        default=600,
+        min=0,
+        help="Number of seconds that a cached response is served without "
+        "contacting the service. Older responses are revalidated with a "
+        "conditional request.",
+    ),
+    cfg.ListOpt(
+        "url_patterns",
+        default=[
+            r"/flavors/detail",
+            r"/flavors/[^/]+/os-extra_specs",
+            r"/images(\?|$)",
+            r"/projects(\?|$)",
+        ],
+        help="Regular expressions matching the URLs (as requested by the "
+        "OpenStack clients) of the catalogues whose responses are cached.",
+    ),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group="response_cache")
+
+LOG = log.getLogger(__name__)
+
+CACHE_FILE = "response_cache.json"
+
+# Headers that are not kept in the cache, as they only make sense for the
+# original response
+_SKIPPED_HEADERS = frozenset(
+    [
+        "connection",
+        "content-encoding",
+        "content-length",
+        "date",
+        "set-cookie",
+        "transfer-encoding",
+    ]
+)
+
+# Entries that have not been validated in this number of seconds are dropped
+# when the cache is stored.
+_MAX_STALE = 7 * 86400
+
+
+def content_hash(content):
+    """Get the hash used to check if a response content has changed."""
+    return hashlib.sha256(content).hexdigest()
+
+
+class ResponseCache(object):
+    """A cache of GET responses, with their validators.
+
+    :param path: File where the cache is stored, None to keep it in memory.
+    :param max_age: Seconds that a response is served without revalidation.
+    """
+
+    def __init__(self, path=None, max_age=600, clock=time.time):
+        """Initialize an empty cache."""
+        self.path = path
+        self.max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        self.stats = {"hits": 0, "not_modified": 0, "unchanged": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(url, project_id, **kwargs):
+        """Build the cache key for a request.
+
+        The key includes everything that can change the response of a
+        catalogue request: the project that the token is scoped to, the
+        endpoint, the microversion and the request headers.
+        """
+        parts = {
+            "url": url,
+            "project_id": project_id,
+            "endpoint_filter": kwargs.get("endpoint_filter"),
+            "endpoint_override": kwargs.get("endpoint_override"),
+            "microversion": kwargs.get("microversion"),
+            "headers": sorted((kwargs.get("headers") or {}).items()),
+            "params": sorted((kwargs.get("params") or {}).items()),
+        }
+        return json.dumps(parts, sort_keys=True, default=str)
+
+    def get_fresh(self, key):
+        """Get a response for a key, if it is fresh enough to be served."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._clock() - entry["validated"] >= self.max_age:
+                return None
+            self.stats["hits"] += 1
+        return _build_response(entry)
+
+    def conditional_headers(self, key):
+        """Get the headers to revalidate the cached response for a key."""
+        with self._lock:
+            entry = self._entries.get(key)
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        elif not entry.get("etag") and entry.get("downloaded"):
+            # Without validators, ask if the catalogue changed since we got it
+            headers["If-Modified-Since"] = entry["downloaded"]
+        return headers
+
+    def not_modified(self, key, request=None):
+        """Get the cached response for a key, after a HTTP 304 from the service.
+
+        :param request: Request that was answered with the HTTP 304.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry["validated"] = self._clock()
+            self.stats["not_modified"] += 1
+        return _build_response(entry, request)
+
+    def store(self, key, resp):
+        """Store a successful response, checking if its content changed."""
+        try:
+            body = resp.content.decode("utf-8")
+        except UnicodeDecodeError:
+            return
+        digest = content_hash(resp.content)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["hash"] == digest:
+                self.stats["unchanged"] += 1
+            else:
+                self.stats["misses"] += 1
+            self._entries[key] = {
+                "url": resp.url,
+                "headers": {
+                    k: v
+                    for k, v in resp.headers.items()
+                    if k.lower() not in _SKIPPED_HEADERS
+                },
+                "body": body,
+                "hash": digest,
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "downloaded": resp.headers.get("Date")
+                or email.utils.formatdate(self._clock(), usegmt=True),
+                "validated": self._clock(),
+            }
+
+    def hit_rate(self):
+        """Get the ratio of requests that did not download the catalogue."""
+        total = sum(self.stats.values())
+        if not total:
+            return 0.0
+        return (self.stats["hits"] + self.stats["not_modified"]) / total
+
+    def load(self):
+        """Load the entries stored in the cache file."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as fd:
+                entries = json.load(fd)
+        except (OSError, ValueError) as e:
+            LOG.warning(f"Cannot read response cache '{self.path}', ignoring - {e}")
+            return
+        if not isinstance(entries, dict):
+            return
+        with self._lock:
+            self._entries.update(entries)
+
+    def save(self):
+        """Store the entries that are still useful in the cache file."""
+        if not self.path:
+            return
+        now = self._clock()
+        with self._lock:
+            entries = {
+                k: v
+                for k, v in self._entries.items()
+                if now - v["validated"] < _MAX_STALE
+            }
+
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as fd:
+                json.dump(entries, fd)
+            os.replace(tmp, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            LOG.warning(f"Cannot write response cache '{self.path}' - {e}")
+
+
+def _build_response(entry, request=None):
+    """Build a response from a cache entry.
+
+    :param request: Request of the response, a GET request to the URL of the
+                    entry by default.
+    """
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.reason = "OK"
+    resp.url = entry["url"]
+    resp.headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+    resp.encoding = "utf-8"
+    resp._content = entry["body"].encode("utf-8")
+    if request is None:
+        request = requests.Request("GET", entry["url"]).prepare()
+    resp.request = request
+    return resp
+
+
+_CACHE: typing.Optional[ResponseCache] = None
+_CACHE_LOCK = threading.Lock()
+_PATTERNS: typing.Optional[typing.List[typing.Pattern]] = None
+
+
+def is_cacheable(url, method):
+    """Check if a request is for a catalogue whose response can be cached."""
+    global _PATTERNS
+
+    if method.upper() != "GET" or not CONF.response_cache.enabled:
+        return False
+    if _PATTERNS is None:
+        _PATTERNS = [re.compile(p) for p in CONF.response_cache.url_patterns]
+    return any(p.search(url) for p in _PATTERNS)
+
+
+def get_cache():
+    """Get the response cache shared by all the sessions of this run."""
+    global _CACHE
+
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            path = os.path.join(CONF.spooldir, CACHE_FILE)
+            _CACHE = ResponseCache(path, CONF.response_cache.max_age)
+            _CACHE.load()
+        return _CACHE
+
+
+def save():
+    """Log the hit rate of the shared cache and store it in the spool directory."""
+    with _CACHE_LOCK:
+        cache = _CACHE
+    if cache is None:
+        return
+    stats = cache.stats
+    LOG.info(
+        f"Catalogue response cache: {stats['hits']} served locally, "
+        f"{stats['not_modified']} not modified, {stats['unchanged']} downloaded "
+        f"but unchanged, {stats['misses']} downloaded (hit rate "
+        f"{cache.hit_rate():.0%})"
+    )
+    cache.save()
+
+
+def reset():
+    """Drop the shared response cache, so that it is loaded again."""
+    global _CACHE, _PATTERNS
+
+    with _CACHE_LOCK:
+        _CACHE = None
+        _PATTERNS = None
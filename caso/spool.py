@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing a compact binary spool of records.
+
+Records are written to a spool file so that they can be pushed to the messengers
+again later (e.g. to checkpoint the extracted records before pushing them),
+without extracting them again from the OpenStack APIs.
+
+A spool file starts with a magic string and a header with the fields of each
+record type. Then, each record is stored as a frame with its type and the
+length of its values, followed by the values, serialized with :mod:`marshal`.
+Dates, UUIDs and enumerations are stored as plain values. The records are read
+through a memory map, and they are built directly from the stored values, as
+they were already validated when they were written.
+
+Spool files are meant to be written and read by cASO itself, as they are not
+safe to read from untrusted sources.
+"""
+
+import datetime
+import enum
+import marshal
+import mmap
+import operator
+import os
+import struct
+import typing
+import uuid
+
+import pydantic_core
+
+from caso import exception
+import caso.record_batch
+
+MAGIC = b"CASOSPL1"
+
+# Version of the marshal format (stable across all the supported Python versions)
+_MARSHAL_VERSION = 4
+
+# Header length, and frame with the type of a record and the length of its values
+_LENGTH = struct.Struct("<I")
+_FRAME = struct.Struct("<BI")
+
+# Types of records that can be spooled, by their code in the spool
+_TYPES = tuple(caso.record_batch.RECORD_TYPES.items())
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_UTC_EPOCH = _EPOCH.replace(tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def _dump_datetime(value: datetime.datetime):
+    # Naive dates are stored as microseconds, and dates with a time zone as UTC
+    # microseconds along with their offset in seconds
+    offset = value.utcoffset()
+    if offset is None:
+        return (value - _EPOCH) // _MICROSECOND
+    if not offset:
+        return ((value - _UTC_EPOCH) // _MICROSECOND, 0)
+    return (
+        (value - _UTC_EPOCH) // _MICROSECOND,
+        offset // datetime.timedelta(seconds=1),
+    )
+
+
+def _load_datetime(value) -> datetime.datetime:
+    if type(value) is int:
+        return _EPOCH + datetime.timedelta(microseconds=value)
+    microseconds, offset = value
+    date = _UTC_EPOCH + datetime.timedelta(microseconds=microseconds)
+    if offset:
+        date = date.astimezone(datetime.timezone(datetime.timedelta(seconds=offset)))
+    return date
+
+
+def _dump_uuid(value: uuid.UUID) -> int:
+    return value.int
+
+
+def _load_uuid(value: int) -> uuid.UUID:
+    # NOTE: this is what uuid.UUID(int=value) does, without checking the value
+    # again, that was a valid UUID when it was stored
+    loaded = object.__new__(uuid.UUID)
+    object.__setattr__(loaded, "int", value)
+    object.__setattr__(loaded, "is_safe", uuid.SafeUUID.unknown)
+    return loaded
+
+
+def _dump_enum(value: enum.Enum):
+    return value.value
+
+
+def _converters(annotation) -> typing.Optional[typing.Tuple[typing.Callable, ...]]:
+    """Get the functions that dump and load the values of a type, if needed."""
+    args = [a for a in typing.get_args(annotation) if a is not type(None)]
+    if len(args) == 1:
+        annotation = args[0]
+    if annotation is datetime.datetime:
+        return (_dump_datetime, _load_datetime)
+    if annotation is uuid.UUID:
+        return (_dump_uuid, _load_uuid)
+    if isinstance(annotation, type) and issubclass(annotation, enum.Enum):
+        return (_dump_enum, {member.value: member for member in annotation}.__getitem__)
+    return None
+
+
+class _Layout(typing.NamedTuple):
+    """How the records of a class are stored in a spool."""
+
+    # Names of the model fields and of the private attributes, in the order in
+    # which their values are stored
+    fields: typing.Tuple[str, ...]
+    private: typing.Tuple[str, ...]
+    # Dump and load functions of the values that are not stored as they are, by
+    # their position
+    converters: typing.Dict[int, typing.Tuple[typing.Callable, ...]]
+    # Functions getting a tuple with the values of the fields from the model
+    # dictionary, and with the values of the private attributes
+    get_fields: typing.Callable
+    get_private: typing.Callable
+
+    @property
+    def names(self) -> typing.Tuple[str, ...]:
+        """Get the names of all the stored values, in order."""
+        return self.fields + self.private
+
+
+# Layouts of the record classes that have been spooled, by class
+_LAYOUTS: typing.Dict[type, _Layout] = {}
+
+
+def _layout(cls: type) -> _Layout:
+    layout = _LAYOUTS.get(cls)
+    if layout is None:
+        layout = _LAYOUTS[cls] = _build_layout(cls)
+    return layout
+
+
+def _build_layout(cls) -> _Layout:
+    fields = tuple(cls.model_fields)
+    private = tuple(cls.__private_attributes__)
+    annotations: typing.Dict[str, typing.Any] = {}
+    for base in reversed(cls.__mro__):
+        annotations.update(getattr(base, "__annotations__", {}))
+    annotations.update({n: f.annotation for n, f in cls.model_fields.items()})
+
+    converters = {}
+    for i, name in enumerate(fields + private):
+        functions = _converters(annotations.get(name))
+        if functions is not None:
+            converters[i] = functions
+    return _Layout(fields, private, converters, _getter(fields), _getter(private))
+
+
+def _getter(names: typing.Tuple[str, ...]) -> typing.Callable:
+    if len(names) == 1:
+        (name,) = names
+        return lambda values: (values[name],)
+    if not names:
+        return lambda values: ()
+    return operator.itemgetter(*names)
+
+
+def _dump(record, layout: _Layout) -> bytes:
+    values = list(layout.get_fields(record.__dict__))
+    private = record.__pydantic_private__
+    try:
+        values.extend(layout.get_private(private))
+    except (KeyError, TypeError):
+        # Private attributes without a default value that have not been set
+        values.extend([(private or {}).get(name) for name in layout.private])
+    for i, (dump, _) in layout.converters.items():
+        value = values[i]
+        if value is not None:
+            values[i] = dump(value)
+    return marshal.dumps(tuple(values), _MARSHAL_VERSION)
+
+
+class _Loader(object):
+    """Build the records of a class from the values stored in a spool.
+
+    The values are mapped to the fields of the record class by their names, so
+    that spools written with other fields can still be read. Fields that are not
+    in the spool get their default values.
+    """
+
+    def __init__(self, cls, names: typing.Sequence[str]):
+        """Map the stored values to the fields of the record class."""
+        layout = _layout(cls)
+        self.cls = cls
+        self.fields = layout.fields
+        self.private = layout.private
+        self.defaults = {
+            name: field.default
+            for name, field in cls.model_fields.items()
+            if not field.is_required()
+        }
+        self.private_defaults = {
+            name: attr.default
+            for name, attr in cls.__private_attributes__.items()
+            if attr.default is not pydantic_core.PydanticUndefined
+        }
+
+        # Positions of the values of the layout of the record class in the stored
+        # values, None if the records are stored with the same layout
+        self.positions: typing.Optional[typing.List[typing.Optional[int]]] = None
+        if tuple(names) != layout.names:
+            stored = {name: i for i, name in enumerate(names)}
+            self.positions = [stored.get(name) for name in layout.names]
+        missing = set()
+        if self.positions is not None:
+            missing = {n for n, i in zip(layout.names, self.positions) if i is None}
+        self.fields_set = frozenset(n for n in self.fields if n not in missing)
+        self.missing_fields = [n for n in self.fields if n in missing]
+        self.missing_private = [n for n in self.private if n in missing]
+        self.private_start = len(self.fields)
+        self.converters = [(i, load) for i, (_, load) in layout.converters.items()]
+
+    def _values(self, stored: typing.Sequence[typing.Any]) -> typing.List:
+        """Get the values in the order of the layout of the record class."""
+        if self.positions is None:
+            return list(stored)
+        return [None if i is None else stored[i] for i in self.positions]
+
+    def __call__(self, stored: typing.Sequence[typing.Any]):
+        """Build a record from its stored values."""
+        values = self._values(stored)
+        for i, load in self.converters:
+            value = values[i]
+            if value is not None:
+                values[i] = load(value)
+
+        fields = dict(zip(self.fields, values))
+        start = self.private_start
+        private = dict(zip(self.private, values[start:]))
+        for name in self.missing_fields:
+            fields[name] = self.defaults.get(name)
+        for name in self.missing_private:
+            if name in self.private_defaults:
+                private[name] = self.private_defaults[name]
+            else:
+                del private[name]
+
+        # NOTE: the records were validated before they were stored, so they are
+        # built directly, as CompactRecord.to_record() does for trusted records
+        record = self.cls.__new__(self.cls)
+        object.__setattr__(record, "__dict__", fields)
+        object.__setattr__(record, "__pydantic_fields_set__", set(self.fields_set))
+        object.__setattr__(record, "__pydantic_extra__", None)
+        # pydantic does not keep the private attributes of the models without them
+        object.__setattr__(
+            record, "__pydantic_private__", private if self.private else None
+        )
+        return record
+
+
+class SpoolWriter(object):
+    """Write records to a spool file.
+
+    The records are written to a temporary file, that replaces the spool file
+    once the writer is closed, so that the spool file is never left half written.
+
+    :param path: Path of the spool file.
+    """
+
+    def __init__(self, path: str):
+        """Create the spool file, writing its header."""
+        self.path = path
+        self.count = 0
+        self._tmp_path = f"{path}.tmp"
+        self._codes = {cls: code for code, (_, cls) in enumerate(_TYPES)}
+        self._file = open(self._tmp_path, "wb")
+        header = marshal.dumps(
+            tuple(
+                (name, _layout(cls).fields + _layout(cls).private)
+                for name, cls in _TYPES
+            ),
+            _MARSHAL_VERSION,
+        )
+        self._file.write(MAGIC + _LENGTH.pack(len(header)) + header)
+
+    def __enter__(self):
+        """Get the writer as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the writer, dropping the records if there was an error."""
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, records: typing.Iterable):
+        """Write a batch of records (a list of records or a record batch).
+
+        :raises ValueError: If a record is not of a known type.
+        """
+        frames = []
+        for record in records:
+            cls = type(record)
+            code = self._codes.get(cls)
+            if code is None:
+                raise ValueError(f"Cannot spool records of type {cls.__name__}")
+            data = _dump(record, _layout(cls))
+            frames.append(_FRAME.pack(code, len(data)))
+            frames.append(data)
+        self._file.write(b"".join(frames))
+        self.count += len(frames) // 2
+
+    def close(self):
+        """Close the writer, replacing the spool file with the written records."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Close the writer, dropping the written records."""
+        self._file.close()
+        os.remove(self._tmp_path)
+
+
+class SpoolReader(object):
+    """Read the records of a spool file, through a memory map.
+
+    :param path: Path of the spool file.
+    :raises caso.exception.InvalidSpoolError: If the file is not a valid spool.
+    """
+
+    def __init__(self, path: str):
+        """Open the spool file, reading its header."""
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise exception.InvalidSpoolError(path=path, reason="empty file")
+        try:
+            if self._map[: len(MAGIC)] != MAGIC:
+                raise exception.InvalidSpoolError(path=path, reason="bad magic")
+            (length,) = _LENGTH.unpack_from(self._map, len(MAGIC))
+            start = len(MAGIC) + _LENGTH.size
+            self._offset = end = start + length
+            header = marshal.loads(self._map[start:end])
+        except (struct.error, EOFError, ValueError, TypeError) as e:
+            self._map.close()
+            raise exception.InvalidSpoolError(path=path, reason=e)
+        except exception.InvalidSpoolError:
+            self._map.close()
+            raise
+
+        record_types = caso.record_batch.RECORD_TYPES
+        self._loaders = [
+            _Loader(record_types[name], names) if name in record_types else None
+            for name, names in header
+        ]
+
+    def __enter__(self):
+        """Get the reader as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the reader."""
+        self.close()
+
+    def __iter__(self):
+        """Iterate over the records of the spool."""
+        view = memoryview(self._map)
+        try:
+            offset = self._offset
+            end = len(self._map)
+            while offset < end:
+                frame = offset
+                try:
+                    code, length = _FRAME.unpack_from(view, offset)
+                    start = offset + _FRAME.size
+                    offset = start + length
+                    values = marshal.loads(view[start:offset])
+                    loader = self._loaders[code]
+                except (struct.error, EOFError, ValueError, TypeError, IndexError):
+                    raise exception.InvalidSpoolError(
+                        path=self.path, reason=f"truncated record at byte {frame}"
+                    )
+                if loader is None:
+                    continue
+                yield loader(values)
+        finally:
+            view.release()
+
+    def close(self):
+        """Close the memory map of the spool file."""
+        self._map.close()
+
+
+def write(path: str, records: typing.Iterable) -> int:
+    """Write the records (a list of records or a record batch) to a spool file.
+
+    :returns: The number of records written.
+    """
+    with SpoolWriter(path) as writer:
+        writer.write(records)
+    return writer.count
+
+
+def read(path: str) -> typing.List:
+    """Read all the records of a spool file.
+
+    :raises caso.exception.InvalidSpoolError: If the file is not a valid spool.
+    """
+    with SpoolReader(path) as reader:
+        return list(reader)
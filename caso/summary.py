@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2014 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Module containing the aggregation of cloud records into summary records.
+
+APEL accepts cloud summary records, holding the usage of all the VMs of a site
+in a month grouped by their VO, user, status, image and benchmark, instead of
+a record per VM. A :class:`CloudSummaryAggregator` rolls the cloud records up
+into these summaries as they are added, only keeping the running totals of each
+group, so that its memory does not grow with the number of records.
+
+APEL replaces the summaries with the same month and group, so each summary must
+hold the usage of the whole month, not only of the records extracted in a run.
+A :class:`CloudSummaryStore` keeps the latest usage of each VM in each month in
+a SQLite database in the spool directory, so that the summaries of the whole
+months can be published as the records of each run are added.
+
+The wall and CPU durations of the cloud records are totals since the VM was
+created, so they are divided among the months in which the VM was running (see
+:func:`monthly_usage`), and each summary only holds the usage of its month.
+"""
+
+import datetime
+import json
+import sqlite3
+import threading
+import typing
+
+import caso.record
+import caso.record_batch
+
+# Fields of the cloud records that identify the group of a summary, in order
+_KEY_FIELDS = (
+    "site_name",
+    "compute_service",
+    "cloud_type",
+    "user_dn",
+    "fqan",
+    "status",
+    "image_id",
+    "benchmark_type",
+    "benchmark_value",
+)
+
+# Columns of the cloud records (see caso.record_batch) with the usage of a VM
+_USAGE_COLUMNS = (
+    "start_time_epoch",
+    "end_time_epoch",
+    "wall_duration",
+    "cpu_duration",
+    "cpu_count",
+    "memory",
+    "disk",
+    "public_ip_count",
+)
+
+# Positions of the running totals of a group
+_COUNT, _WALL, _CPU, _CPU_COUNT, _MEMORY, _DISK, _IPS, _EARLIEST, _LATEST = range(9)
+
+
+def _utc(date: datetime.datetime) -> datetime.datetime:
+    if date.tzinfo is not None:
+        date = date.astimezone(datetime.timezone.utc)
+    return date
+
+
+def _next_month(year: int, month: int) -> typing.Tuple[int, int]:
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def monthly_usage(
+    start: int, end: int, wall: int, cpu: int
+) -> typing.List[typing.Tuple[int, int, int, int]]:
+    """Divide the usage of a VM among the months in which it was running.
+
+    The durations are divided in proportion to the time that the VM ran in each
+    month, rounding the totals at the end of each month so that the usage of
+    the months adds up to the durations given.
+
+    :param start: Start of the VM, as a UTC timestamp.
+    :param end: End of the VM (or the measure time, if it has not ended yet),
+                as a UTC timestamp.
+    :param wall: Wall duration of the VM, in seconds.
+    :param cpu: CPU duration of the VM, in seconds.
+    :returns: A list with the year, month, wall and CPU durations of each
+              month, in time order.
+    """
+    first = datetime.datetime.fromtimestamp(start, datetime.timezone.utc)
+    year, month = first.year, first.month
+    usage = []
+    accounted_wall = accounted_cpu = 0
+    while True:
+        boundary = datetime.datetime(
+            *_next_month(year, month), 1, tzinfo=datetime.timezone.utc
+        ).timestamp()
+        if boundary >= end:
+            usage.append((year, month, wall - accounted_wall, cpu - accounted_cpu))
+            return usage
+        ratio = (boundary - start) / (end - start)
+        month_wall = round(wall * ratio) - accounted_wall
+        month_cpu = round(cpu * ratio) - accounted_cpu
+        usage.append((year, month, month_wall, month_cpu))
+        accounted_wall += month_wall
+        accounted_cpu += month_cpu
+        year, month = _next_month(year, month)
+
+
+def _monthly_usage(
+    record: caso.record.CloudRecord, measure_time: datetime.datetime
+) -> typing.List[typing.Tuple[int, int, int, int]]:
+    """Divide the usage of a record among the months in which it was running."""
+    end = record.end_time_epoch or int(measure_time.timestamp())
+    return monthly_usage(
+        record.start_time_epoch,
+        end,
+        record.wall_duration or 0,
+        record.cpu_duration or 0,
+    )
+
+
+def _summary(year, month, values, totals) -> caso.record.CloudSummaryRecord:
+    """Get a summary record with the fields of its group and its totals."""
+    return caso.record.CloudSummaryRecord(
+        year=year,
+        month=month,
+        earliest_start_time=totals[_EARLIEST],
+        latest_start_time=totals[_LATEST],
+        wall_duration=totals[_WALL],
+        cpu_duration=totals[_CPU],
+        cpu_count=totals[_CPU_COUNT],
+        memory=totals[_MEMORY],
+        disk=totals[_DISK],
+        public_ip_count=totals[_IPS],
+        number_of_vms=totals[_COUNT],
+        **dict(zip(_KEY_FIELDS, values)),
+    )
+
+
+class CloudSummaryAggregator(object):
+    """Incremental aggregation of cloud records into summary records.
+
+    The usage of a record is divided among the months in which the VM was
+    running, until it ended or until the measure time if it has not ended yet.
+    Only the totals of each group are kept, so the records can be freed once
+    they are added.
+
+    :param measure_time: Date in which the records were measured, used for the
+                         records that have not ended (default: now).
+    """
+
+    def __init__(self, measure_time: typing.Optional[datetime.datetime] = None):
+        """Initialize an empty aggregator."""
+        if measure_time is None:
+            measure_time = datetime.datetime.now(datetime.timezone.utc)
+        self.measure_time = _utc(measure_time)
+        self.records = 0
+        self._groups: typing.Dict[tuple, typing.List[int]] = {}
+
+    def __len__(self):
+        """Get the number of summaries."""
+        return len(self._groups)
+
+    def add(self, record: caso.record.CloudRecord):
+        """Add the usage of a cloud record to the totals of its groups."""
+        values = tuple(getattr(record, name) for name in _KEY_FIELDS)
+        start = record.start_time_epoch
+
+        for year, month, wall, cpu in _monthly_usage(record, self.measure_time):
+            key = (year, month) + values
+            totals = self._groups.get(key)
+            if totals is None:
+                totals = self._groups[key] = [0, 0, 0, 0, 0, 0, 0, start, start]
+            totals[_COUNT] += 1
+            totals[_WALL] += wall
+            totals[_CPU] += cpu
+            totals[_CPU_COUNT] += record.cpu_count
+            totals[_MEMORY] += record.memory
+            totals[_DISK] += record.disk
+            totals[_IPS] += record.public_ip_count
+            if start < totals[_EARLIEST]:
+                totals[_EARLIEST] = start
+            elif start > totals[_LATEST]:
+                totals[_LATEST] = start
+        self.records += 1
+
+    def update(self, records: typing.Iterable[caso.record.CloudRecord]):
+        """Add the usage of several cloud records."""
+        for record in records:
+            self.add(record)
+
+    def summaries(self) -> typing.List[caso.record.CloudSummaryRecord]:
+        """Get the summary records of the groups, in the order they were found."""
+        summaries = []
+        for key, totals in self._groups.items():
+            year, month, *values = key
+            summaries.append(_summary(year, month, values, totals))
+        return summaries
+
+
+def summarize(
+    records: typing.Iterable[caso.record.CloudRecord],
+    measure_time: typing.Optional[datetime.datetime] = None,
+) -> typing.List[caso.record.CloudSummaryRecord]:
+    """Aggregate cloud records into summary records.
+
+    :param records: Iterable with the cloud records.
+    :param measure_time: Date in which the records were measured, used for the
+                         records that have not ended (default: now).
+    :returns: A list with the summary records.
+    """
+    aggregator = CloudSummaryAggregator(measure_time)
+    aggregator.update(records)
+    return aggregator.summaries()
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    uuid TEXT NOT NULL,
+    grp TEXT NOT NULL,
+    wall INTEGER NOT NULL,
+    cpu INTEGER NOT NULL,
+    cpu_count INTEGER NOT NULL,
+    memory INTEGER NOT NULL,
+    disk INTEGER NOT NULL,
+    ips INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    PRIMARY KEY (year, month, uuid)
+) WITHOUT ROWID
+"""
+
+# Keep the usage with the longest wall duration of each VM in each month, so
+# that records extracted again for an older period do not replace newer ones
+_UPSERT = """
+INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (year, month, uuid) DO UPDATE SET
+    grp = excluded.grp,
+    wall = excluded.wall,
+    cpu = excluded.cpu,
+    cpu_count = excluded.cpu_count,
+    memory = excluded.memory,
+    disk = excluded.disk,
+    ips = excluded.ips,
+    start = excluded.start
+WHERE excluded.wall >= usage.wall
+"""
+
+# Totals of the groups of a month, in the positions of the running totals
+_TOTALS = """
+SELECT grp, COUNT(*), SUM(wall), SUM(cpu), SUM(cpu_count), SUM(memory),
+       SUM(disk), SUM(ips), MIN(start), MAX(start)
+FROM usage WHERE year = ? AND month = ? GROUP BY grp ORDER BY grp
+"""
+
+
+class CloudSummaryStore(object):
+    """A persistent store of the usage of the VMs in each month.
+
+    Only the latest usage of each VM (by its UUID) in each month is kept, so
+    adding records extracted again in overlapping periods does not count them
+    twice, and the summaries of a month include the VMs that were added in
+    previous runs.
+
+    :param path: SQLite database where the usage is stored, None to keep it in
+                 memory.
+    :param months: Number of months, including the current one, whose usage is
+                   kept. The summaries of older months are not published, as
+                   they would not hold the usage of the whole month.
+    :param measure_time: Date in which the records were measured, used for the
+                         records that have not ended (default: now).
+    """
+
+    def __init__(
+        self,
+        path: typing.Optional[str] = None,
+        months: int = 3,
+        measure_time: typing.Optional[datetime.datetime] = None,
+    ):
+        """Initialize the store, opening its database."""
+        if measure_time is None:
+            measure_time = datetime.datetime.now(datetime.timezone.utc)
+        self.path = path
+        self.measure_time = _utc(measure_time)
+        year, month = self.measure_time.year, self.measure_time.month
+        self.first_month = self._index(year, month) - (months - 1)
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+    @staticmethod
+    def _index(year: int, month: int) -> int:
+        return year * 12 + month - 1
+
+    def update(
+        self,
+        records: typing.Union[
+            caso.record_batch.RecordBatch, typing.Iterable[caso.record.CloudRecord]
+        ],
+    ) -> typing.List[typing.Tuple[int, int]]:
+        """Store the usage of several cloud records in each of their months.
+
+        The usage is read from the columns of the cloud records of a batch (or
+        of a batch built with the records given), only reading the fields that
+        identify their groups from the records themselves. The usage in months
+        older than the ones that are kept is ignored, and the records that only
+        have usage in those months are skipped.
+
+        :returns: The months (year and month) of the usage that was stored, in
+                  the order they were found.
+        """
+        batch = caso.record_batch.RecordBatch(records)
+        columns = [batch.column("cloud", name) for name in _USAGE_COLUMNS]
+        measure_time = int(self.measure_time.timestamp())
+
+        months: typing.Dict[typing.Tuple[int, int], None] = {}
+        rows = []
+        for record, start, end, wall, cpu, cpu_count, memory, disk, ips in zip(
+            batch.records("cloud"), *columns
+        ):
+            # Records that have not ended have a zero end time in the columns
+            usage = [
+                u
+                for u in monthly_usage(start, end or measure_time, wall, cpu)
+                if self._index(u[0], u[1]) >= self.first_month
+            ]
+            if not usage:
+                self.skipped += 1
+                continue
+            group = json.dumps([getattr(record, name) for name in _KEY_FIELDS])
+            uuid = str(record.uuid)
+            for year, month, month_wall, month_cpu in usage:
+                months[(year, month)] = None
+                rows.append(
+                    (
+                        year,
+                        month,
+                        uuid,
+                        group,
+                        month_wall,
+                        month_cpu,
+                        cpu_count,
+                        memory,
+                        disk,
+                        ips,
+                        start,
+                    )
+                )
+        with self._lock:
+            self._db.executemany(_UPSERT, rows)
+            self._db.commit()
+        return list(months)
+
+    def summaries(
+        self, months: typing.Iterable[typing.Tuple[int, int]]
+    ) -> typing.List[caso.record.CloudSummaryRecord]:
+        """Get the summary records of the whole months given."""
+        summaries = []
+        with self._lock:
+            for year, month in months:
+                rows = self._db.execute(_TOTALS, (year, month)).fetchall()
+                for group, *totals in rows:
+                    summaries.append(_summary(year, month, json.loads(group), totals))
+        return summaries
+
+    def evict(self) -> int:
+        """Forget the usage of the months that are no longer kept.
+
+        :returns: The number of VM usages forgotten.
+        """
+        with self._lock:
+            count = self._db.execute(
+                "DELETE FROM usage WHERE year * 12 + month - 1 < ?",
+                (self.first_month,),
+            ).rowcount
+            self._db.commit()
+        return count
+
+    def close(self):
+        """Close the database of the store."""
+        with self._lock:
+            self._db.close()
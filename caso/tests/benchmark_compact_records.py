@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Benchmark of the compact records against the full pydantic records.
+
+Cloud records are built and updated as the Nova extractor does, holding them
+as full :class:`caso.record.CloudRecord` objects or as
+:class:`caso.record.CompactCloudRecord` objects, reporting the time needed to
+build them and the memory they use. The compact records are also converted
+into full records, either validating all their fields or trusting them as the
+extractors do by default (see the ``strict_validation`` option), checking that
+they give the same records. Run it with::
+
+    python -m caso.tests.benchmark_compact_records --records 100000
+
+Use ``--help`` to see all the available options.
+"""
+
+import datetime
+import uuid
+
+import caso.record
+from caso.tests import benchmark_harness
+
+# Representations of the records: the class used while building them, and
+# how they are converted into full records afterwards (None if they are not)
+REPRESENTATIONS = {
+    "model": (caso.record.CloudRecord, None),
+    "compact": (caso.record.CompactCloudRecord, None),
+    "compact-validated": (caso.record.CompactCloudRecord, "validated"),
+    "compact-trusted": (caso.record.CompactCloudRecord, "trusted"),
+}
+
+
+def make_fields(count):
+    """Get the fields of cloud records with varied values."""
+    now = datetime.datetime(2024, 1, 1)
+    statuses = ["started", "completed", "error", "paused"]
+    fields = []
+    for i in range(count):
+        fields.append(
+            dict(
+                uuid=str(uuid.UUID(int=i + 1)),
+                site_name="BENCHMARK",
+                name=f"VM {i}",
+                user_id=str(uuid.UUID(int=i % 97)),
+                group_id=str(uuid.UUID(int=i % 13)),
+                fqan=f"VO {i % 13}",
+                start_time=now - datetime.timedelta(seconds=3600 + i),
+                end_time=now if i % 3 else None,
+                compute_service="Benchmark Cloud Service",
+                status=statuses[i % len(statuses)],
+                image_id=str(uuid.UUID(int=i % 7)) if i % 5 else None,
+                user_dn=f"User {i % 97}" if i % 2 else None,
+                benchmark_type="HEPscore23" if i % 4 else None,
+                benchmark_value=10.5 + i % 10 if i % 4 else None,
+                memory=2048 * (1 + i % 8),
+                cpu_count=1 + i % 8,
+                disk=20 * (1 + i % 5),
+                public_ip_count=i % 2,
+            )
+        )
+    return fields
+
+
+def build_records(record_class, fields):
+    """Build and update the records, as the Nova extractor does."""
+    records = []
+    for f in fields:
+        record = record_class(**f)
+        if record.end_time is None:
+            wall = 3600
+            record.wall_duration = wall
+            record.cpu_duration = wall * record.cpu_count
+        records.append(record)
+    return records
+
+
+def run_benchmark(representations, count=10_000, memory=True):
+    """Build some records with several representations.
+
+    :param representations: Names of the representations to run.
+    :param count: Number of records to build.
+    :param memory: Trace the memory used by the records.
+    :returns: A list of Results.
+    :raises AssertionError: If the compact records give different records.
+    """
+    fields = make_fields(count)
+    reference = [
+        r.model_dump(by_alias=True)
+        for r in build_records(caso.record.CloudRecord, fields)
+    ]
+    results = []
+    for name in representations:
+        record_class, conversion = REPRESENTATIONS[name]
+        with benchmark_harness.Measure(memory) as measure:
+            records = build_records(record_class, fields)
+            if conversion:
+                caso.record.validate_records(records, trusted=conversion == "trusted")
+        if conversion:
+            benchmark_harness.check_output(
+                name, [r.model_dump(by_alias=True) for r in records], reference
+            )
+        measures = dict(records=count, seconds=measure.seconds, memory=measure.memory)
+        results.append(benchmark_harness.Result(name, measures))
+        del records
+    return results
+
+
+def check_results(results):
+    """Check that the memory used by the records has been traced."""
+    assert all(r.measures["memory"] > 0 for r in results)
+
+
+BENCHMARK = benchmark_harness.Benchmark(
+    description=__doc__.splitlines()[0],
+    case_name="representation",
+    cases=REPRESENTATIONS,
+    run=run_benchmark,
+    columns=[
+        benchmark_harness.Column("records", 9, "records"),
+        benchmark_harness.Column("time (s)", 9, "seconds", ".2f"),
+        benchmark_harness.Column(
+            "µs/record", 10, benchmark_harness.per_record("seconds", 1e6), ".1f"
+        ),
+        benchmark_harness.Column("MiB", 8, benchmark_harness.mib("memory"), ".2f"),
+        benchmark_harness.Column(
+            "B/record", 9, benchmark_harness.per_record("memory"), ".0f"
+        ),
+    ],
+    arguments=[
+        benchmark_harness.RECORDS,
+        benchmark_harness.Argument(
+            ("--no-memory",),
+            dict(
+                dest="memory",
+                action="store_false",
+                help="Do not trace the memory used (tracing slows down the "
+                "building).",
+            ),
+        ),
+    ],
+    smoke=dict(count=100),
+    check=check_results,
+)
+
+
+def main(argv=None):
+    """Run the benchmark from the command line."""
+    benchmark_harness.main(BENCHMARK, argv)
+
+
+if __name__ == "__main__":
+    main()
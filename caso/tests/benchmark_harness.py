@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Harness shared by the benchmarks in :mod:`caso.tests`.
+
+Each benchmark module only defines its workload: a :class:`Benchmark` with the
+named cases that it compares (e.g. the renderers of the messages), a function
+that runs some of them returning a :class:`Result` per run, and the columns of
+the table that is printed. The harness parses the command line, runs the
+selected cases and formats their results, and the smoke test in
+:mod:`caso.tests.test_benchmarks` runs every benchmark with a small workload.
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+import typing
+
+
+class Result(typing.NamedTuple):
+    """Result of running a case of a benchmark."""
+
+    case: str
+    measures: typing.Dict[str, typing.Any]
+
+
+class Column(typing.NamedTuple):
+    """Column of the table of results of a benchmark.
+
+    The value is the name of a measure of the results, or a function getting
+    it from the measures. Missing values (None) are shown as "-".
+    """
+
+    header: str
+    width: int
+    value: typing.Union[
+        str, typing.Callable[[typing.Dict[str, typing.Any]], typing.Any]
+    ]
+    format_spec: str = ""
+
+
+class Argument(typing.NamedTuple):
+    """Command line argument of a benchmark, as in ``add_argument``."""
+
+    flags: typing.Tuple[str, ...]
+    kwargs: typing.Dict[str, typing.Any]
+
+
+class Benchmark(typing.NamedTuple):
+    """Workload of a benchmark.
+
+    :param description: Description of the benchmark, for the command line.
+    :param case_name: Name of the cases (e.g. "renderer").
+    :param cases: Cases to compare, by name.
+    :param run: Function running a list of cases, with the values of the
+                arguments as keyword arguments, that returns a list of Results.
+    :param columns: Columns of the table of results, after the case name.
+    :param arguments: Other command line arguments of the benchmark.
+    :param cases_option: Name of the argument selecting the cases (default: the
+                         plural of the case name, e.g. "renderers").
+    :param smoke: Keyword arguments of a small run, for the smoke test.
+    :param check: Function checking the results of the smoke run.
+    """
+
+    description: str
+    case_name: str
+    cases: typing.Dict[str, typing.Any]
+    run: typing.Callable[..., typing.List[Result]]
+    columns: typing.Sequence[Column]
+    arguments: typing.Sequence[Argument] = ()
+    cases_option: typing.Optional[str] = None
+    smoke: typing.Optional[typing.Dict[str, typing.Any]] = None
+    check: typing.Optional[typing.Callable[[typing.List[Result]], None]] = None
+
+
+# Number of records of the benchmarks that process records
+RECORDS = Argument(
+    ("--records",),
+    dict(dest="count", type=int, default=100_000, help="Number of records."),
+)
+
+
+class Measure(object):
+    """Measure the wall time, and optionally the memory, of a block of code.
+
+    The garbage is collected before starting. When tracing the memory, the
+    memory allocated when the block ends and the peak are kept.
+    """
+
+    def __init__(self, memory=False):
+        """Initialize the measure."""
+        self.trace_memory = memory
+        self.seconds = 0.0
+        self.memory = None
+        self.peak_memory = None
+
+    def __enter__(self):
+        """Start measuring."""
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        """Stop measuring."""
+        self.seconds = time.perf_counter() - self._start
+        if self.trace_memory:
+            self.memory, self.peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return False
+
+
+def check_output(case, output, reference):
+    """Check that a case gives the same output as the reference one.
+
+    :raises AssertionError: If the outputs are different.
+    """
+    if output != reference:
+        raise AssertionError(f"Case '{case}' gives a different output")
+
+
+def mib(name):
+    """Get a column value with a measure in bytes as MiB."""
+    return lambda m: None if m[name] is None else m[name] / 2**20
+
+
+def per_record(name, scale=1):
+    """Get a column value with a measure divided by the number of records."""
+    return lambda m: None if m[name] is None else m[name] / m["records"] * scale
+
+
+def run(benchmark, cases=None, **kwargs):
+    """Run some cases of a benchmark (default: all), returning their Results."""
+    return benchmark.run(list(cases or benchmark.cases), **kwargs)
+
+
+def format_results(benchmark, results):
+    """Format the results of a benchmark as a table."""
+    width = max([len(benchmark.case_name)] + [len(r.case) for r in results])
+    header = [f"{benchmark.case_name:<{width}}"]
+    header.extend(f"{c.header:>{c.width}}" for c in benchmark.columns)
+    lines = [" ".join(header)]
+    for r in results:
+        line = [f"{r.case:<{width}}"]
+        for c in benchmark.columns:
+            value = c.value(r.measures) if callable(c.value) else r.measures[c.value]
+            if value is None:
+                line.append(f"{'-':>{c.width}}")
+            else:
+                line.append(f"{value:>{c.width}{c.format_spec}}")
+        lines.append(" ".join(line))
+    return "\n".join(lines)
+
+
+def main(benchmark, argv=None):
+    """Run a benchmark from the command line."""
+    cases_option = benchmark.cases_option or f"{benchmark.case_name}s"
+    parser = argparse.ArgumentParser(description=benchmark.description)
+    for argument in benchmark.arguments:
+        parser.add_argument(*argument.flags, **argument.kwargs)
+    parser.add_argument(
+        f"--{cases_option}",
+        dest="cases",
+        default=",".join(benchmark.cases),
+        help=f"Comma separated {cases_option} to run, from "
+        f"{', '.join(benchmark.cases)}.",
+    )
+    kwargs = vars(parser.parse_args(argv))
+
+    cases = [s.strip() for s in kwargs.pop("cases").split(",") if s.strip()]
+    unknown = set(cases) - set(benchmark.cases)
+    if unknown:
+        parser.error(f"Unknown {cases_option}: {', '.join(sorted(unknown))}")
+
+    print(format_results(benchmark, run(benchmark, cases, **kwargs)))
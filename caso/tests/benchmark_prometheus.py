@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Benchmark of the Prometheus extractor against a local Prometheus stand-in.
+
+The extractor is run for N VMs during M days with different query strategies,
+against a :class:`caso.tests.fake_prometheus.FakePrometheusServer`, reporting
+the number of queries issued, the bytes transferred and the wall time of each
+strategy. Run it with::
+
+    python -m caso.tests.benchmark_prometheus --vms 50 --days 7
+
+Use ``--help`` to see all the available options.
+"""
+
+import datetime
+import math
+import os
+import tempfile
+from unittest import mock
+import uuid
+
+from oslo_config import cfg
+
+from caso.extract import energy_cache
+from caso.extract import prometheus
+from caso.tests import benchmark_harness
+from caso.tests import fake_prometheus
+
+CONF = cfg.CONF
+CONF.import_opt("spooldir", "caso.manager")
+
+# Prometheus options overridden by each strategy
+STRATEGIES = {
+    "per-vm": {
+        "vm_batch_size": 1,
+        "integration_mode": "client",
+        "stream_responses": False,
+    },
+    "per-vm-stream": {
+        "vm_batch_size": 1,
+        "integration_mode": "client",
+        "stream_responses": True,
+    },
+    "batched": {
+        "vm_batch_size": 50,
+        "integration_mode": "client",
+        "stream_responses": True,
+    },
+    "server-sum": {"vm_batch_size": 50, "integration_mode": "sum_over_time"},
+    "server-avg": {"vm_batch_size": 50, "integration_mode": "avg_over_time"},
+}
+
+
+def _servers(vm_uuids, created):
+    servers = []
+    for vm_uuid in vm_uuids:
+        server = mock.Mock()
+        server.id = vm_uuid
+        server.name = f"vm-{vm_uuid[:8]}"
+        server.status = "ACTIVE"
+        server.created = created.strftime("%Y-%m-%dT%H:%M:%SZ")
+        server.flavor = {"id": "flavor-1"}
+        servers.append(server)
+    return servers
+
+
+def _extractor(servers):
+    """Get an extractor for a project with the given servers."""
+    with mock.patch(
+        "caso.extract.openstack.base.BaseOpenStackExtractor.__init__",
+        return_value=None,
+    ), mock.patch(
+        "caso.extract.openstack.base.BaseOpenStackExtractor._get_nova_client"
+    ) as m_nova:
+        nova = m_nova.return_value
+        nova.flavors.list.return_value = []
+        nova.servers.list.side_effect = lambda search_opts=None, **kwargs: (
+            [] if search_opts else servers
+        )
+        extractor = prometheus.EnergyConsumptionExtractor("bench", "bench-vo")
+    extractor.project = "bench"
+    extractor.vo = "bench-vo"
+    extractor.flavors = {"flavor-1": {"vcpus": 2, "id": "flavor-1"}}
+    return extractor
+
+
+def run_strategy(server, extractor, options, extract_from, extract_to, memory):
+    """Run the extractor with the options of a strategy, and measure it."""
+    for key, value in options.items():
+        CONF.set_override(key, value, group="prometheus")
+    prometheus.reset_prometheus_client()
+    server.prometheus.reset_stats()
+    try:
+        with benchmark_harness.Measure(memory) as measure:
+            records = extractor.extract(extract_from, extract_to)
+    finally:
+        for key in options:
+            CONF.clear_override(key, group="prometheus")
+    return dict(
+        queries=server.prometheus.queries,
+        bytes_sent=server.prometheus.bytes_sent,
+        wall_time=measure.seconds,
+        records=len(records),
+        energy_wh=sum(r.energy_wh for r in records),
+        peak_memory=measure.peak_memory,
+    )
+
+
+def run_benchmark(
+    strategies,
+    vms=10,
+    days=1,
+    series_per_vm=1,
+    step=30,
+    batch_size=None,
+    concurrency=4,
+    memory=False,
+    cache=False,
+):
+    """Run the extractor with several strategies against a fake Prometheus.
+
+    :param strategies: Names of the strategies to run.
+    :param batch_size: Override the batch size of the batched strategies.
+    :param memory: Trace the peak memory allocated by the extractor.
+    :param cache: Run each strategy twice with the energy cache enabled, to
+                  measure cold and warm runs.
+    :returns: A list of Results.
+    """
+    vm_uuids = [str(uuid.UUID(int=i + 1)) for i in range(vms)]
+    extract_to = datetime.datetime(2024, 1, 1) + datetime.timedelta(days=days)
+    extract_from = datetime.datetime(2024, 1, 1)
+    extractor = _extractor(_servers(vm_uuids, extract_from))
+
+    overrides = {
+        "prometheus_step_seconds": step,
+        "max_concurrent_queries": concurrency,
+        "labels": ["type_instance:scaph_process_power_microwatts"],
+    }
+    results = []
+    fake = fake_prometheus.FakePrometheus(
+        vm_uuids, series_per_vm=series_per_vm, interval=step
+    )
+    server = fake_prometheus.FakePrometheusServer(fake)
+    with tempfile.TemporaryDirectory() as spooldir, server:
+        CONF.set_override("site_name", "BENCHMARK")
+        CONF.set_override("spooldir", spooldir)
+        CONF.set_override("enabled", cache, group="energy_cache")
+        CONF.set_override("prometheus_endpoint", server.url, group="prometheus")
+        try:
+            for name in strategies:
+                options = dict(overrides, **STRATEGIES[name])
+                if batch_size and options["vm_batch_size"] > 1:
+                    options["vm_batch_size"] = batch_size
+                runs = ["cold", "warm"] if cache else [None]
+                for run in runs:
+                    measures = run_strategy(
+                        server, extractor, options, extract_from, extract_to, memory
+                    )
+                    measures["run"] = run
+                    results.append(benchmark_harness.Result(name, measures))
+                # Do not reuse the buckets cached by the previous strategy
+                energy_cache.reset()
+                cache_file = os.path.join(spooldir, energy_cache.CACHE_FILE)
+                if os.path.exists(cache_file):
+                    os.remove(cache_file)
+        finally:
+            prometheus.reset_prometheus_client()
+            energy_cache.reset()
+            CONF.clear_override("site_name")
+            CONF.clear_override("spooldir")
+            CONF.clear_override("enabled", group="energy_cache")
+            CONF.clear_override("prometheus_endpoint", group="prometheus")
+    return results
+
+
+def check_results(results):
+    """Check that all the strategies get the same energy consumption.
+
+    The smoke run extracts 3 VMs with the energy cache, so that the warm runs
+    must transfer less data than the cold ones.
+    """
+    cold = {r.case: r.measures for r in results if r.measures["run"] == "cold"}
+    warm = {r.case: r.measures for r in results if r.measures["run"] == "warm"}
+    assert cold["per-vm"]["queries"] == 3
+    assert cold["batched"]["queries"] == 1
+    assert warm["batched"]["bytes_sent"] < cold["batched"]["bytes_sent"]
+    energy = cold["per-vm"]["energy_wh"]
+    for result in results:
+        assert result.measures["records"] == 3
+        assert math.isclose(result.measures["energy_wh"], energy, rel_tol=0.01)
+
+
+BENCHMARK = benchmark_harness.Benchmark(
+    description=__doc__.splitlines()[0],
+    case_name="strategy",
+    cases_option="strategies",
+    cases=STRATEGIES,
+    run=run_benchmark,
+    columns=[
+        benchmark_harness.Column("run", 4, "run"),
+        benchmark_harness.Column("queries", 8, "queries"),
+        benchmark_harness.Column("MiB", 9, benchmark_harness.mib("bytes_sent"), ".2f"),
+        benchmark_harness.Column("wall (s)", 9, "wall_time", ".2f"),
+        benchmark_harness.Column("records", 8, "records"),
+        benchmark_harness.Column("energy (Wh)", 13, "energy_wh", ".3f"),
+        benchmark_harness.Column(
+            "peak MiB", 9, benchmark_harness.mib("peak_memory"), ".2f"
+        ),
+    ],
+    arguments=[
+        benchmark_harness.Argument(
+            ("--vms",), dict(type=int, default=10, help="Number of VMs.")
+        ),
+        benchmark_harness.Argument(
+            ("--days",), dict(type=int, default=1, help="Days to extract.")
+        ),
+        benchmark_harness.Argument(
+            ("--series-per-vm",),
+            dict(
+                type=int,
+                default=1,
+                help="Number of power series (e.g. processes) of each VM.",
+            ),
+        ),
+        benchmark_harness.Argument(
+            ("--step",),
+            dict(type=int, default=30, help="Interval between samples (seconds)."),
+        ),
+        benchmark_harness.Argument(
+            ("--batch-size",),
+            dict(type=int, help="Batch size of the batched strategies."),
+        ),
+        benchmark_harness.Argument(
+            ("--concurrency",),
+            dict(type=int, default=4, help="Maximum concurrent queries."),
+        ),
+        benchmark_harness.Argument(
+            ("--memory",),
+            dict(
+                action="store_true",
+                help="Trace the peak memory allocated (slows down the extraction).",
+            ),
+        ),
+        benchmark_harness.Argument(
+            ("--cache",),
+            dict(
+                action="store_true",
+                help="Enable the energy cache, running each strategy twice.",
+            ),
+        ),
+    ],
+    smoke=dict(vms=3, days=1, step=300, cache=True),
+    check=check_results,
+)
+
+
+def main(argv=None):
+    """Run the benchmark from the command line."""
+    CONF([], project="caso")
+    benchmark_harness.main(BENCHMARK, argv)
+
+
+if __name__ == "__main__":
+    main()
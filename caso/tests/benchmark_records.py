@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Benchmark of the rendering of the SSM messages of the cloud records.
+
+The direct rendering of :meth:`caso.record.CloudRecord.ssm_message` is compared
+with the previous one, that serialized each record to JSON and loaded it again
+before building the message lines, checking that both give the same messages.
+Run it with::
+
+    python -m caso.tests.benchmark_records --records 100000
+
+Use ``--help`` to see all the available options.
+"""
+
+import datetime
+import json
+import uuid
+
+import caso.record
+from caso.tests import benchmark_harness
+
+
+def json_round_trip_ssm_message(record):
+    """Render the SSM message of a cloud record through a JSON round trip."""
+    serialized_record = json.loads(
+        record.model_dump_json(by_alias=True, exclude_none=True)
+    )
+    for f in ["CpuDuration", "WallDuration"]:
+        if f in serialized_record and serialized_record[f] == 0:
+            serialized_record[f] = 1
+    aux = [f"{k}: {v}" for k, v in serialized_record.items()]
+    aux.sort()
+    return "\n".join(aux)
+
+
+# Renderers of the SSM messages of a record
+RENDERERS = {
+    "json-round-trip": json_round_trip_ssm_message,
+    "direct": caso.record.CloudRecord.ssm_message,
+}
+
+
+def make_records(count):
+    """Get cloud records with varied values."""
+    now = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    statuses = ["started", "completed", "error", "paused"]
+    records = []
+    for i in range(count):
+        record = caso.record.CloudRecord(
+            uuid=str(uuid.UUID(int=i + 1)),
+            site_name="BENCHMARK",
+            name=f"VM {i}",
+            user_id=str(uuid.UUID(int=i % 97)),
+            group_id=str(uuid.UUID(int=i % 13)),
+            fqan=f"VO {i % 13}",
+            start_time=now - datetime.timedelta(seconds=3600 + i),
+            end_time=now if i % 3 else None,
+            compute_service="Benchmark Cloud Service",
+            status=statuses[i % len(statuses)],
+            image_id=str(uuid.UUID(int=i % 7)) if i % 5 else None,
+            user_dn=f"User {i % 97}" if i % 2 else None,
+            benchmark_type="HEPscore23" if i % 4 else None,
+            benchmark_value=10.5 + i % 10 if i % 4 else None,
+            memory=2048 * (1 + i % 8),
+            cpu_count=1 + i % 8,
+            disk=20 * (1 + i % 5),
+            public_ip_count=i % 2,
+        )
+        if i % 11 == 0:
+            record.cpu_duration = 0
+        records.append(record)
+    return records
+
+
+def run_benchmark(renderers, count=10_000):
+    """Render the messages of some records with several renderers.
+
+    :param renderers: Names of the renderers to run.
+    :param count: Number of records to render.
+    :returns: A list of Results.
+    :raises AssertionError: If the renderers give different messages.
+    """
+    records = make_records(count)
+    results = []
+    reference = None
+    for name in renderers:
+        render = RENDERERS[name]
+        with benchmark_harness.Measure() as measure:
+            messages = [render(record) for record in records]
+        if reference is None:
+            reference = messages
+        benchmark_harness.check_output(name, messages, reference)
+        measures = dict(
+            records=count,
+            seconds=measure.seconds,
+            size=sum(len(m) for m in messages),
+        )
+        results.append(benchmark_harness.Result(name, measures))
+    return results
+
+
+def check_results(results):
+    """Check that all the renderers give messages of the same size."""
+    assert len({r.measures["size"] for r in results}) == 1
+
+
+BENCHMARK = benchmark_harness.Benchmark(
+    description=__doc__.splitlines()[0],
+    case_name="renderer",
+    cases=RENDERERS,
+    run=run_benchmark,
+    columns=[
+        benchmark_harness.Column("records", 9, "records"),
+        benchmark_harness.Column("time (s)", 9, "seconds", ".2f"),
+        benchmark_harness.Column(
+            "µs/record", 10, benchmark_harness.per_record("seconds", 1e6), ".1f"
+        ),
+        benchmark_harness.Column("MiB", 8, benchmark_harness.mib("size"), ".2f"),
+    ],
+    arguments=[benchmark_harness.RECORDS],
+    smoke=dict(count=100),
+    check=check_results,
+)
+
+
+def main(argv=None):
+    """Run the benchmark from the command line."""
+    benchmark_harness.main(BENCHMARK, argv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Benchmark of the serialization of the records with their serialization plan.
+
+Cloud records are serialized to the dicts of JSON values used in the SSM
+messages and to JSON, with the serialization plan of their class and with the
+serializer that pydantic compiles for the model. The "key: value" SSM messages,
+that are only rendered from the plan, are included too. For each serializer the
+cold cost (the first record that is serialized, building the plan of the class)
+and the warm cost (the rest of the records) are reported, checking that the
+serializers of the same output give the same results. Run it with::
+
+    python -m caso.tests.benchmark_serialization --records 100000
+
+Use ``--help`` to see all the available options.
+"""
+
+import math
+import typing
+
+import pydantic_core
+
+import caso.record
+from caso.tests import benchmark_harness
+from caso.tests import benchmark_records
+
+
+def pydantic_json(record):
+    """Serialize a record to JSON with pydantic."""
+    return record.model_dump_json(by_alias=True, exclude_none=True)
+
+
+def pydantic_dict(record):
+    """Get the JSON values of a record with pydantic."""
+    serialized_record = record.model_dump(mode="json", by_alias=True, exclude_none=True)
+    for k, v in serialized_record.items():
+        if isinstance(v, float) and not math.isfinite(v):
+            serialized_record[k] = None
+    return serialized_record
+
+
+def plan_json(record):
+    """Serialize a record to JSON dumping the values of its plan."""
+    return pydantic_core.to_json(record.as_dict()).decode("utf-8")
+
+
+# Serializers of the records, grouping those that must give the same output
+SERIALIZERS = {
+    "dict-pydantic": ("dict", pydantic_dict),
+    "dict-plan": ("dict", caso.record.CloudRecord.as_dict),
+    "json-pydantic": ("json", pydantic_json),
+    "json-plan": ("json", plan_json),
+    "ssm-plan": ("ssm", caso.record.CloudRecord.ssm_message),
+}
+
+
+def run_benchmark(serializers, count=10_000):
+    """Serialize some records with several serializers.
+
+    :param serializers: Names of the serializers to run.
+    :param count: Number of records to serialize.
+    :returns: A list of Results.
+    :raises AssertionError: If the serializers give different outputs.
+    """
+    records = benchmark_records.make_records(count)
+    results = []
+    references: typing.Dict[str, list] = {}
+    for name in serializers:
+        output, serialize = SERIALIZERS[name]
+        caso.record.serialization_plan.cache_clear()
+        with benchmark_harness.Measure() as cold:
+            first = serialize(records[0])
+        with benchmark_harness.Measure() as warm:
+            serialized = [serialize(record) for record in records[1:]]
+        serialized.insert(0, first)
+        reference = references.setdefault(output, serialized)
+        benchmark_harness.check_output(name, serialized, reference)
+        measures = dict(
+            records=count,
+            cold_seconds=cold.seconds,
+            warm_seconds=warm.seconds,
+            warm_per_record=warm.seconds / max(count - 1, 1),
+        )
+        results.append(benchmark_harness.Result(name, measures))
+    return results
+
+
+BENCHMARK = benchmark_harness.Benchmark(
+    description=__doc__.splitlines()[0],
+    case_name="serializer",
+    cases=SERIALIZERS,
+    run=run_benchmark,
+    columns=[
+        benchmark_harness.Column("records", 9, "records"),
+        benchmark_harness.Column(
+            "cold (µs)", 10, lambda m: m["cold_seconds"] * 1e6, ".1f"
+        ),
+        benchmark_harness.Column("warm (s)", 9, "warm_seconds", ".2f"),
+        benchmark_harness.Column(
+            "µs/record", 10, lambda m: m["warm_per_record"] * 1e6, ".1f"
+        ),
+    ],
+    arguments=[benchmark_harness.RECORDS],
+    smoke=dict(count=100),
+)
+
+
+def main(argv=None):
+    """Run the benchmark from the command line."""
+    benchmark_harness.main(BENCHMARK, argv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Benchmark of the binary spool of records against JSON lines.
+
+Cloud records are written to a file and read back with the binary spool of
+:mod:`caso.spool` and as JSON lines (a record per line, built again with its
+model when it is read), reporting the time needed to write and read them and the
+size of the files, and checking that the records that are read give the same
+messages. Run it with::
+
+    python -m caso.tests.benchmark_spool --records 100000
+
+Use ``--help`` to see all the available options.
+"""
+
+import datetime
+import json
+import os
+import tempfile
+
+import caso.record
+from caso import spool
+from caso.tests import benchmark_harness
+from caso.tests import benchmark_records
+
+
+def write_json(path, records):
+    """Write cloud records as JSON lines."""
+    with open(path, "w") as f:
+        for record in records:
+            f.write(record.model_dump_json())
+            f.write("\n")
+
+
+def read_json(path):
+    """Read cloud records from JSON lines."""
+    records = []
+    with open(path) as f:
+        for line in f:
+            fields = json.loads(line)
+            for name in ("start_time", "end_time"):
+                epoch = fields.pop(f"{name}_epoch")
+                fields[name] = (
+                    datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc)
+                    if epoch
+                    else None
+                )
+            wall_duration = fields.pop("wall_duration")
+            cpu_duration = fields.pop("cpu_duration")
+            record = caso.record.CloudRecord(**fields)
+            record.wall_duration = wall_duration
+            record.cpu_duration = cpu_duration
+            records.append(record)
+    return records
+
+
+# Formats of the files: functions to write and read the records
+FORMATS = {
+    "json": (write_json, read_json),
+    "spool": (spool.write, spool.read),
+}
+
+
+def run_benchmark(formats, count=10_000):
+    """Write and read some records with several formats.
+
+    :param formats: Names of the formats to run.
+    :param count: Number of records to write and read.
+    :returns: A list of Results.
+    :raises AssertionError: If the records read give different messages.
+    """
+    records = benchmark_records.make_records(count)
+    reference = [r.ssm_message() for r in records]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in formats:
+            write, read = FORMATS[name]
+            path = os.path.join(directory, name)
+            with benchmark_harness.Measure() as write_measure:
+                write(path, records)
+            with benchmark_harness.Measure() as read_measure:
+                read_records = read(path)
+            benchmark_harness.check_output(
+                name, [r.ssm_message() for r in read_records], reference
+            )
+            del read_records
+            measures = dict(
+                records=count,
+                write_seconds=write_measure.seconds,
+                read_seconds=read_measure.seconds,
+                seconds=write_measure.seconds + read_measure.seconds,
+                size=os.path.getsize(path),
+            )
+            results.append(benchmark_harness.Result(name, measures))
+    return results
+
+
+def check_results(results):
+    """Check that the spool is smaller than the JSON lines."""
+    sizes = {r.case: r.measures["size"] for r in results}
+    assert sizes["spool"] < sizes["json"]
+
+
+BENCHMARK = benchmark_harness.Benchmark(
+    description=__doc__.splitlines()[0],
+    case_name="format",
+    cases=FORMATS,
+    run=run_benchmark,
+    columns=[
+        benchmark_harness.Column("records", 9, "records"),
+        benchmark_harness.Column("write (s)", 10, "write_seconds", ".2f"),
+        benchmark_harness.Column("read (s)", 9, "read_seconds", ".2f"),
+        benchmark_harness.Column(
+            "µs/record", 10, benchmark_harness.per_record("seconds", 1e6), ".1f"
+        ),
+        benchmark_harness.Column("MiB", 8, benchmark_harness.mib("size"), ".2f"),
+        benchmark_harness.Column(
+            "B/record", 9, benchmark_harness.per_record("size"), ".0f"
+        ),
+    ],
+    arguments=[benchmark_harness.RECORDS],
+    smoke=dict(count=100),
+    check=check_results,
+)
+
+
+def main(argv=None):
+    """Run the benchmark from the command line."""
+    benchmark_harness.main(BENCHMARK, argv)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,16 +17,42 @@
 """Fixtures for cASO tests."""
 
 import datetime
+import time
 import typing
 
+from oslo_config import cfg
 import pytest
 
 import caso
+import caso.extract.base
 import caso.record
 
+CONF = cfg.CONF
+
 now = datetime.datetime(2023, 5, 25, 21, 59, 6, 0, tzinfo=datetime.timezone.utc)
 cloud_type = caso.user_agent
 
+
+@pytest.fixture(autouse=True)
+def strict_validation():
+    """Validate all the fields of the records built during the tests."""
+    CONF.set_override("strict_validation", True)
+    yield
+    CONF.clear_override("strict_validation")
+
+
+@pytest.fixture(
+    params=["UTC0", "CET-1CEST,M3.5.0,M10.5.0/3", "EST+5EDT,M3.2.0,M11.1.0"]
+)
+def local_timezone(request, monkeypatch):
+    """Run a test with the local time zone set to UTC and to other time zones."""
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
 valid_cloud_records_fields = [
     dict(
         uuid="721cf1db-0e0f-4c24-a5ea-cd75e0f303e8",
@@ -329,6 +355,13 @@ def another_cloud_record() -> caso.record.CloudRecord:
     return record
 
 
+@pytest.fixture()
+def compact_cloud_record() -> caso.record.CompactCloudRecord:
+    """Get a fixture for the CompactCloudRecord."""
+    record = caso.record.CompactCloudRecord(**valid_cloud_records_fields[0])
+    return record
+
+
 @pytest.fixture()
 def valid_cloud_record() -> dict:
     """Get a fixture for a valid record."""
@@ -422,6 +455,13 @@ def another_accelerator_record() -> caso.record.AcceleratorRecord:
     return record
 
 
+@pytest.fixture()
+def compact_accelerator_record() -> caso.record.CompactAcceleratorRecord:
+    """Get a fixture for the CompactAcceleratorRecord."""
+    record = caso.record.CompactAcceleratorRecord(**valid_accelerator_records_fields[0])
+    return record
+
+
 @pytest.fixture()
 def valid_accelerator_record() -> dict:
     """Get a fixture for a valid record."""
@@ -459,6 +499,13 @@ def another_storage_record() -> caso.record.StorageRecord:
     return record
 
 
+@pytest.fixture()
+def compact_storage_record() -> caso.record.CompactStorageRecord:
+    """Get a fixture for the CompactStorageRecord."""
+    record = caso.record.CompactStorageRecord(**valid_storage_records_fields[0])
+    return record
+
+
 @pytest.fixture()
 def valid_storage_record() -> dict:
     """Get a fixture for a valid record."""
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for `caso.extract.energy_cache` module."""
+
+import datetime
+
+import pytest
+from oslo_config import cfg
+
+from caso.extract import energy_cache
+
+CONF = cfg.CONF
+CONF.import_opt("spooldir", "caso.manager")
+
+VM = "e3c5aeef-37b8-4332-ad9f-9d068f156dc2"
+
+
+class FakeClock(object):
+    """A fake clock that can be moved forward."""
+
+    def __init__(self):
+        """Start the clock at 2023-05-26T00:00:00Z."""
+        self.now = 1685059200.0
+
+    def __call__(self):
+        """Get the current time."""
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    """Get a fake clock."""
+    return FakeClock()
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    """Get the path of an energy cache database."""
+    return str(tmp_path / energy_cache.CACHE_FILE)
+
+
+def test_buckets_are_aligned_and_old_enough(clock, local_timezone):
+    """Test that only whole, old enough buckets of a period are cacheable."""
+    cache = energy_cache.EnergyCache(bucket_size=3600, min_age=900, clock=clock)
+    start = datetime.datetime(2023, 5, 25, 20, 30)
+    end = datetime.datetime(2023, 5, 26, 0, 0)
+
+    assert cache.buckets(start, end) == [
+        datetime.datetime(2023, 5, 25, 21, 0),
+        datetime.datetime(2023, 5, 25, 22, 0),
+    ]
+    clock.now += 900
+    assert cache.buckets(start, end)[-1] == datetime.datetime(2023, 5, 25, 23, 0)
+
+
+def test_store_and_get(clock):
+    """Test that stored buckets are returned, and accounted as hits."""
+    cache = energy_cache.EnergyCache(clock=clock)
+    b1 = datetime.datetime(2023, 5, 25, 10, 0)
+    b2 = datetime.datetime(2023, 5, 25, 11, 0)
+    cache.store("fp", VM, {b1: energy_cache.Bucket(1.5, 3600.0)})
+
+    assert cache.get("fp", VM, [b1, b2]) == {b1: energy_cache.Bucket(1.5, 3600.0)}
+    assert cache.get("other", VM, [b1]) == {}
+    assert cache.get("fp", "other-vm", [b1]) == {}
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_cache_is_persisted(clock, cache_path):
+    """Test that buckets are kept in the database between runs."""
+    bucket = datetime.datetime(2023, 5, 25, 10, 0)
+    cache = energy_cache.EnergyCache(cache_path, clock=clock)
+    cache.store("fp", VM, {bucket: energy_cache.Bucket(2.0, None)})
+    cache.close()
+
+    cache = energy_cache.EnergyCache(cache_path, clock=clock)
+    assert cache.get("fp", VM, [bucket]) == {bucket: energy_cache.Bucket(2.0, None)}
+
+
+def test_unused_buckets_are_evicted(clock):
+    """Test that buckets not used within the retention period are evicted."""
+    cache = energy_cache.EnergyCache(retention=2, clock=clock)
+    old = datetime.datetime(2023, 5, 20, 10, 0)
+    used = datetime.datetime(2023, 5, 20, 11, 0)
+    cache.store("fp", VM, {b: energy_cache.Bucket(1.0, None) for b in (old, used)})
+
+    clock.now += 86400
+    cache.get("fp", VM, [used])
+    clock.now += 86400 + 1
+
+    assert cache.evict() == 1
+    assert list(cache.get("fp", VM, [old, used])) == [used]
+
+
+def test_invalidate(clock):
+    """Test that buckets can be dropped per VM or by the time they were obtained."""
+    cache = energy_cache.EnergyCache(clock=clock)
+    bucket = datetime.datetime(2023, 5, 25, 10, 0)
+    cache.store("fp", VM, {bucket: energy_cache.Bucket(1.0, None)})
+    cache.store("fp", "other-vm", {bucket: energy_cache.Bucket(1.0, None)})
+
+    assert cache.invalidate(vm_uuid="other-vm") == 1
+    assert cache.invalidate(computed_before=datetime.datetime(2023, 5, 25)) == 0
+    assert cache.invalidate(computed_before=datetime.datetime(2023, 5, 27)) == 1
+    assert cache.get("fp", VM, [bucket]) == {}
+
+
+def test_invalidate_before_option(clock, cache_path, tmp_path):
+    """Test that the shared cache drops the buckets obtained before a date."""
+    bucket = datetime.datetime(2023, 5, 25, 10, 0)
+    cache = energy_cache.EnergyCache(cache_path, clock=clock)
+    cache.store("fp", VM, {bucket: energy_cache.Bucket(1.0, None)})
+    cache.close()
+
+    CONF.set_override("spooldir", str(tmp_path))
+    CONF.set_override("invalidate_before", "2023-05-27", group="energy_cache")
+    try:
+        shared = energy_cache.get_cache()
+        assert shared.get("fp", VM, [bucket]) == {}
+    finally:
+        energy_cache.reset()
+        CONF.clear_override("spooldir")
+        CONF.clear_override("invalidate_before", group="energy_cache")
+
+
+def test_disabled_cache():
+    """Test that no cache is used if it is disabled."""
+    CONF.set_override("enabled", False, group="energy_cache")
+    try:
+        assert energy_cache.get_cache() is None
+    finally:
+        CONF.clear_override("enabled", group="energy_cache")
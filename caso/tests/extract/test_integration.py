@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for `caso.extract.integration` module."""
+
+import random
+from unittest import mock
+
+import pytest
+
+from caso.extract import integration
+
+
+def _numpy_available():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@pytest.fixture(
+    params=[
+        "python",
+        pytest.param(
+            "numpy",
+            marks=pytest.mark.skipif(
+                not _numpy_available(), reason="NumPy is not installed"
+            ),
+        ),
+    ]
+)
+def backend(request):
+    """Run the tests with both the NumPy and the pure Python backends."""
+    if request.param == "python":
+        with mock.patch.object(integration, "numpy", None):
+            yield request.param
+    else:
+        yield request.param
+
+
+def test_empty_series(backend):
+    """Test that an empty series has no energy and no coverage."""
+    assert integration.integrate([], 30, 3600) == (0.0, 0.0)
+
+
+def test_regular_series_step(backend):
+    """Test that a regular series gives the sum of the samples times the step."""
+    samples = [[0, "1.0"], [30, "2.0"], [60, "3.0"], [90, "4.0"]]
+    result = integration.integrate(samples, 30, 120)
+    assert result.value == pytest.approx(300.0)
+    assert result.coverage == pytest.approx(1.0)
+
+
+def test_irregular_series_step(backend):
+    """Test that samples are held until the next real timestamp."""
+    samples = [[0, "10"], [20, "20"], [60, "30"]]
+    result = integration.integrate(samples, 30, 120, max_gap=60)
+    assert result.value == pytest.approx(10 * 20 + 20 * 40 + 30 * 30)
+    assert result.coverage == pytest.approx(90 / 120)
+
+
+def test_gaps_are_not_accounted(backend):
+    """Test that gaps longer than the maximum are considered missing data."""
+    samples = [[0, "10"], [30, "10"], [600, "10"], [630, "10"]]
+    result = integration.integrate(samples, 30, 660)
+    assert result.value == pytest.approx(4 * 10 * 30)
+    assert result.coverage == pytest.approx(120 / 660)
+
+
+def test_trapezoid(backend):
+    """Test the trapezoidal rule, skipping gaps."""
+    samples = [[0, "0"], [30, "10"], [60, "20"], [600, "20"]]
+    result = integration.integrate(samples, 30, 600, method="trapezoid")
+    assert result.value == pytest.approx(5 * 30 + 15 * 30)
+    assert result.coverage == pytest.approx(60 / 600)
+
+
+def test_unknown_method():
+    """Test that an unknown method is rejected."""
+    with pytest.raises(ValueError):
+        integration.integrate([[0, "1"]], 30, 30, method="simpson")
+
+
+@pytest.mark.parametrize("method", integration.METHODS)
+def test_merged_partials_match_integrate(backend, method):
+    """Test that joining partial integrals of runs gives the same result."""
+    samples = [[0, "10"], [30, "20"], [45, "5"], [75, "7"], [600, "3"], [630, "8"]]
+    expected = integration.integrate(samples, 30, 700, method=method)
+
+    partials = []
+    for start, end in ((4, 6), (0, 2), (2, 4)):
+        accumulator = integration.Accumulator(30, method=method)
+        for timestamp, value in samples[start:end]:
+            accumulator.add(timestamp, value)
+        partials.append(accumulator.partial())
+    result = integration.merge(partials, 30, 700, method=method)
+
+    assert result.value == pytest.approx(expected.value)
+    assert result.coverage == pytest.approx(expected.coverage)
+
+
+def test_empty_accumulator():
+    """Test that an accumulator without samples has no partial integral."""
+    assert integration.Accumulator(30).partial() is None
+    assert integration.merge([], 30, 3600) == (0.0, 0.0)
+
+
+@pytest.mark.parametrize("method", integration.METHODS)
+def test_numpy_matches_python(method):
+    """Test that the NumPy and pure Python integrations give the same results."""
+    pytest.importorskip("numpy")
+    rng = random.Random(42)
+    timestamp = 0
+    samples = []
+    for _ in range(1000):
+        # Mostly regular samples, with some jitter and some gaps
+        timestamp += rng.choice([30, 30, 30, 29, 31, 45, 600])
+        samples.append([timestamp, str(rng.uniform(0, 500))])
+
+    expected = integration._integrate_python(samples, 30, 60, method)
+    result = integration._integrate_numpy(samples, 30, 60, method)
+    assert result == pytest.approx(expected)
@@ -24,6 +24,9 @@ import six
 from dateutil import tz
 from oslo_config import cfg
 
+from caso import circuit_breaker
+from caso import exception
+from caso import record
 from caso.extract import manager
 
 CONF = cfg.CONF
@@ -90,6 +93,29 @@ class TestCasoManager(unittest.TestCase):
         )
         self.assertEqual(self.records, ret)
 
+    def test_extract_validates_compact_records(self):
+        """Test that compact records are validated once they are extracted."""
+        self.flags(dry_run=True)
+        self.flags(projects=["bazonk"])
+        compact_record = mock.Mock(spec=record.CompactRecord)
+        self.m_extractor.return_value.extract.return_value = [compact_record]
+
+        ret = self.manager.get_records()
+        compact_record.to_record.assert_called_once_with(False)
+        self.assertEqual([compact_record.to_record.return_value], ret)
+
+    def test_extract_trusts_compact_records(self):
+        """Test that compact records are trusted without strict validation."""
+        self.flags(dry_run=True)
+        self.flags(projects=["bazonk"])
+        self.flags(strict_validation=False)
+        compact_record = mock.Mock(spec=record.CompactRecord)
+        self.m_extractor.return_value.extract.return_value = [compact_record]
+
+        ret = self.manager.get_records()
+        compact_record.to_record.assert_called_once_with(True)
+        self.assertEqual([compact_record.to_record.return_value], ret)
+
     def test_get_records_wrong_extract_from(self):
         """Test that wrong dates in extract from cause a failure."""
         self.flags(projects=["foo"])
@@ -262,6 +288,61 @@ class TestCasoManager(unittest.TestCase):
             self.manager.get_records()
             m.assert_called_once_with("/tmp/caso_test/lastrun.bazonk", "w")
 
+    def test_get_records_skips_extractor_with_open_circuit(self):
+        """Test that an extractor is skipped once its endpoint circuit opens."""
+        self.flags(projects=["project1", "project2"])
+        self.m_extractor.return_value.extract.side_effect = exception.CircuitOpenError(
+            endpoint="volumev3", failures=5
+        )
+
+        with unittest.mock.patch.object(
+            self.manager, "get_project_vo", return_value="test-vo"
+        ):
+            with unittest.mock.patch.object(self.manager, "write_lastrun") as m:
+                ret = self.manager.get_records()
+
+        self.assertEqual([], ret)
+        self.m_extractor.assert_called_once()
+        self.assertEqual({"mock"}, self.manager.skipped_extractors)
+        m.assert_not_called()
+
+    def test_get_records_does_not_advance_lastrun_on_endpoint_failure(self):
+        """Test that lastrun is kept if an extractor failed due to an endpoint."""
+        self.flags(projects=["bazonk"])
+
+        def extract(*args):
+            circuit_breaker.get_breaker("volumev3").record_failure()
+            raise Exception("Connection failed")
+
+        self.m_extractor.return_value.extract.side_effect = extract
+
+        with unittest.mock.patch.object(
+            self.manager, "get_project_vo", return_value="test-vo"
+        ):
+            with unittest.mock.patch.object(self.manager, "write_lastrun") as m:
+                self.manager.get_records()
+
+        circuit_breaker.reset()
+        m.assert_not_called()
+
+    def test_get_records_does_not_advance_lastrun_on_incomplete_extraction(self):
+        """Test that lastrun is kept if some records could not be extracted."""
+        self.flags(projects=["bazonk"])
+        self.m_extractor.return_value.extract.side_effect = (
+            exception.IncompleteExtractionError(failed=1, records=["record"])
+        )
+
+        with unittest.mock.patch.object(
+            self.manager, "get_project_vo", return_value="test-vo"
+        ):
+            with unittest.mock.patch.object(self.manager, "write_lastrun") as m:
+                with unittest.mock.patch("caso.record.validate_records"):
+                    ret = self.manager.get_records()
+
+        # The records that could be extracted are still returned
+        self.assertEqual(["record"], ret)
+        m.assert_not_called()
+
     def flags(self, **kw):
         """Override flag variables for a test."""
         group = kw.pop("group", None)
@@ -18,6 +18,7 @@ import datetime
 import unittest
 from unittest import mock
 
+from caso import exception
 from caso.extract.openstack import nova
 
 
@@ -107,3 +108,28 @@ class TestNovaVmStatus(unittest.TestCase):
         extractor = object.__new__(nova.NovaExtractor)
 
         self.assertEqual("started", extractor.vm_status("PASSWORD"))
+
+
+class TestNovaKeystoneUser(unittest.TestCase):
+    """Test case for getting the Keystone users of the servers."""
+
+    def setUp(self):
+        """Create an extractor with a mocked Keystone client."""
+        super(TestNovaKeystoneUser, self).setUp()
+        self.extractor = object.__new__(nova.NovaExtractor)
+        self.extractor.keystone_unscoped = mock.Mock()
+
+    def test_get_keystone_user_hides_errors(self):
+        """Test that users that cannot be got are None."""
+        self.extractor.keystone_unscoped.users.get.side_effect = Exception("Boom")
+
+        self.assertIsNone(self.extractor._get_keystone_user("user-id"))
+
+    def test_get_keystone_user_raises_open_circuit(self):
+        """Test that an open circuit breaker is not hidden."""
+        self.extractor.keystone_unscoped.users.get.side_effect = (
+            exception.CircuitOpenError(endpoint="identity", failures=5)
+        )
+
+        with self.assertRaises(exception.CircuitOpenError):
+            self.extractor._get_keystone_user("user-id")
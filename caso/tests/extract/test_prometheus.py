@@ -16,12 +16,20 @@
 
 """Unit tests for the Prometheus energy consumption extractor."""
 
+import collections
 import datetime
+import io
+import json
 import unittest.mock as mock
 
 import pytest
+import requests
 from oslo_config import cfg
 
+from caso import exception
+from caso import http_pool
+from caso.extract import energy_cache
+from caso.extract import prometheus
 from caso.extract.prometheus import EnergyConsumptionExtractor
 
 CONF = cfg.CONF
@@ -72,6 +80,8 @@ def configured_extractor(mock_flavors):
     CONF.set_override("prometheus_step_seconds", 30, group="prometheus")
     CONF.set_override("prometheus_verify_ssl", True, group="prometheus")
     CONF.set_override("cpu_normalization_factor", 1.0, group="prometheus")
+    CONF.set_override("enabled", False, group="energy_cache")
+    CONF.set_override("stream_responses", False, group="prometheus")
 
     with mock.patch(
         "caso.extract.openstack.base.BaseOpenStackExtractor.__init__",
@@ -81,13 +91,19 @@ def configured_extractor(mock_flavors):
         return_value=mock_flavors,
     ), mock.patch(
         "caso.extract.openstack.base.BaseOpenStackExtractor._get_nova_client"
+    ), mock.patch(
+        "caso.extract.prometheus.time.sleep"
     ):
         extractor = EnergyConsumptionExtractor("test-project", "test-vo")
         extractor.project = "test-project"
         extractor.vo = "test-vo"
         extractor.project_id = "test-project-id"
         extractor.cloud_type = "openstack"
+        prometheus.reset_prometheus_client()
         yield extractor
+        prometheus.reset_prometheus_client()
+    CONF.clear_override("enabled", group="energy_cache")
+    CONF.clear_override("stream_responses", group="prometheus")
 
 
 @pytest.fixture
@@ -103,6 +119,28 @@ def mock_prometheus_result_success():
     ]
 
 
+def _power_series(vm_uuids, start, end, step):
+    """Get irregular power series (µW) for some VMs, as returned by Prometheus."""
+    series = []
+    for index, vm_uuid in enumerate(vm_uuids):
+        values = [
+            [t, str(1_000_000 * (index + 1) + (t % 7) * 1000)]
+            for t in range(start, end + 1, step)
+            # Some missing samples
+            if t % 3600 < 3000
+        ]
+        series.append({"metric": {"uuid": vm_uuid}, "values": values})
+    return series
+
+
+def _json_response(body, status_code=200):
+    """Get a response whose content is read from a stream."""
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(json.dumps(body).encode("utf-8"))
+    return response
+
+
 @pytest.fixture
 def mock_prometheus_result_empty():
     """Return an empty Prometheus result."""
@@ -194,7 +232,708 @@ class TestEnergyConsumptionExtractor:
         mock_prom.custom_query_range.side_effect = Exception("Connection error")
         mock_prom_connect.return_value = mock_prom
 
-        records = configured_extractor.extract(**extract_dates)
+        with pytest.raises(exception.IncompleteExtractionError) as excinfo:
+            configured_extractor.extract(**extract_dates)
 
-        assert len(records) == 0
+        assert excinfo.value.records == []
+        assert excinfo.value.kwargs["failed"] == 1
         mock_log.error.assert_called()
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_extract_batched(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        extract_dates,
+    ):
+        """Test that batched queries give the same results as per-VM queries."""
+        mock_server2 = mock.Mock()
+        mock_server2.id = "f4d6bedf-48c9-5f2f-b043-ebb4f9e65d73"
+        mock_server2.name = "test-vm-2"
+        mock_server2.status = "ACTIVE"
+        mock_server2.created = "2023-05-25T12:00:00Z"
+        mock_server2.flavor = {"id": "flavor-1"}
+        servers = [mock_server, mock_server2]
+
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = servers
+
+        series = {
+            mock_server.id: [[1685051946, "5.0"], [1685051976, "7.0"]],
+            mock_server2.id: [[1685051946, "3.0"]],
+        }
+
+        def query_range(query, **kwargs):
+            if "uuid=~" in query:
+                return [{"metric": {"uuid": k}, "values": v} for k, v in series.items()]
+            vm_uuid = query.split('uuid="')[1].split('"')[0]
+            return [{"metric": {"uuid": vm_uuid}, "values": series[vm_uuid]}]
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query_range.side_effect = query_range
+        mock_prom_connect.return_value = mock_prom
+
+        expected = configured_extractor.extract(**extract_dates)
+        per_vm_queries = mock_prom.custom_query_range.call_count
+
+        CONF.set_override("vm_batch_size", 50, group="prometheus")
+        mock_prom.custom_query_range.reset_mock()
+        records = configured_extractor.extract(**extract_dates)
+        CONF.clear_override("vm_batch_size", group="prometheus")
+
+        assert mock_prom.custom_query_range.call_count == per_vm_queries / 2
+        query = mock_prom.custom_query_range.call_args.kwargs["query"]
+        assert query == (
+            "prometheus_value{"
+            'type_instance="scaph_process_power_microwatts",'
+            f'uuid=~"{mock_server.id}|{mock_server2.id}"}}'
+        )
+        assert [r.energy_wh for r in records] == [r.energy_wh for r in expected]
+        assert records[0].energy_wh == pytest.approx(1.0e-07)
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_batched_queries_integrate_each_series(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        extract_dates,
+    ):
+        """Test that batched queries integrate the gapped series on their own."""
+        mock_server2 = mock.Mock()
+        mock_server2.id = "f4d6bedf-48c9-5f2f-b043-ebb4f9e65d73"
+        mock_server2.name = "test-vm-2"
+        mock_server2.status = "ACTIVE"
+        mock_server2.created = "2023-05-25T12:00:00Z"
+        mock_server2.flavor = {"id": "flavor-1"}
+        servers = [mock_server, mock_server2]
+
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = servers
+        CONF.set_override("max_sample_gap", 60, group="prometheus")
+        CONF.set_override("integration_method", "trapezoid", group="prometheus")
+
+        # Two series per VM, one of them with a gap longer than the maximum
+        start = 1685051946
+        steady = [[start + 30 * i, "10.0"] for i in range(10)]
+        gapped = [[start + 30 * i, "20.0"] for i in (0, 1, 2, 7, 8, 9)]
+        series = [
+            {"metric": {"uuid": vm_uuid, "core": core}, "values": values}
+            for vm_uuid in (mock_server.id, mock_server2.id)
+            for core, values in (("0", steady), ("1", gapped))
+        ]
+
+        def query_range(query, **kwargs):
+            if "uuid=~" in query:
+                result = series
+            else:
+                vm_uuid = query.split('uuid="')[1].split('"')[0]
+                result = [s for s in series if s["metric"]["uuid"] == vm_uuid]
+            if not query.startswith("sum by"):
+                return result
+            # Aggregated series, as Prometheus would return them
+            sums = collections.defaultdict(dict)
+            for s in result:
+                for t, v in s["values"]:
+                    vm_sums = sums[s["metric"]["uuid"]]
+                    vm_sums[t] = vm_sums.get(t, 0.0) + float(v)
+            return [
+                {"metric": {"uuid": k}, "values": sorted(v.items())}
+                for k, v in sums.items()
+            ]
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query_range.side_effect = query_range
+        mock_prom_connect.return_value = mock_prom
+
+        expected = configured_extractor.extract(**extract_dates)
+        CONF.set_override("vm_batch_size", 50, group="prometheus")
+        records = configured_extractor.extract(**extract_dates)
+        CONF.clear_override("vm_batch_size", group="prometheus")
+        CONF.clear_override("max_sample_gap", group="prometheus")
+        CONF.clear_override("integration_method", group="prometheus")
+
+        assert [r.energy_wh for r in records] == pytest.approx(
+            [r.energy_wh for r in expected]
+        )
+        # The gap is not accounted for, although the other series covers it
+        assert records[0].energy_wh == pytest.approx(
+            (10.0 * 270 + 20.0 * 120) / 3600 / 1_000_000
+        )
+
+    def test_batch_label_selector_escapes_regex(self, configured_extractor):
+        """Test that label values are escaped in the batch regex matcher."""
+        metric = configured_extractor._get_metrics()[0]
+        selector = configured_extractor._build_batch_label_selector(
+            metric, ["a.b", "c"]
+        )
+        assert selector.endswith('uuid=~"a\\\\.b|c"')
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_extract_multiple_metrics(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        extract_dates,
+        mock_prometheus_result_success,
+    ):
+        """Test that the energy of several metrics is obtained in a single run."""
+        prometheus.register_metric_opts(["scaphandre", "dcgm"])
+        CONF.set_override("metrics", ["scaphandre", "dcgm"], group="prometheus")
+        CONF.set_override(
+            "labels",
+            ["type_instance:scaph_process_power_microwatts"],
+            group="prometheus_metric_scaphandre",
+        )
+        CONF.set_override(
+            "metric_name", "DCGM_FI_DEV_POWER_USAGE", group="prometheus_metric_dcgm"
+        )
+        CONF.set_override(
+            "vm_uuid_label_name", "instance_uuid", group="prometheus_metric_dcgm"
+        )
+        CONF.set_override("unit", "watts", group="prometheus_metric_dcgm")
+
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = [mock_server]
+
+        def query_range(query, **kwargs):
+            if query.startswith("DCGM_FI_DEV_POWER_USAGE"):
+                return [
+                    {
+                        "metric": {"instance_uuid": mock_server.id},
+                        "values": [[1685051946, "2.0"]],
+                    }
+                ]
+            return mock_prometheus_result_success
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query_range.side_effect = query_range
+        mock_prom_connect.return_value = mock_prom
+
+        try:
+            records = configured_extractor.extract(**extract_dates)
+        finally:
+            CONF.clear_override("metrics", group="prometheus")
+            CONF.clear_override("labels", group="prometheus_metric_scaphandre")
+            CONF.clear_override("metric_name", group="prometheus_metric_dcgm")
+            CONF.clear_override("vm_uuid_label_name", group="prometheus_metric_dcgm")
+            CONF.clear_override("unit", group="prometheus_metric_dcgm")
+
+        # The servers are listed once for all the metrics
+        assert configured_extractor.nova.servers.list.call_count == 2
+        queries = [
+            c.kwargs["query"] for c in mock_prom.custom_query_range.call_args_list
+        ]
+        assert sorted(queries) == [
+            f'DCGM_FI_DEV_POWER_USAGE{{instance_uuid="{mock_server.id}"}}',
+            'prometheus_value{type_instance="scaph_process_power_microwatts",'
+            f'uuid="{mock_server.id}"}}',
+        ]
+        assert len(records) == 1
+        assert records[0].energy_wh_by_metric == {
+            "scaphandre": pytest.approx(4.1666667e-08),
+            "dcgm": pytest.approx(2.0 * 30 / 3600),
+        }
+        assert records[0].energy_wh == pytest.approx(2.0 * 30 / 3600 + 4.1666667e-08)
+        message = json.loads(records[0].ssm_message())
+        assert set(message["EnergyWhByMetric"]) == {"scaphandre", "dcgm"}
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_vm_with_failed_metric_is_skipped(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        extract_dates,
+        mock_prometheus_result_success,
+    ):
+        """Test that no record is built if the energy of a metric is missing."""
+        prometheus.register_metric_opts(["scaphandre", "ipmi"])
+        CONF.set_override("metrics", ["scaphandre", "ipmi"], group="prometheus")
+        CONF.set_override("metric_name", "ipmi_power", group="prometheus_metric_ipmi")
+
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = [mock_server]
+
+        def query_range(query, **kwargs):
+            if query.startswith("ipmi_power"):
+                raise Exception("Connection error")
+            return mock_prometheus_result_success
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query_range.side_effect = query_range
+        mock_prom_connect.return_value = mock_prom
+
+        try:
+            with pytest.raises(exception.IncompleteExtractionError) as excinfo:
+                configured_extractor.extract(**extract_dates)
+        finally:
+            CONF.clear_override("metrics", group="prometheus")
+            CONF.clear_override("metric_name", group="prometheus_metric_ipmi")
+
+        assert excinfo.value.records == []
+
+    def test_single_metric_is_not_attributed(
+        self,
+        configured_extractor,
+        mock_server,
+    ):
+        """Test that records do not report the energy per metric by default."""
+        energy_record = configured_extractor._build_energy_record(
+            mock_server,
+            1.0,
+            datetime.datetime(2023, 5, 25, 12, 0, 0),
+            datetime.datetime(2023, 5, 25, 18, 0, 0),
+        )
+        assert energy_record.energy_wh_by_metric is None
+        assert "EnergyWhByMetric" not in json.loads(energy_record.ssm_message())
+
+    @pytest.mark.parametrize(
+        "mode,query,value,energy",
+        [
+            (
+                "sum_over_time",
+                "sum by (uuid) (sum_over_time(prometheus_value{"
+                'type_instance="scaph_process_power_microwatts",'
+                'uuid="e3c5aeef-37b8-4332-ad9f-9d068f156dc2"}[43199s:30s]))',
+                "5.0",
+                4.1666667e-08,
+            ),
+            (
+                "avg_over_time",
+                "sum by (uuid) (avg_over_time(prometheus_value{"
+                'type_instance="scaph_process_power_microwatts",'
+                'uuid="e3c5aeef-37b8-4332-ad9f-9d068f156dc2"}[43199s]))',
+                "1000000.0",
+                11.999722,
+            ),
+        ],
+    )
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_extract_server_side_integration(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        extract_dates,
+        mode,
+        query,
+        value,
+        energy,
+    ):
+        """Test that Prometheus can do the integration with an instant query."""
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = [mock_server]
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query.return_value = [
+            {"metric": {"uuid": mock_server.id}, "value": [1685051946, value]}
+        ]
+        mock_prom_connect.return_value = mock_prom
+
+        CONF.set_override("integration_mode", mode, group="prometheus")
+        extract_dates["extract_from"] = datetime.datetime(2023, 5, 25, 12, 0, 0)
+        records = configured_extractor.extract(**extract_dates)
+        CONF.clear_override("integration_mode", group="prometheus")
+
+        mock_prom.custom_query_range.assert_not_called()
+        mock_prom.custom_query.assert_called_once()
+        assert mock_prom.custom_query.call_args.kwargs["query"] == query
+        assert len(records) == 1
+        assert records[0].energy_wh == pytest.approx(energy)
+
+    def test_prometheus_client_is_shared(self, configured_extractor):
+        """Test that a single pooled Prometheus client is used for the run."""
+        prom = configured_extractor._get_prometheus_client()
+        assert prometheus.get_prometheus_client() is prom
+
+        session = prometheus.get_prometheus_session()
+        adapter = session.get_adapter(prom.url)
+        assert isinstance(adapter, http_pool.PooledHTTPAdapter)
+        assert adapter.max_retries.total > 0
+        assert session.verify is True
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_failed_queries_are_retried(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        extract_dates,
+        mock_prometheus_result_success,
+    ):
+        """Test that failed queries are retried with a timeout."""
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = [mock_server]
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query_range.side_effect = [
+            Exception("Connection error"),
+            mock_prometheus_result_success,
+        ]
+        mock_prom_connect.return_value = mock_prom
+
+        records = configured_extractor.extract(**extract_dates)
+
+        assert len(records) == 1
+        assert mock_prom.custom_query_range.call_count == 2
+        assert mock_prom.custom_query_range.call_args.kwargs["timeout"] == 60
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_chunks_are_queried_concurrently(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+    ):
+        """Test that chunks are queried concurrently and joined in order."""
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = [mock_server]
+        mock_server.created = "2023-05-01T00:00:00Z"
+
+        def query_range(query, start_time, end_time, **kwargs):
+            # Samples out of order, as chunks may be completed in any order
+            ts = start_time.timestamp()
+            return [{"metric": {}, "values": [[ts + 30, "1.0"], [ts, "1.0"]]}]
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query_range.side_effect = query_range
+        mock_prom_connect.return_value = mock_prom
+
+        CONF.set_override("max_concurrent_queries", 3, group="prometheus")
+        with mock.patch.object(
+            configured_extractor, "_integrate_energy"
+        ) as m_integrate:
+            m_integrate.return_value = prometheus.integration.Integral(1.0, 1.0)
+            configured_extractor.extract(
+                datetime.datetime(2023, 5, 1, 0, 0, 0),
+                datetime.datetime(2023, 5, 11, 0, 0, 0),
+            )
+        CONF.clear_override("max_concurrent_queries", group="prometheus")
+
+        # 10 days at 30s are 28800 steps, split in chunks of 11000 steps
+        assert mock_prom.custom_query_range.call_count == 3
+        (series, _), _ = m_integrate.call_args
+        timestamps = [t for t, _ in series[0]]
+        assert timestamps == sorted(timestamps)
+        assert len(timestamps) == 6
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_vm_with_failed_chunk_is_skipped(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        extract_dates,
+        mock_prometheus_result_success,
+    ):
+        """Test that a VM is skipped if a chunk fails after all the retries."""
+        mock_server2 = mock.Mock()
+        mock_server2.id = "f4d6bedf-48c9-5f2f-b043-ebb4f9e65d73"
+        mock_server2.name = "test-vm-2"
+        mock_server2.status = "ACTIVE"
+        mock_server2.created = "2023-05-25T12:00:00Z"
+        mock_server2.flavor = {"id": "flavor-1"}
+
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = [
+            mock_server,
+            mock_server2,
+        ]
+
+        def query_range(query, **kwargs):
+            if mock_server.id in query:
+                raise Exception("Connection error")
+            return mock_prometheus_result_success
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query_range.side_effect = query_range
+        mock_prom_connect.return_value = mock_prom
+
+        with pytest.raises(exception.IncompleteExtractionError) as excinfo:
+            configured_extractor.extract(**extract_dates)
+
+        # The records of the other VMs are still obtained
+        records = excinfo.value.records
+        assert [str(r.exec_unit_id) for r in records] == [mock_server2.id]
+        # 1 query for the second VM, 1 + 2 retries for the first one
+        assert mock_prom.custom_query_range.call_count == 4
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_only_vms_alive_in_period_are_queried(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        extract_dates,
+        mock_prometheus_result_success,
+    ):
+        """Test that VMs deleted before or created after the period are skipped."""
+        deleted_before = mock.Mock()
+        deleted_before.id = "a1b2c3d4-0000-4000-8000-000000000001"
+        deleted_before.name = "deleted-before"
+        deleted_before.status = "DELETED"
+        deleted_before.created = "2023-05-01T00:00:00Z"
+        deleted_before.updated = "2023-05-24T00:00:00Z"
+        setattr(deleted_before, "OS-SRV-USG:terminated_at", "2023-05-24T00:00:00Z")
+
+        created_after = mock.Mock()
+        created_after.id = "a1b2c3d4-0000-4000-8000-000000000002"
+        created_after.name = "created-after"
+        created_after.status = "ACTIVE"
+        created_after.created = "2023-05-26T00:00:00Z"
+
+        def list_servers(search_opts=None, **kwargs):
+            if search_opts:
+                return [deleted_before]
+            return [mock_server, created_after]
+
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.side_effect = list_servers
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query_range.return_value = mock_prometheus_result_success
+        mock_prom_connect.return_value = mock_prom
+
+        records = configured_extractor.extract(**extract_dates)
+
+        assert [str(r.exec_unit_id) for r in records] == [mock_server.id]
+        assert mock_prom.custom_query_range.call_count == 1
+        query = mock_prom.custom_query_range.call_args[1]["query"]
+        assert mock_server.id in query
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_query_range_is_clipped_to_vm_lifetime(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        extract_dates,
+        mock_prometheus_result_success,
+    ):
+        """Test that a VM is only queried while it existed in the period."""
+        mock_prometheus_result_success[0]["values"] = [[1685026800, "5.0"]]
+        mock_server.status = "DELETED"
+        mock_server.updated = "2023-05-25T18:00:05Z"
+        setattr(mock_server, "OS-SRV-USG:terminated_at", "2023-05-25T18:00:00Z")
+
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = [mock_server]
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query_range.return_value = mock_prometheus_result_success
+        mock_prom_connect.return_value = mock_prom
+
+        records = configured_extractor.extract(**extract_dates)
+
+        kwargs = mock_prom.custom_query_range.call_args[1]
+        assert kwargs["start_time"] == datetime.datetime(
+            2023, 5, 25, 12, 0, 0, tzinfo=datetime.timezone.utc
+        )
+        assert kwargs["end_time"] == datetime.datetime(
+            2023, 5, 25, 18, 0, 0, tzinfo=datetime.timezone.utc
+        )
+        # The record still covers the extraction period
+        assert len(records) == 1
+        assert records[0].start_exec_time == "2023-05-25T12:00:00Z"
+        assert records[0].end_exec_time == "2023-05-25T23:59:59Z"
+        assert records[0].wall_clock_time_s == 12 * 3600 - 1
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_cached_buckets_are_not_queried_again(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        local_timezone,
+    ):
+        """Test that a second extraction only queries the uncached edges."""
+        mock_server.created = "2023-05-01T00:00:00Z"
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = [mock_server]
+
+        def query_range(query, start_time, end_time, step, **kwargs):
+            # 1 W samples
+            start = int(start_time.timestamp())
+            end = int(end_time.timestamp())
+            values = [[t, "1000000"] for t in range(start, end + 1, step)]
+            return [{"metric": {}, "values": values}]
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query_range.side_effect = query_range
+        mock_prom_connect.return_value = mock_prom
+
+        extract_from = datetime.datetime(2023, 5, 25, 0, 0, 0)
+        extract_to = datetime.datetime(2023, 5, 25, 3, 30, 0)
+        cache = energy_cache.EnergyCache()
+        with mock.patch.object(energy_cache, "get_cache", return_value=cache):
+            first = configured_extractor.extract(extract_from, extract_to)
+            second = configured_extractor.extract(extract_from, extract_to)
+
+        assert mock_prom.custom_query_range.call_count == 2
+        first_call, second_call = mock_prom.custom_query_range.call_args_list
+        assert first_call[1]["start_time"] == extract_from.replace(
+            tzinfo=datetime.timezone.utc
+        )
+        assert second_call[1]["start_time"] == datetime.datetime(
+            2023, 5, 25, 3, 0, tzinfo=datetime.timezone.utc
+        )
+        assert (cache.hits, cache.misses) == (3, 3)
+        # 3.5 hours at 1 W, the last sample holding for a step
+        assert first[0].energy_wh == pytest.approx(3.5 + 30 / 3600)
+        assert second[0].energy_wh == pytest.approx(first[0].energy_wh)
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_server_side_buckets_are_cached(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        local_timezone,
+    ):
+        """Test that missing buckets are integrated with a single range query."""
+        mock_server.created = "2023-05-01T00:00:00Z"
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = [mock_server]
+
+        def query_range(query, start_time, end_time, step, **kwargs):
+            # 1 Wh (120 samples of 1 W) per bucket
+            start = int(start_time.timestamp())
+            end = int(end_time.timestamp())
+            values = [[t, "120000000"] for t in range(start, end + 1, step)]
+            return [{"metric": {"uuid": mock_server.id}, "values": values}]
+
+        mock_prom = mock.Mock()
+        mock_prom.custom_query_range.side_effect = query_range
+        mock_prom.custom_query.return_value = [
+            {"metric": {"uuid": mock_server.id}, "value": [0, "60000000"]}
+        ]
+        mock_prom_connect.return_value = mock_prom
+
+        extract_from = datetime.datetime(2023, 5, 25, 0, 0, 0)
+        extract_to = datetime.datetime(2023, 5, 25, 3, 30, 0)
+        CONF.set_override("integration_mode", "sum_over_time", group="prometheus")
+        cache = energy_cache.EnergyCache()
+        with mock.patch.object(energy_cache, "get_cache", return_value=cache):
+            first = configured_extractor.extract(extract_from, extract_to)
+            second = configured_extractor.extract(extract_from, extract_to)
+        CONF.clear_override("integration_mode", group="prometheus")
+
+        mock_prom.custom_query_range.assert_called_once()
+        kwargs = mock_prom.custom_query_range.call_args[1]
+        assert "[3600s:30s]" in kwargs["query"]
+        assert kwargs["start_time"] == datetime.datetime(
+            2023, 5, 25, 1, 0, tzinfo=datetime.timezone.utc
+        )
+        assert kwargs["end_time"] == datetime.datetime(
+            2023, 5, 25, 3, 0, tzinfo=datetime.timezone.utc
+        )
+        assert kwargs["step"] == 3600
+        # The edge is queried in both runs, at its UTC timestamp
+        assert mock_prom.custom_query.call_count == 2
+        for call in mock_prom.custom_query.call_args_list:
+            assert 1684972800 <= call[1]["params"]["time"] <= 1684985400
+        assert first[0].energy_wh == pytest.approx(3.5)
+        assert second[0].energy_wh == pytest.approx(3.5)
+
+    @pytest.mark.parametrize("method", ["step", "trapezoid"])
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_streamed_responses_give_the_same_energy(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        method,
+    ):
+        """Test that decoding responses as they are received gives the same energy."""
+        mock_server2 = mock.Mock()
+        mock_server2.id = "f4d6bedf-48c9-5f2f-b043-ebb4f9e65d73"
+        mock_server2.name = "test-vm-2"
+        mock_server2.status = "ACTIVE"
+        mock_server2.created = "2023-05-20T00:00:00Z"
+        mock_server2.flavor = {"id": "flavor-1"}
+        mock_server.created = "2023-05-20T00:00:00Z"
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = [
+            mock_server,
+            mock_server2,
+        ]
+        vm_uuids = [mock_server.id, mock_server2.id]
+
+        def query_range(query, start_time, end_time, step, **kwargs):
+            start = int(start_time.timestamp())
+            end = int(end_time.timestamp())
+            return _power_series(vm_uuids, start, end, step)
+
+        def request(url, params, **kwargs):
+            assert url == "http://localhost:9090/api/v1/query_range"
+            assert kwargs["stream"] is True
+            result = _power_series(
+                vm_uuids, params["start"], params["end"], params["step"]
+            )
+            return _json_response(
+                {
+                    "status": "success",
+                    "data": {"resultType": "matrix", "result": result},
+                }
+            )
+
+        mock_prom = mock.Mock()
+        mock_prom.url = "http://localhost:9090"
+        mock_prom.custom_query_range.side_effect = query_range
+        mock_prom_connect.return_value = mock_prom
+        session = mock.Mock()
+        session.get.side_effect = request
+
+        extract_from = datetime.datetime(2023, 5, 20, 0, 0, 0)
+        extract_to = datetime.datetime(2023, 5, 25, 0, 0, 0)
+        CONF.set_override("integration_method", method, group="prometheus")
+        CONF.set_override("vm_batch_size", 2, group="prometheus")
+        expected = configured_extractor.extract(extract_from, extract_to)
+        CONF.set_override("stream_responses", True, group="prometheus")
+        # Read the responses in small chunks
+        with mock.patch.object(prometheus, "_STREAM_CHUNK_SIZE", 100):
+            with mock.patch.object(
+                prometheus, "get_prometheus_session", return_value=session
+            ):
+                records = configured_extractor.extract(extract_from, extract_to)
+        CONF.clear_override("integration_method", group="prometheus")
+        CONF.clear_override("vm_batch_size", group="prometheus")
+
+        # 5 days at 30s are split in 2 chunks
+        assert session.get.call_count == 2
+        assert len(records) == 2
+        for record, expected_record in zip(records, expected):
+            assert record.energy_wh == pytest.approx(expected_record.energy_wh)
+
+    @mock.patch("caso.extract.prometheus.prometheus_api_client.PrometheusConnect")
+    def test_streamed_response_error(
+        self,
+        mock_prom_connect,
+        configured_extractor,
+        mock_server,
+        extract_dates,
+    ):
+        """Test that failed streamed queries are retried, and the VM skipped."""
+        configured_extractor.nova = mock.Mock()
+        configured_extractor.nova.servers.list.return_value = [mock_server]
+
+        mock_prom = mock.Mock()
+        mock_prom.url = "http://localhost:9090"
+        mock_prom_connect.return_value = mock_prom
+        session = mock.Mock()
+        session.get.side_effect = lambda url, **kwargs: _json_response(
+            {"status": "error", "error": "overloaded"}, status_code=503
+        )
+
+        CONF.set_override("stream_responses", True, group="prometheus")
+        with mock.patch.object(
+            prometheus, "get_prometheus_session", return_value=session
+        ):
+            with pytest.raises(exception.IncompleteExtractionError) as excinfo:
+                configured_extractor.extract(**extract_dates)
+
+        assert excinfo.value.records == []
+        assert session.get.call_count == 3
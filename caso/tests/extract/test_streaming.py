@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for `caso.extract.streaming` module."""
+
+import json
+
+import pytest
+
+from caso.extract import streaming
+
+RESPONSE = {
+    "status": "success",
+    "data": {
+        "resultType": "matrix",
+        "result": [
+            {
+                "metric": {"uuid": "vm-1", "type": "power"},
+                "values": [[1685051946, "5.0"], [1685051976.5, "6e3"]],
+            },
+            {"metric": {"uuid": "vm-2"}, "values": [[1685051946, "NaN"]]},
+            {"metric": {"uuid": "vm-3"}, "values": []},
+        ],
+    },
+}
+
+EXPECTED = [
+    ({"uuid": "vm-1", "type": "power"}, 1685051946.0, 5.0),
+    ({"uuid": "vm-1", "type": "power"}, 1685051976.5, 6000.0),
+    ({"uuid": "vm-2"}, 1685051946.0, float("nan")),
+]
+
+
+def _chunks(body, size):
+    data = json.dumps(body, indent=2).encode("utf-8")
+    chunks = []
+    for start in range(0, len(data), size):
+        end = start + size
+        chunks.append(data[start:end])
+    return chunks
+
+
+def _assert_samples(samples, expected):
+    assert len(samples) == len(expected)
+    for (metric, timestamp, value), (e_metric, e_timestamp, e_value) in zip(
+        samples, expected
+    ):
+        assert metric == e_metric
+        assert timestamp == e_timestamp
+        assert value == pytest.approx(e_value, nan_ok=True)
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 64, 100_000])
+def test_samples_are_decoded_in_any_chunk_size(size):
+    """Test that samples are decoded whatever the size of the chunks."""
+    samples = list(streaming.iter_samples(_chunks(RESPONSE, size)))
+    _assert_samples(samples, EXPECTED)
+
+
+def test_metric_after_values():
+    """Test that the labels of a series are applied if they come last."""
+    body = {
+        "status": "success",
+        "data": {"result": [{"values": [[1, "2"]], "metric": {"uuid": "vm-1"}}]},
+    }
+    samples = list(streaming.iter_samples(_chunks(body, 3)))
+    assert samples == [({"uuid": "vm-1"}, 1.0, 2.0)]
+
+
+def test_samples_are_yielded_incrementally():
+    """Test that samples are yielded before the whole response is read."""
+    read = []
+
+    def chunks():
+        for chunk in _chunks(RESPONSE, 16):
+            read.append(chunk)
+            yield chunk
+
+    samples = streaming.iter_samples(chunks())
+    next(samples)
+    assert len(read) < len(_chunks(RESPONSE, 16))
+
+
+def test_failed_query():
+    """Test that an unsuccessful response is rejected."""
+    body = {"status": "error", "errorType": "timeout", "error": "query timed out"}
+    with pytest.raises(ValueError):
+        list(streaming.iter_samples(_chunks(body, 8)))
+
+
+@pytest.mark.parametrize(
+    "data", [b"", b'{"status": "success", "data": {"result": [', b"[1, 2]"]
+)
+def test_invalid_response(data):
+    """Test that truncated or invalid responses are rejected."""
+    with pytest.raises(ValueError):
+        list(streaming.iter_samples([data]))
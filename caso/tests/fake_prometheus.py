@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A local stand-in for a Prometheus server, serving synthetic power series.
+
+The server answers the range (``/api/v1/query_range``) and instant
+(``/api/v1/query``) queries sent by the Prometheus extractor, with
+Scaphandre-like power series (in µW) for a configurable number of VMs and of
+series per VM. Only the subset of PromQL used by the extractor is understood:
+
+- a selector, ``metric{label="value", uuid=~"regex"}``
+- optionally wrapped in ``sum_over_time(selector[<range>s:<step>s])`` or
+  ``avg_over_time(selector[<range>s])``
+- optionally aggregated with ``sum by (label) (...)``
+
+The server counts the queries it answers and the bytes it sends, so that it can
+be used to compare query strategies.
+"""
+
+import http.server
+import json
+import re
+import threading
+import urllib.parse
+
+_MATCHER = re.compile(r'\s*(\w+)\s*(=~|!=|=)\s*"((?:[^"\\]|\\.)*)"\s*,?')
+_SELECTOR = re.compile(r"^(\w+)\{(.*)\}$")
+_FUNCTION = re.compile(r"^(sum_over_time|avg_over_time)\((.*)\[(\d+)s(?::(\d+)s)?\]\)$")
+_AGGREGATION = re.compile(r"^sum by \((\w+)\) \((.*)\)$")
+
+
+def _unescape(value):
+    """Unescape a PromQL string."""
+    return re.sub(r"\\(.)", r"\1", value)
+
+
+class PromQLError(Exception):
+    """The query is not supported by the fake server."""
+
+
+class FakePrometheus(object):
+    """Synthetic power series, and the evaluation of the queries over them.
+
+    :param vm_uuids: UUIDs of the VMs with power series.
+    :param series_per_vm: Number of series (e.g. processes) of each VM.
+    :param interval: Scrape interval of the series, in seconds.
+    :param metric: Name of the metric.
+    :param labels: Labels shared by all the series.
+    :param uuid_label: Name of the label with the VM UUID.
+    """
+
+    def __init__(
+        self,
+        vm_uuids,
+        series_per_vm=1,
+        interval=30,
+        metric="prometheus_value",
+        labels=None,
+        uuid_label="uuid",
+    ):
+        """Build the series of the VMs."""
+        self.interval = interval
+        self.uuid_label = uuid_label
+        if labels is None:
+            labels = {"type_instance": "scaph_process_power_microwatts"}
+        self.series = []
+        for vm_index, vm_uuid in enumerate(vm_uuids):
+            for index in range(series_per_vm):
+                series_labels = dict(labels, __name__=metric)
+                series_labels[uuid_label] = vm_uuid
+                series_labels["exe"] = f"process-{index}"
+                self.series.append((series_labels, vm_index * 31 + index))
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.bytes_sent = 0
+
+    def reset_stats(self):
+        """Reset the query and byte counters."""
+        with self._lock:
+            self.queries = 0
+            self.bytes_sent = 0
+
+    def account(self, size):
+        """Account a query whose response had some bytes."""
+        with self._lock:
+            self.queries += 1
+            self.bytes_sent += size
+
+    def value(self, seed, timestamp):
+        """Get the power (µW) of a series at a scrape time."""
+        tick = int(timestamp // self.interval)
+        return 1_000_000 + ((seed * 7919 + tick * 104729) % 1000) * 1000
+
+    def _scrapes(self, start, end):
+        """Get the scrape times in the (start, end] interval."""
+        first = int(start // self.interval) + 1
+        last = int(end // self.interval)
+        return [t * self.interval for t in range(first, last + 1)]
+
+    def _select(self, selector):
+        match = _SELECTOR.match(selector.strip())
+        if match is None:
+            raise PromQLError(f"Unsupported selector '{selector}'")
+        matchers = [("__name__", "=", match.group(1))]
+        for name, op, value in _MATCHER.findall(match.group(2)):
+            matchers.append((name, op, _unescape(value)))
+
+        selected = []
+        for labels, seed in self.series:
+            for name, op, value in matchers:
+                actual = labels.get(name, "")
+                if op == "=~":
+                    matched = re.fullmatch(value, actual) is not None
+                else:
+                    matched = (actual == value) == (op == "=")
+                if not matched:
+                    break
+            else:
+                selected.append((labels, seed))
+        return selected
+
+    def _compile(self, expression):
+        """Compile an instant vector expression.
+
+        :returns: A function evaluating the expression at a time, returning a
+                  list of (labels, value) tuples.
+        """
+        expression = expression.strip()
+        match = _AGGREGATION.match(expression)
+        if match is not None:
+            label = match.group(1)
+            inner = self._compile(match.group(2))
+
+            def aggregate(at):
+                groups = {}
+                for labels, value in inner(at):
+                    key = labels.get(label, "")
+                    groups[key] = groups.get(key, 0.0) + value
+                return [({label: k}, v) for k, v in groups.items()]
+
+            return aggregate
+
+        match = _FUNCTION.match(expression)
+        if match is not None:
+            function, selector, window, step = match.groups()
+            window = int(window)
+            selected = [
+                ({k: v for k, v in labels.items() if k != "__name__"}, seed)
+                for labels, seed in self._select(selector)
+            ]
+
+            def over_time(at):
+                if step is None:
+                    times = self._scrapes(at - window, at)
+                else:
+                    first = int((at - window) // int(step)) + 1
+                    last = int(at // int(step))
+                    times = [t * int(step) for t in range(first, last + 1)]
+                result = []
+                for labels, seed in selected:
+                    values = [self.value(seed, t) for t in times]
+                    if not values:
+                        continue
+                    if function == "avg_over_time":
+                        result.append((labels, sum(values) / len(values)))
+                    else:
+                        result.append((labels, float(sum(values))))
+                return result
+
+            return over_time
+
+        selected = self._select(expression)
+        return lambda at: [
+            (labels, float(self.value(seed, at))) for labels, seed in selected
+        ]
+
+    def query(self, expression, at):
+        """Evaluate an instant query, as returned by the HTTP API."""
+        return {
+            "resultType": "vector",
+            "result": [
+                {"metric": labels, "value": [at, _format(value)]}
+                for labels, value in self._compile(expression)(at)
+            ],
+        }
+
+    def query_range(self, expression, start, end, step):
+        """Evaluate a range query, as returned by the HTTP API."""
+        evaluate = self._compile(expression)
+        series = {}
+        t = start
+        while t <= end:
+            for labels, value in evaluate(t):
+                key = tuple(sorted(labels.items()))
+                series.setdefault(key, []).append([t, _format(value)])
+            t += step
+        return {
+            "resultType": "matrix",
+            "result": [
+                {"metric": dict(key), "values": values}
+                for key, values in series.items()
+            ],
+        }
+
+
+def _format(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # noqa(N802)
+        """Answer a Prometheus API query."""
+        url = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        self._answer(url.path, params)
+
+    def do_POST(self):  # noqa(N802)
+        """Answer a Prometheus API query sent as a form."""
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        params = dict(urllib.parse.parse_qsl(body))
+        self._answer(urllib.parse.urlparse(self.path).path, params)
+
+    def _answer(self, path, params):
+        prometheus = self.server.prometheus
+        try:
+            if path == "/api/v1/query_range":
+                data = prometheus.query_range(
+                    params["query"],
+                    float(params["start"]),
+                    float(params["end"]),
+                    float(params["step"]),
+                )
+            elif path == "/api/v1/query":
+                data = prometheus.query(params["query"], float(params["time"]))
+            else:
+                self._reply(404, {"status": "error", "error": "not found"})
+                return
+        except (KeyError, ValueError, PromQLError) as e:
+            self._reply(
+                400, {"status": "error", "errorType": "bad_data", "error": str(e)}
+            )
+            return
+        self._reply(200, {"status": "success", "data": data})
+
+    def _reply(self, status, body):
+        body = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        self.server.prometheus.account(len(body))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Do not log anything."""
+
+
+class FakePrometheusServer(object):
+    """A local HTTP server answering queries with a FakePrometheus.
+
+    It can be used as a context manager, that starts the server in a thread
+    and stops it on exit.
+    """
+
+    def __init__(self, prometheus):
+        """Create the server, listening on a random local port."""
+        self.prometheus = prometheus
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.prometheus = prometheus
+        self._thread = None
+
+    @property
+    def url(self):
+        """Get the URL of the server."""
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        """Start serving requests in a thread."""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        """Start the server."""
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """Stop the server."""
+        self.stop()
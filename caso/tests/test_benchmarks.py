@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Smoke test of the benchmarks."""
+
+import pytest
+
+from caso.tests import benchmark_compact_records
+from caso.tests import benchmark_harness
+from caso.tests import benchmark_prometheus
+from caso.tests import benchmark_records
+from caso.tests import benchmark_serialization
+from caso.tests import benchmark_spool
+
+BENCHMARKS = {
+    "compact_records": benchmark_compact_records.BENCHMARK,
+    "prometheus": benchmark_prometheus.BENCHMARK,
+    "records": benchmark_records.BENCHMARK,
+    "serialization": benchmark_serialization.BENCHMARK,
+    "spool": benchmark_spool.BENCHMARK,
+}
+
+
+@pytest.mark.parametrize("benchmark", BENCHMARKS.values(), ids=list(BENCHMARKS))
+def test_benchmark(benchmark):
+    """Test that a benchmark runs all its cases with a small workload."""
+    results = benchmark_harness.run(benchmark, **(benchmark.smoke or {}))
+
+    assert list(dict.fromkeys(r.case for r in results)) == list(benchmark.cases)
+    if benchmark.check:
+        benchmark.check(results)
+    table = benchmark_harness.format_results(benchmark, results).splitlines()
+    assert len(table) == len(results) + 1
+    assert all(line.startswith(r.case) for line, r in zip(table[1:], results))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for `caso.circuit_breaker` module."""
+
+from unittest import mock
+
+import keystoneauth1.exceptions
+import keystoneauth1.session
+import pytest
+from oslo_config import cfg
+
+from caso import circuit_breaker
+from caso import exception
+from caso import keystone_client
+from caso import ratelimit
+
+CONF = cfg.CONF
+
+
+@pytest.fixture(autouse=True)
+def reset_breakers():
+    """Reset the breakers and the configuration after each test."""
+    with mock.patch("time.sleep"):
+        yield
+    circuit_breaker.reset()
+    ratelimit.reset()
+    CONF.reset()
+
+
+def _response(status):
+    resp = mock.Mock()
+    resp.status_code = status
+    resp.headers = {}
+    return resp
+
+
+def test_retry_delay_is_bounded():
+    """Test that the retry delay uses jitter within the backoff ceiling."""
+    CONF.set_override("retry_base_delay", 1, group="circuit_breaker")
+    CONF.set_override("retry_max_delay", 5, group="circuit_breaker")
+    for attempt in range(10):
+        delay = circuit_breaker.retry_delay(attempt)
+        assert 0 <= delay <= min(5, 2**attempt)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    """Test that the breaker opens only after consecutive failures."""
+    breaker = circuit_breaker.CircuitBreaker("volumev3", 2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    with pytest.raises(exception.CircuitOpenError):
+        breaker.check()
+    assert breaker.total_failures == 3
+
+
+def test_breaker_disabled():
+    """Test that a zero threshold never opens the breaker."""
+    breaker = circuit_breaker.CircuitBreaker("volumev3", 0)
+    for _ in range(100):
+        breaker.record_failure()
+    breaker.check()
+
+
+def test_session_retries_connection_failures():
+    """Test that the session retries requests failing to connect."""
+    sess = keystone_client.Session()
+    side_effect = [keystoneauth1.exceptions.ConnectFailure(), _response(200)]
+    with mock.patch.object(
+        keystoneauth1.session.Session, "request", side_effect=side_effect
+    ) as m:
+        resp = sess.request(
+            "/volumes", "GET", endpoint_filter={"service_type": "volumev3"}
+        )
+    assert resp.status_code == 200
+    assert m.call_count == 2
+    breaker = circuit_breaker.get_breaker("volumev3")
+    assert breaker.consecutive_failures == 0
+
+
+def test_session_opens_circuit():
+    """Test that the session stops sending requests to a failing endpoint."""
+    CONF.set_override("retries", 1, group="circuit_breaker")
+    CONF.set_override("failure_threshold", 2, group="circuit_breaker")
+    sess = keystone_client.Session()
+    with mock.patch.object(
+        keystoneauth1.session.Session,
+        "request",
+        side_effect=keystoneauth1.exceptions.ConnectTimeout(),
+    ) as m:
+        for _ in range(2):
+            with pytest.raises(keystoneauth1.exceptions.ConnectTimeout):
+                sess.request(
+                    "/volumes", "GET", endpoint_filter={"service_type": "volumev3"}
+                )
+        assert m.call_count == 4
+
+        with pytest.raises(exception.CircuitOpenError):
+            sess.request(
+                "/volumes", "GET", endpoint_filter={"service_type": "volumev3"}
+            )
+        assert m.call_count == 4
+
+
+def test_session_returns_server_errors_when_not_raising():
+    """Test that server errors are retried and returned if not raising."""
+    CONF.set_override("retries", 1, group="circuit_breaker")
+    sess = keystone_client.Session()
+    with mock.patch.object(
+        keystoneauth1.session.Session, "request", return_value=_response(500)
+    ) as m:
+        resp = sess.request(
+            "/servers",
+            "GET",
+            endpoint_filter={"service_type": "compute"},
+            raise_exc=False,
+        )
+    assert resp.status_code == 500
+    assert m.call_count == 2
+    assert circuit_breaker.total_failures() == 1
+
+
+@pytest.mark.parametrize("raise_exc", [True, False])
+def test_session_does_not_retry_throttled_requests_twice(raise_exc):
+    """Test that throttled requests are only retried by the limiter."""
+    CONF.set_override("retries", 2, group="circuit_breaker")
+    CONF.set_override("max_retries", 3, group="rate_limit")
+    sess = keystone_client.Session()
+    with mock.patch.object(
+        keystoneauth1.session.Session, "request", return_value=_response(503)
+    ) as m, mock.patch.object(ratelimit.ServiceLimiter, "throttled") as m_throttled:
+        if raise_exc:
+            with pytest.raises(keystoneauth1.exceptions.ServiceUnavailable):
+                sess.request(
+                    "/volumes", "GET", endpoint_filter={"service_type": "volumev3"}
+                )
+        else:
+            resp = sess.request(
+                "/volumes",
+                "GET",
+                endpoint_filter={"service_type": "volumev3"},
+                raise_exc=False,
+            )
+            assert resp.status_code == 503
+    # The first request and the 3 retries of the limiter, not (2 + 1) * (3 + 1)
+    assert m.call_count == 4
+    assert m_throttled.call_count == 3
+    assert circuit_breaker.total_failures() == 1
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for `caso.messenger.delivery_index` module."""
+
+import datetime
+import unittest.mock as mock
+
+import pytest
+from oslo_config import cfg
+
+import caso.messenger
+from caso.messenger import delivery_index
+import caso.record_batch
+
+CONF = cfg.CONF
+CONF.import_opt("spooldir", "caso.manager")
+
+
+class FakeClock(object):
+    """A fake clock that can be moved forward."""
+
+    def __init__(self):
+        """Start the clock at 2023-05-26T00:00:00Z."""
+        self.now = 1685059200.0
+
+    def __call__(self):
+        """Get the current time."""
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    """Get a fake clock."""
+    return FakeClock()
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    """Get the path of a delivery index database."""
+    return str(tmp_path / delivery_index.INDEX_FILE)
+
+
+@pytest.fixture
+def spooldir(tmp_path):
+    """Use a temporary spool directory, closing the shared index afterwards."""
+    CONF.set_override("spooldir", str(tmp_path))
+    yield tmp_path
+    delivery_index.reset()
+    CONF.clear_override("spooldir")
+
+
+def test_record_digest(cloud_record_list, ip_record):
+    """Test that the hash of a record only depends on its contents."""
+    record = cloud_record_list[0]
+    digest = delivery_index.record_digest(record)
+
+    assert len(digest) == 16
+    assert delivery_index.record_digest(record.model_copy()) == digest
+    assert delivery_index.record_digest(cloud_record_list[1]) != digest
+    record.cpu_count += 1
+    assert delivery_index.record_digest(record) != digest
+
+
+def test_record_digest_ignores_the_measure_time(storage_record, ip_record):
+    """Test that records measured again with the same usage have the same hash."""
+    digest = delivery_index.record_digest(storage_record)
+    measured_again = storage_record.model_copy(deep=True)
+    measured_again.measure_time += datetime.timedelta(hours=1)
+
+    assert measured_again.as_json() != storage_record.as_json()
+    assert delivery_index.record_digest(measured_again) == digest
+    measured_again.active_duration += 3600
+    assert delivery_index.record_digest(measured_again) != digest
+
+    # The usage of the IP records is the count at the time they were measured
+    digest = delivery_index.record_digest(ip_record)
+    measured_again = ip_record.model_copy(deep=True)
+    measured_again.measure_time += datetime.timedelta(hours=1)
+    assert delivery_index.record_digest(measured_again) != digest
+
+
+def test_add_and_seen(clock):
+    """Test that delivered hashes are found for their messenger only."""
+    index = delivery_index.DeliveryIndex(clock=clock)
+    index.add("ssm", [b"a", b"b"])
+
+    assert index.seen("ssm", [b"a", b"c"]) == {b"a"}
+    assert index.seen("logstash", [b"a"]) == set()
+    assert (index.skipped, index.delivered) == (1, 2)
+
+
+def test_seen_many_hashes(clock):
+    """Test that many hashes can be looked up at once."""
+    index = delivery_index.DeliveryIndex(clock=clock)
+    digests = [i.to_bytes(16, "big") for i in range(2500)]
+    index.add("ssm", digests[::2])
+
+    assert index.seen("ssm", digests) == set(digests[::2])
+
+
+def test_index_is_persisted(clock, index_path):
+    """Test that the hashes are kept in the database between runs."""
+    index = delivery_index.DeliveryIndex(index_path, clock=clock)
+    index.add("ssm", [b"a"])
+    index.close()
+
+    index = delivery_index.DeliveryIndex(index_path, clock=clock)
+    assert index.seen("ssm", [b"a"]) == {b"a"}
+
+
+def test_unseen_hashes_are_evicted(clock):
+    """Test that hashes not seen within the retention period are evicted."""
+    index = delivery_index.DeliveryIndex(retention=2, clock=clock)
+    index.add("ssm", [b"old", b"seen"])
+
+    clock.now += 86400
+    index.seen("ssm", [b"seen"])
+    clock.now += 86400 + 1
+
+    assert index.evict() == 1
+    assert index.seen("ssm", [b"old", b"seen"]) == {b"seen"}
+
+
+def test_invalidate(clock):
+    """Test that hashes can be forgotten per messenger or by delivery time."""
+    index = delivery_index.DeliveryIndex(clock=clock)
+    index.add("ssm", [b"a"])
+    index.add("logstash", [b"a"])
+
+    assert index.invalidate(messenger="logstash") == 1
+    assert index.invalidate(delivered_before=datetime.datetime(2023, 5, 25)) == 0
+    assert index.invalidate(delivered_before=datetime.datetime(2023, 5, 27)) == 1
+    assert index.seen("ssm", [b"a"]) == set()
+
+
+def test_skip_delivered(clock, cloud_record_list, ip_record):
+    """Test that delivered records are dropped, keeping lists and batches."""
+    index = delivery_index.DeliveryIndex(clock=clock)
+    records = cloud_record_list + [ip_record]
+    index.add("ssm", [delivery_index.record_digest(cloud_record_list[0])])
+
+    digests = {}
+    kept, pending = index.skip_delivered("ssm", records, digests)
+    assert kept == records[1:]
+    assert pending == [delivery_index.record_digest(r) for r in records[1:]]
+    assert len(digests) == 3
+
+    batch = caso.record_batch.RecordBatch(records)
+    kept, pending = index.skip_delivered("ssm", batch, digests)
+    assert isinstance(kept, caso.record_batch.RecordBatch)
+    assert list(kept) == records[1:]
+
+
+def test_invalidate_before_option(clock, index_path, spooldir):
+    """Test that the shared index forgets the records delivered before a date."""
+    index = delivery_index.DeliveryIndex(index_path, clock=clock)
+    index.add("ssm", [b"a"])
+    index.close()
+
+    CONF.set_override("invalidate_before", "2023-05-27", group="delivery_index")
+    try:
+        assert delivery_index.get_index().seen("ssm", [b"a"]) == set()
+    finally:
+        CONF.clear_override("invalidate_before", group="delivery_index")
+
+
+def test_disabled_index():
+    """Test that no index is used if it is disabled."""
+    CONF.set_override("enabled", False, group="delivery_index")
+    try:
+        assert delivery_index.get_index() is None
+    finally:
+        CONF.clear_override("enabled", group="delivery_index")
+
+
+def _messenger_manager(*names):
+    manager = caso.messenger.Manager.__new__(caso.messenger.Manager)
+    manager.mgr = []
+    for name in names:
+        ext = mock.Mock()
+        ext.name = name
+        manager.mgr.append(ext)
+    manager.messenger_record_types = {}
+    return manager
+
+
+def test_push_skips_delivered_records(spooldir, cloud_record_list, ip_record):
+    """Test that records are only pushed once to each messenger."""
+    records = cloud_record_list + [ip_record]
+    manager = _messenger_manager("ssm")
+    manager.push_to_all(records)
+    assert list(manager.mgr[0].obj.push.call_args[0][0]) == records
+
+    manager = _messenger_manager("ssm", "logstash")
+    manager.push_to_all(records[1:])
+    manager.mgr[0].obj.push.assert_not_called()
+    assert list(manager.mgr[1].obj.push.call_args[0][0]) == records[1:]
+
+
+def test_push_failure_is_not_recorded(spooldir, cloud_record_list):
+    """Test that records are pushed again if the messenger failed."""
+    manager = _messenger_manager("ssm")
+    manager.mgr[0].obj.push.side_effect = Exception("Boom")
+    manager.push_to_all(cloud_record_list)
+
+    manager = _messenger_manager("ssm")
+    manager.push_to_all(cloud_record_list)
+    assert list(manager.mgr[0].obj.push.call_args[0][0]) == cloud_record_list
+
+
+def test_push_replayed_records(spooldir, cloud_record_list):
+    """Test that replayed records are pushed even if they were delivered."""
+    manager = _messenger_manager("ssm")
+    manager.push_to_all(cloud_record_list)
+
+    manager = _messenger_manager("ssm")
+    manager.push_to_all(cloud_record_list, skip_delivered=False)
+    assert list(manager.mgr[0].obj.push.call_args[0][0]) == cloud_record_list
+
+    # They are still recorded as delivered
+    index = delivery_index.get_index()
+    digests = delivery_index.record_digests(cloud_record_list)
+    assert index.seen("ssm", digests) == set(digests)
+
+
+def test_push_logs_skipped_records(spooldir, cloud_record_list):
+    """Test that the number of records skipped for each messenger is logged."""
+    manager = _messenger_manager("ssm")
+    manager.push_to_all(cloud_record_list[:1])
+
+    manager = _messenger_manager("ssm")
+    with mock.patch("caso.messenger.LOG") as log:
+        manager.push_to_all(cloud_record_list)
+    log.info.assert_called_once_with(
+        "Skipping %d records already delivered to messenger %s", 1, "ssm"
+    )
+    assert list(manager.mgr[0].obj.push.call_args[0][0]) == cloud_record_list[1:]
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for `caso.discovery_cache` module."""
+
+from unittest import mock
+
+from keystoneauth1 import discover
+from keystoneauth1 import session as ks_session
+import pytest
+
+from caso import discovery_cache
+
+VERSION_DATA = [
+    {
+        "id": "v2.1",
+        "status": "CURRENT",
+        "version": "2.95",
+        "min_version": "2.1",
+        "links": [{"rel": "self", "href": "https://nova.example.org/v2.1/"}],
+    }
+]
+
+
+class FakeClock(object):
+    """A fake clock that can be moved forward."""
+
+    def __init__(self):
+        """Start the clock."""
+        self.now = 1000.0
+
+    def __call__(self):
+        """Get the current time."""
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    """Get a fake clock."""
+    return FakeClock()
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    """Get the path of a discovery cache file."""
+    return str(tmp_path / discovery_cache.CACHE_FILE)
+
+
+def _discover(session, url, cache):
+    with mock.patch.object(
+        discover, "get_version_data", return_value=VERSION_DATA
+    ) as m:
+        disc = discover.get_discovery(session, url, cache=cache)
+    return disc, m.call_count
+
+
+def test_discovery_is_shared_between_sessions(clock):
+    """Test that discovery is done once per endpoint for all the sessions."""
+    cache = discovery_cache.DiscoveryCache(ttl=60, clock=clock)
+    sess1 = ks_session.Session(discovery_cache=cache)
+    sess2 = ks_session.Session(discovery_cache=cache)
+
+    _, calls = _discover(sess1, "https://nova.example.org/", None)
+    assert calls == 1
+    disc, calls = _discover(sess2, "https://nova.example.org", None)
+    assert calls == 0
+    assert disc.raw_version_data() == VERSION_DATA
+    assert cache.hits == 1
+
+
+def test_entries_expire(clock):
+    """Test that discovery is done again once the entries expire."""
+    cache = discovery_cache.DiscoveryCache(ttl=60, clock=clock)
+    sess = ks_session.Session(discovery_cache=cache)
+    _discover(sess, "https://nova.example.org", None)
+
+    clock.now += 30
+    assert "https://nova.example.org" in cache
+    clock.now += 30
+    assert "https://nova.example.org" not in cache
+    _, calls = _discover(sess, "https://nova.example.org", None)
+    assert calls == 1
+
+
+def test_cache_is_persisted(clock, cache_path):
+    """Test that the cache is stored and loaded again in the next runs."""
+    cache = discovery_cache.DiscoveryCache(cache_path, ttl=60, clock=clock)
+    sess = ks_session.Session(discovery_cache=cache)
+    _discover(sess, "https://nova.example.org", None)
+    cache.save()
+
+    clock.now += 30
+    cache = discovery_cache.DiscoveryCache(cache_path, ttl=60, clock=clock)
+    cache.load()
+    sess = ks_session.Session(discovery_cache=cache)
+    disc, calls = _discover(sess, "https://nova.example.org", None)
+    assert calls == 0
+    assert disc.raw_version_data() == VERSION_DATA
+
+    # Entries keep their original timestamp, so they expire as expected
+    clock.now += 30
+    cache = discovery_cache.DiscoveryCache(cache_path, ttl=60, clock=clock)
+    cache.load()
+    assert len(cache) == 0
+
+
+def test_corrupt_cache_is_ignored(cache_path):
+    """Test that a corrupt cache file does not break the run."""
+    with open(cache_path, "w") as fd:
+        fd.write("not json")
+    cache = discovery_cache.DiscoveryCache(cache_path)
+    cache.load()
+    assert len(cache) == 0
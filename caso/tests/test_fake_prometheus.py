@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for the Prometheus stand-in of the extractor benchmark."""
+
+import json
+import urllib.parse
+import urllib.request
+
+import pytest
+
+from caso.tests import fake_prometheus
+
+VMS = ["vm-1", "vm-2"]
+
+
+@pytest.fixture
+def server():
+    """Run a Prometheus stand-in for 2 VMs with 2 series each."""
+    fake = fake_prometheus.FakePrometheus(VMS, series_per_vm=2, interval=30)
+    with fake_prometheus.FakePrometheusServer(fake) as server:
+        yield server
+
+
+def _get(server, path, **params):
+    url = f"{server.url}{path}?{urllib.parse.urlencode(params)}"
+    with urllib.request.urlopen(url) as response:  # nosec
+        return json.load(response)
+
+
+def test_range_query(server):
+    """Test that a range query returns a series per matching series."""
+    body = _get(
+        server,
+        "/api/v1/query_range",
+        query='prometheus_value{type_instance="scaph_process_power_microwatts",'
+        'uuid="vm-1"}',
+        start=0,
+        end=300,
+        step=30,
+    )
+    assert body["status"] == "success"
+    result = body["data"]["result"]
+    assert len(result) == 2
+    assert all(series["metric"]["uuid"] == "vm-1" for series in result)
+    assert all(len(series["values"]) == 11 for series in result)
+    assert server.prometheus.queries == 1
+    assert server.prometheus.bytes_sent > 0
+
+
+def test_aggregated_integration_query(server):
+    """Test that sum_over_time results are aggregated by VM."""
+    query = (
+        'sum by (uuid) (sum_over_time(prometheus_value{uuid=~"vm-1|vm-2"}[300s:30s]))'
+    )
+    body = _get(server, "/api/v1/query", query=query, time=300)
+    result = {s["metric"]["uuid"]: float(s["value"][1]) for s in body["data"]["result"]}
+
+    raw = _get(
+        server,
+        "/api/v1/query_range",
+        query='sum by (uuid) (prometheus_value{uuid="vm-2"})',
+        start=30,
+        end=300,
+        step=30,
+    )
+    values = raw["data"]["result"][0]["values"]
+    assert set(result) == set(VMS)
+    assert result["vm-2"] == sum(float(v) for _, v in values)
+
+
+def test_unsupported_query(server):
+    """Test that unsupported queries are rejected."""
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _get(server, "/api/v1/query", query="rate(foo[5m])", time=0)
+    assert e.value.code == 400
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for `caso.http_pool` module."""
+
+import http.server
+import threading
+from unittest import mock
+
+import pytest
+
+from caso import discovery_cache
+from caso import http_pool
+from caso import keystone_client
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # noqa(N802)
+        """Reply with a small body, keeping the connection open."""
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Do not log anything."""
+
+
+@pytest.fixture
+def http_server():
+    """Run a local HTTP/1.1 server in a thread."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def shared_session():
+    """Get a fresh shared session with empty statistics."""
+    http_pool.close_session()
+    http_pool.STATS.reset()
+    yield http_pool.get_session()
+    http_pool.close_session()
+    http_pool.STATS.reset()
+
+
+def test_session_is_shared(shared_session):
+    """Test that we always get the same session."""
+    assert http_pool.get_session() is shared_session
+    assert isinstance(
+        shared_session.get_adapter("https://example.org"),
+        http_pool.PooledHTTPAdapter,
+    )
+
+
+def test_connections_are_reused(shared_session, http_server):
+    """Test that several requests to an endpoint use a single connection."""
+    for _ in range(3):
+        resp = shared_session.get(f"http://{http_server}/")
+        assert resp.status_code == 200
+
+    stats = http_pool.get_stats()
+    assert stats == {
+        http_server: {"requests": 3, "connections": 1, "tls_handshakes": 0}
+    }
+
+
+def test_keystone_sessions_share_pool(shared_session):
+    """Test that all the keystone sessions use the shared requests session."""
+    with mock.patch("keystoneauth1.loading.load_auth_from_conf_options"):
+        with mock.patch("keystoneauth1.session.Session.get_token"):
+            sess1 = keystone_client.get_session(keystone_client.CONF, "foo")
+            sess2 = keystone_client.get_session(keystone_client.CONF, "bar")
+    discovery_cache.reset()
+
+    assert sess1 is not sess2
+    assert sess1.session is shared_session
+    assert sess2.session is shared_session
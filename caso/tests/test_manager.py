@@ -14,15 +14,21 @@
 
 """Tests for `caso.manager` module."""
 
+import os.path
+
+import fixtures
 from oslo_concurrency.fixture import lockutils as lock_fixture
 import six
-import unittest
 from unittest import mock
 
+import caso.record
 from caso import manager
+from caso import spool
+from caso.tests import base
+from caso.tests import conftest
 
 
-class TestCasoManager(unittest.TestCase):
+class TestCasoManager(base.TestCase):
     """Test case for the cASO Manager."""
 
     def setUp(self):
@@ -44,5 +50,37 @@ class TestCasoManager(unittest.TestCase):
         """Reset mocks and tear down."""
         for p in self.patchers.values():
             p.stop()
+        self.reset_flags()
 
         super(TestCasoManager, self).tearDown()
+
+    def test_run_checkpoint(self):
+        """Test that the extracted records are stored before pushing them."""
+        spooldir = self.useFixture(fixtures.TempDir()).path
+        self.flags(spooldir=spooldir, checkpoint=True, dry_run=False)
+        records = [caso.record.IPRecord(**conftest.valid_ip_records_fields[0])]
+        self.mocks["extract"].return_value.get_records.return_value = records
+        self.manager.lock_path = spooldir
+
+        self.manager.run()
+        self.mocks["messenger"].return_value.push_to_all.assert_called_once_with(
+            records, skip_delivered=True
+        )
+        path = os.path.join(spooldir, manager.CHECKPOINT_FILE)
+        self.assertEqual(records, spool.read(path))
+
+    def test_run_replay(self):
+        """Test that the stored records are pushed without extracting them."""
+        spooldir = self.useFixture(fixtures.TempDir()).path
+        path = os.path.join(spooldir, manager.CHECKPOINT_FILE)
+        records = [caso.record.IPRecord(**conftest.valid_ip_records_fields[0])]
+        spool.write(path, records)
+        self.flags(replay=path, dry_run=False)
+        self.manager.lock_path = spooldir
+
+        self.manager.run()
+        self.mocks["extract"].assert_not_called()
+        # The records are pushed even if they were already delivered
+        self.mocks["messenger"].return_value.push_to_all.assert_called_once_with(
+            records, skip_delivered=False
+        )
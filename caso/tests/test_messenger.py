@@ -16,8 +16,13 @@
 
 """Tests for messenger module."""
 
+from unittest import mock
+
 import caso.messenger
+import caso.messenger.logstash
+import caso.messenger.ssm
 import caso.record
+import caso.record_batch
 
 
 class TestFilterRecords:
@@ -112,6 +117,16 @@ class TestFilterRecords:
         assert len(result) == 1
         assert isinstance(result[0], caso.record.CloudRecord)
 
+    def test_filter_records_selects_from_batch(
+        self, cloud_record, ip_record, storage_record
+    ):
+        """Test that the records of a batch are selected by their type."""
+        batch = caso.record_batch.RecordBatch([cloud_record, ip_record, storage_record])
+        result = caso.messenger._filter_records(batch, ["cloud", "invalid_type"])
+        assert isinstance(result, caso.record_batch.RecordBatch)
+        assert list(result) == [cloud_record]
+        assert result.records("cloud") is batch.records("cloud")
+
 
 class TestGetMessengerOpts:
     """Test cases for the get_messenger_opts function."""
@@ -187,3 +202,76 @@ class TestValidRecordTypes:
             set(caso.messenger.RECORD_TYPE_MAP.keys())
             == caso.messenger.VALID_RECORD_TYPES
         )
+
+
+class TestLogstashMessenger:
+    """Test cases for the logstash messenger."""
+
+    def test_push_sends_json_lines(self, cloud_record, ip_record):
+        """Test that the records are sent as JSON lines."""
+        with mock.patch("socket.socket") as m_socket:
+            messenger = caso.messenger.logstash.LogstashMessenger()
+            messenger.push([cloud_record, ip_record])
+
+        sock = m_socket.return_value
+        sock.connect.assert_called_once_with((messenger.host, messenger.port))
+        sock.sendall.assert_has_calls(
+            [
+                mock.call(cloud_record.as_json().encode("utf-8") + b"\n"),
+                mock.call(ip_record.as_json().encode("utf-8") + b"\n"),
+            ]
+        )
+        sock.close.assert_called_once_with()
+
+
+class TestPushToAll:
+    """Test cases for pushing the records to all the messengers."""
+
+    class ListMessenger(caso.messenger.BaseMessenger):
+        """Messenger that keeps the records that are pushed to it."""
+
+        def push(self, records):
+            """Keep the records."""
+            self.pushed = records
+
+    class BatchMessenger(ListMessenger):
+        """Messenger that keeps the batches that are pushed to it."""
+
+        accepts_batches = True
+
+    def _push(self, records, *messengers):
+        manager = caso.messenger.Manager.__new__(caso.messenger.Manager)
+        manager.mgr = []
+        for i, messenger in enumerate(messengers):
+            ext = mock.Mock()
+            ext.name = f"messenger-{i}"
+            ext.obj = messenger
+            manager.mgr.append(ext)
+        manager.messenger_record_types = {"messenger-0": ["cloud", "ip"]}
+        with mock.patch("caso.messenger.delivery_index.get_index", return_value=None):
+            manager.push_to_all(records)
+
+    def test_push_lists_in_order(self, cloud_record, ip_record, storage_record):
+        """Test that messengers get lists, keeping the order of the records."""
+        records = [ip_record, storage_record, cloud_record]
+        filtered, everything = self.ListMessenger(), self.ListMessenger()
+        self._push(records, filtered, everything)
+
+        assert filtered.pushed == [ip_record, cloud_record]
+        assert everything.pushed == records
+
+    def test_push_batches(self, cloud_record, ip_record, storage_record):
+        """Test that messengers accepting batches get the records grouped."""
+        records = [ip_record, storage_record, cloud_record]
+        filtered, everything = self.BatchMessenger(), self.BatchMessenger()
+        self._push(records, filtered, everything)
+
+        assert isinstance(filtered.pushed, caso.record_batch.RecordBatch)
+        assert filtered.pushed.record_types == ["ip", "cloud"]
+        assert everything.pushed.records("storage") == [storage_record]
+        assert filtered.pushed.records("cloud") is everything.pushed.records("cloud")
+
+    def test_ssm_messenger_accepts_batches(self):
+        """Test that the SSM messenger gets batches, but not the others."""
+        assert caso.messenger.ssm.SSMMessenger.accepts_batches
+        assert not caso.messenger.logstash.LogstashMessenger.accepts_batches
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for `caso.ratelimit` module."""
+
+from unittest import mock
+
+import keystoneauth1.exceptions
+import keystoneauth1.session
+import pytest
+from oslo_config import cfg
+
+from caso import circuit_breaker
+from caso import keystone_client
+from caso import ratelimit
+
+CONF = cfg.CONF
+
+
+class FakeClock(object):
+    """A fake clock, where sleeping just advances the time."""
+
+    def __init__(self):
+        """Start the clock at zero."""
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        """Get the current time."""
+        return self.now
+
+    def sleep(self, seconds):
+        """Advance the clock."""
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    """Get a fake clock."""
+    return FakeClock()
+
+
+@pytest.fixture(autouse=True)
+def reset_limiters():
+    """Reset the limiters and the configuration after each test."""
+    yield
+    ratelimit.reset()
+    circuit_breaker.reset()
+    CONF.reset()
+
+
+def test_parse_retry_after():
+    """Test that we parse both forms of the Retry-After header."""
+    assert ratelimit.parse_retry_after("3") == 3.0
+    assert ratelimit.parse_retry_after(None) is None
+    assert ratelimit.parse_retry_after("foo") is None
+    now = 1445412480.0  # Wed, 21 Oct 2015 07:28:00 GMT
+    assert ratelimit.parse_retry_after("Wed, 21 Oct 2015 07:28:10 GMT", now=now) == 10.0
+
+
+def test_token_bucket_limits_rate(clock):
+    """Test that the bucket lets a burst through, then limits the rate."""
+    bucket = ratelimit.TokenBucket(2, 2, clock=clock, sleep=clock.sleep)
+    for _ in range(6):
+        bucket.acquire()
+    # 2 requests in the burst, then 4 at 2 requests per second
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_token_bucket_unlimited(clock):
+    """Test that an unlimited bucket never waits."""
+    bucket = ratelimit.TokenBucket(0, 1, clock=clock, sleep=clock.sleep)
+    for _ in range(100):
+        bucket.acquire()
+    assert clock.slept == []
+
+
+def test_limiter_backs_off_and_recovers(clock):
+    """Test that throttling reduces the rate, and successes recover it."""
+    limiter = ratelimit.ServiceLimiter(
+        "compute", 10, 1, 0, clock=clock, sleep=clock.sleep
+    )
+    delay = limiter.throttled("5")
+    assert delay == 5.0
+    assert limiter.rate == 5.0
+
+    # The service is paused until Retry-After expires
+    with limiter:
+        pass
+    assert clock.now >= 5.0
+
+    for _ in range(100):
+        limiter.succeeded()
+    assert limiter.rate == 10
+
+
+def test_limiter_backoff_without_retry_after(clock):
+    """Test that we use an exponential backoff without Retry-After."""
+    CONF.set_override("max_backoff", 3, group="rate_limit")
+    limiter = ratelimit.ServiceLimiter("compute", 0, 1, 0, clock=clock)
+    assert limiter.throttled(None, attempt=1) == 2.0
+    assert limiter.throttled(None, attempt=5) == 3.0
+
+
+def test_get_limiter_uses_service_overrides():
+    """Test that per-service configuration is honoured."""
+    CONF.set_override("requests_per_second", 20, group="rate_limit")
+    CONF.set_override(
+        "service_requests_per_second", {"compute": "5"}, group="rate_limit"
+    )
+    assert ratelimit.get_limiter("compute").rate == 5.0
+    assert ratelimit.get_limiter("identity").rate == 20.0
+    assert ratelimit.get_limiter("compute") is ratelimit.get_limiter("compute")
+
+
+def _response(status, headers=None):
+    resp = mock.Mock()
+    resp.status_code = status
+    resp.headers = headers or {}
+    return resp
+
+
+def test_session_retries_throttled_requests():
+    """Test that the session retries requests answered with HTTP 429."""
+    sess = keystone_client.Session()
+    responses = [_response(429, {"Retry-After": "0"}), _response(200)]
+    with mock.patch.object(
+        keystoneauth1.session.Session, "request", side_effect=responses
+    ) as m:
+        resp = sess.request(
+            "/servers", "GET", endpoint_filter={"service_type": "compute"}
+        )
+
+    assert resp.status_code == 200
+    assert m.call_count == 2
+    _, kwargs = m.call_args
+    assert kwargs["rate_semaphore"] is ratelimit.get_limiter("compute")
+    assert kwargs["raise_exc"] is False
+
+
+def test_session_gives_up_after_max_retries():
+    """Test that the session raises once retries are exhausted."""
+    CONF.set_override("max_retries", 1, group="rate_limit")
+    CONF.set_override("retries", 0, group="circuit_breaker")
+    sess = keystone_client.Session()
+    responses = [_response(503, {"Retry-After": "0"})] * 2
+    with mock.patch.object(
+        keystoneauth1.session.Session, "request", side_effect=responses
+    ) as m:
+        with mock.patch.object(
+            keystoneauth1.exceptions,
+            "from_response",
+            return_value=keystoneauth1.exceptions.ServiceUnavailable(),
+        ):
+            with pytest.raises(keystoneauth1.exceptions.ServiceUnavailable):
+                sess.request(
+                    "/servers", "GET", endpoint_filter={"service_type": "compute"}
+                )
+    assert m.call_count == 2
@@ -18,6 +18,13 @@
 
 import datetime
 import json
+import math
+import uuid
+
+import pytest
+
+import caso.record
+import caso.summary
 
 
 def test_cloud_record(cloud_record):
@@ -95,6 +102,25 @@ def test_cloud_record_zero_cpu(zero_cpu_cloud_record):
     assert "WallDuration: 1" in ssm_message
 
 
+def test_cloud_record_ssm_message(cloud_record, valid_cloud_record):
+    """Test a cloud record is rendered as sorted key: value lines."""
+    expected = [f"{k}: {v}" for k, v in valid_cloud_record.items()]
+
+    assert cloud_record.ssm_message() == "\n".join(sorted(expected))
+
+
+def test_cloud_record_ssm_message_optional_fields(cloud_record):
+    """Test that None values are not rendered, and floats are kept as floats."""
+    cloud_record.user_dn = None
+    cloud_record.benchmark_type = "HEPscore23"
+    cloud_record.benchmark_value = 10.0
+    ssm_message = cloud_record.ssm_message()
+
+    assert "GlobalUserName" not in ssm_message
+    assert "BenchmarkType: HEPscore23" in ssm_message.splitlines()
+    assert "Benchmark: 10.0" in ssm_message.splitlines()
+
+
 def test_ip_record(ip_record):
     """Test that an IP record is correctly generated."""
     assert isinstance(ip_record.measure_time, datetime.datetime)
@@ -158,3 +184,187 @@ def test_energy_record_map_opts(energy_record, valid_energy_record):
         "exclude_none": True,
     }
     assert json.loads(energy_record.model_dump_json(**opts)) == valid_energy_record
+
+
+def test_ssm_usage_record(ip_record, accelerator_record, energy_record):
+    """Test that the usage records are the same as the JSON SSM messages."""
+    for record in (ip_record, accelerator_record, energy_record):
+        assert record.ssm_usage_record() == json.loads(record.ssm_message())
+
+
+def test_ssm_usage_record_non_finite(energy_record):
+    """Test that non finite floats are rendered as nulls in usage records."""
+    energy_record.energy_wh = math.nan
+    usage_record = energy_record.ssm_usage_record()
+    assert usage_record["EnergyWh"] is None
+    assert usage_record == json.loads(energy_record.ssm_message())
+
+
+def test_serialization_plan(cloud_record):
+    """Test the serialization plan of a record class."""
+    plan = caso.record.serialization_plan(caso.record.CloudRecord)
+    assert caso.record.serialization_plan(caso.record.CloudRecord) is plan
+    assert plan.aliases["start_time_epoch"] == "StartTime"
+    assert plan.aliases["uuid"] == "VMUUID"
+    assert "version" not in plan.aliases
+    with pytest.raises(TypeError):
+        plan.aliases["uuid"] = "UUID"  # type: ignore[index]
+    assert [key for _, key in plan.fields + plan.computed_fields] == list(
+        cloud_record.model_dump(by_alias=True)
+    )
+    keys = [prefix for _, prefix, _, _ in plan.ssm_fields]
+    assert keys == sorted(keys)
+
+
+@pytest.mark.parametrize("end_time", [None, datetime.datetime(2024, 1, 1)])
+@pytest.mark.parametrize("wall_duration", [None, 0, 10])
+@pytest.mark.parametrize("cpu_duration", [None, 0, 20])
+def test_cloud_record_computed_values(
+    cloud_record, end_time, wall_duration, cpu_duration
+):
+    """Test that the computed values are the same as the properties."""
+    cloud_record.start_time = datetime.datetime(2023, 12, 1)
+    cloud_record.end_time = end_time
+    cloud_record._wall_duration = wall_duration
+    cloud_record._cpu_duration = cpu_duration
+    assert cloud_record._computed_values() == tuple(
+        getattr(cloud_record, name) for name in cloud_record.model_computed_fields
+    )
+
+
+@pytest.mark.parametrize(
+    "record_fixture",
+    [
+        "cloud_record",
+        "ip_record",
+        "accelerator_record",
+        "storage_record",
+        "energy_record",
+    ],
+)
+def test_as_json(record_fixture, request):
+    """Test that records are serialized as with model_dump_json."""
+    record = request.getfixturevalue(record_fixture)
+    expected = record.model_dump_json(by_alias=True, exclude_none=True)
+    assert record.as_json() == expected
+    assert record.as_dict() == json.loads(expected)
+
+
+def test_as_json_cloud_summary(cloud_record):
+    """Test that summary records are serialized as with model_dump_json."""
+    (summary,) = caso.summary.summarize([cloud_record])
+    assert summary.as_json() == summary.model_dump_json(
+        by_alias=True, exclude_none=True
+    )
+
+
+def test_as_json_non_finite(energy_record):
+    """Test that nested non finite floats are serialized as nulls."""
+    energy_record.energy_wh = math.inf
+    energy_record.energy_wh_by_metric = {"power": math.nan}
+    assert energy_record.as_json() == energy_record.model_dump_json(
+        by_alias=True, exclude_none=True
+    )
+    assert energy_record.as_dict()["EnergyWhByMetric"] == {"power": None}
+
+
+def test_compact_cloud_record(compact_cloud_record, valid_cloud_record):
+    """Test that a compact cloud record gives the same full record."""
+    record = compact_cloud_record.to_record()
+    assert isinstance(record, caso.record.CloudRecord)
+    opts = {
+        "by_alias": True,
+        "exclude_none": True,
+    }
+    assert json.loads(record.model_dump_json(**opts)) == valid_cloud_record
+
+
+def test_compact_cloud_record_durations(compact_cloud_record):
+    """Test that the durations of a compact cloud record are kept."""
+    compact_cloud_record.wall_duration = 60
+    compact_cloud_record.cpu_duration = 0
+    record = compact_cloud_record.to_record()
+    assert record.wall_duration == 60
+    assert record.cpu_duration == 0
+
+
+def test_compact_accelerator_record(
+    compact_accelerator_record, valid_accelerator_record
+):
+    """Test that a compact accelerator record gives the same full record."""
+    record = compact_accelerator_record.to_record()
+    assert isinstance(record, caso.record.AcceleratorRecord)
+    assert record.ssm_usage_record() == valid_accelerator_record
+
+
+def test_compact_storage_record(compact_storage_record, storage_record):
+    """Test that a compact storage record gives the same full record."""
+    record = compact_storage_record.to_record()
+    assert isinstance(record, caso.record.StorageRecord)
+    assert record.ssm_message() == storage_record.ssm_message()
+
+
+def test_compact_record_fields(compact_cloud_record):
+    """Test that compact records check the names of their fields."""
+    fields = {
+        n: getattr(compact_cloud_record, n) for n in compact_cloud_record.__slots__
+    }
+    with pytest.raises(TypeError):
+        caso.record.CompactCloudRecord(foo="bar", **fields)
+    del fields["uuid"]
+    with pytest.raises(TypeError):
+        caso.record.CompactCloudRecord(**fields)
+    with pytest.raises(AttributeError):
+        compact_cloud_record.foo = "bar"
+
+
+def test_validate_records(compact_cloud_record, compact_storage_record, ip_record):
+    """Test that compact records are validated, dropping the invalid ones."""
+    invalid_record = caso.record.CompactStorageRecord(
+        **{
+            n: getattr(compact_storage_record, n)
+            for n in compact_storage_record.__slots__
+        }
+    )
+    invalid_record.capacity = "not a capacity"
+    records = [compact_cloud_record, invalid_record, ip_record, compact_storage_record]
+    assert caso.record.validate_records(records) is records
+    assert [type(r) for r in records] == [
+        caso.record.CloudRecord,
+        caso.record.IPRecord,
+        caso.record.StorageRecord,
+    ]
+    assert records[1] is ip_record
+
+
+@pytest.mark.parametrize(
+    "compact_fixture",
+    ["compact_cloud_record", "compact_accelerator_record", "compact_storage_record"],
+)
+def test_compact_record_trusted(compact_fixture, request):
+    """Test that trusted compact records give the same records as validated."""
+    compact_record = request.getfixturevalue(compact_fixture)
+    record = compact_record.to_record()
+    trusted_record = compact_record.to_record(trusted=True)
+    assert type(trusted_record) is type(record)
+    assert trusted_record == record
+    assert trusted_record.model_fields_set == record.model_fields_set
+    assert trusted_record.model_dump_json() == record.model_dump_json()
+    assert trusted_record.ssm_message() == record.ssm_message()
+
+
+def test_compact_record_trusted_conversions(compact_cloud_record):
+    """Test that trusted compact records convert the UUIDs and statuses."""
+    compact_cloud_record.status = "completed"
+    record = compact_cloud_record.to_record(trusted=True)
+    assert isinstance(record.uuid, uuid.UUID)
+    assert record.status == "completed"
+    assert record.status is caso.record._ValidCloudStatus.completed
+
+
+def test_validate_records_trusted(compact_cloud_record, ip_record):
+    """Test that compact records are converted trusting their values."""
+    records = [compact_cloud_record, ip_record]
+    expected = compact_cloud_record.to_record()
+    assert caso.record.validate_records(records, trusted=True) is records
+    assert records == [expected, ip_record]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for the record batches."""
+
+import pytest
+
+from caso import record_batch
+
+COLUMNS = list(record_batch.COLUMNS["cloud"])
+
+
+def test_batch_groups_records(cloud_record_list, ip_record, storage_record):
+    """Test that the records are grouped by their type, keeping their order."""
+    records = [cloud_record_list[0], ip_record, cloud_record_list[1], storage_record]
+    batch = record_batch.RecordBatch(records)
+
+    assert len(batch) == 4
+    assert batch.record_types == ["cloud", "ip", "storage"]
+    assert batch.records("cloud") == cloud_record_list
+    assert batch.records("ip") == [ip_record]
+    assert batch.records("accelerator") == []
+    assert list(batch) == cloud_record_list + [ip_record, storage_record]
+
+
+def test_batch_unknown_records(cloud_record):
+    """Test that records of unknown types are kept under the None type."""
+    batch = record_batch.RecordBatch([cloud_record, "foo"])
+
+    assert batch.record_types == ["cloud", None]
+    assert batch.records(None) == ["foo"]
+
+
+def test_batch_select(cloud_record_list, ip_record, storage_record):
+    """Test that selected batches share the records and the columns."""
+    batch = record_batch.RecordBatch(cloud_record_list + [ip_record, storage_record])
+    selected = batch.select(["cloud", "storage", "energy"])
+
+    assert selected.record_types == ["cloud", "storage"]
+    assert selected.records("cloud") is batch.records("cloud")
+    assert selected.column("cloud", "cpu_count") is batch.column("cloud", "cpu_count")
+    assert len(batch) == 4
+    assert len(record_batch.RecordBatch(selected)) == 3
+
+
+def test_batch_columns(cloud_record_list):
+    """Test the columns of the records."""
+    cloud_record_list[1].end_time = None
+    batch = record_batch.RecordBatch(cloud_record_list)
+
+    column = batch.column("cloud", "start_time_epoch")
+    assert column.typecode == "q"
+    assert list(column) == [r.start_time_epoch for r in cloud_record_list]
+    # Values that are not set are stored as zeros
+    assert list(batch.column("cloud", "wall_duration")) == [432000, 0]
+    with pytest.raises(KeyError):
+        batch.column("cloud", "name")
+
+
+def test_batch_aggregates(cloud_record_list, energy_record):
+    """Test the aggregates of the columns."""
+    cloud_record_list[1].cpu_count = 2
+    batch = record_batch.RecordBatch(cloud_record_list + [energy_record])
+
+    assert batch.sum("cloud", "cpu_count") == 10
+    assert batch.min("cloud", "cpu_count") == 2
+    assert batch.max("cloud", "cpu_count") == 8
+    assert batch.sum("energy", "energy_wh") == energy_record.energy_wh
+    assert batch.sum("storage", "capacity") == 0
+    assert batch.min("storage", "capacity") is None
+    assert batch.max("storage", "capacity") is None
+
+
+@pytest.mark.parametrize("aggregate", ["sum", "min", "max"])
+def test_batch_numpy_matches_python(monkeypatch, cloud_record_list, aggregate):
+    """Test that the aggregates with NumPy match the pure Python ones."""
+    pytest.importorskip("numpy")
+    cloud_record_list[1].cpu_count = 2
+    batch = record_batch.RecordBatch(cloud_record_list)
+    results = {}
+    for name in COLUMNS:
+        results[name] = getattr(batch, aggregate)("cloud", name)
+
+    monkeypatch.setattr(record_batch, "numpy", None)
+    for name in COLUMNS:
+        result = getattr(batch, aggregate)("cloud", name)
+        assert result == results[name]
+        assert type(result) is type(results[name])
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for `caso.response_cache` module."""
+
+from unittest import mock
+
+import keystoneauth1.session
+import pytest
+import requests
+from oslo_config import cfg
+
+from caso import circuit_breaker
+from caso import keystone_client
+from caso import ratelimit
+from caso import response_cache
+
+CONF = cfg.CONF
+
+FLAVORS = b'{"flavors": [{"id": "1", "name": "m1.small"}]}'
+
+
+class FakeClock(object):
+    """A fake clock that can be moved forward."""
+
+    def __init__(self):
+        """Start the clock."""
+        self.now = 1000.0
+
+    def __call__(self):
+        """Get the current time."""
+        return self.now
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """Get a response cache shared by all the sessions, with a fake clock."""
+    clock = FakeClock()
+    cache = response_cache.ResponseCache(
+        str(tmp_path / response_cache.CACHE_FILE), max_age=60, clock=clock
+    )
+    with mock.patch.object(response_cache, "get_cache", return_value=cache):
+        yield cache
+    response_cache.reset()
+    ratelimit.reset()
+    circuit_breaker.reset()
+    CONF.reset()
+
+
+def _response(status, content=b"", headers=None):
+    resp = requests.Response()
+    resp.status_code = status
+    resp.url = "https://nova.example.org/v2.1/flavors/detail"
+    resp._content = content
+    resp.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    return resp
+
+
+def _get_flavors(sess, responses):
+    with mock.patch.object(
+        keystoneauth1.session.Session, "request", side_effect=responses
+    ) as m:
+        resp = sess.request(
+            "/flavors/detail", "GET", endpoint_filter={"service_type": "compute"}
+        )
+    return resp, m
+
+
+def test_is_cacheable():
+    """Test that only GET requests to catalogues are cached."""
+    assert response_cache.is_cacheable("/flavors/detail?is_public=None", "GET")
+    assert response_cache.is_cacheable("/flavors/42/os-extra_specs", "GET")
+    assert response_cache.is_cacheable("/v2/images?limit=20", "GET")
+    assert response_cache.is_cacheable("/projects?tags=caso", "GET")
+    assert not response_cache.is_cacheable("/projects/foo", "GET")
+    assert not response_cache.is_cacheable("/servers/detail", "GET")
+    assert not response_cache.is_cacheable("/flavors/detail", "POST")
+
+
+def test_fresh_responses_are_served_locally(cache):
+    """Test that a fresh response does not hit the service."""
+    sess = keystone_client.Session()
+    resp, m = _get_flavors(sess, [_response(200, FLAVORS)])
+    assert m.call_count == 1
+
+    resp, m = _get_flavors(sess, [])
+    assert m.call_count == 0
+    assert resp.json() == {"flavors": [{"id": "1", "name": "m1.small"}]}
+    assert cache.stats == {"hits": 1, "not_modified": 0, "unchanged": 0, "misses": 1}
+
+
+def test_revalidation_with_etag(cache):
+    """Test that old responses are revalidated with a conditional request."""
+    sess = keystone_client.Session()
+    _get_flavors(sess, [_response(200, FLAVORS, {"ETag": '"abc"'})])
+
+    cache._clock.now += 120
+    resp, m = _get_flavors(sess, [_response(304)])
+    assert m.call_args.kwargs["headers"] == {"If-None-Match": '"abc"'}
+    assert resp.status_code == 200
+    assert resp.content == FLAVORS
+    assert cache.stats["not_modified"] == 1
+    assert cache.hit_rate() == 0.5
+
+
+def test_revalidation_with_content_hash(cache):
+    """Test that we detect unchanged content without validators."""
+    sess = keystone_client.Session()
+    _get_flavors(sess, [_response(200, FLAVORS)])
+
+    cache._clock.now += 120
+    _, m = _get_flavors(sess, [_response(200, FLAVORS)])
+    assert m.call_args.kwargs["headers"] == {
+        "If-Modified-Since": "Thu, 01 Jan 1970 00:16:40 GMT"
+    }
+    assert cache.stats["unchanged"] == 1
+
+    cache._clock.now += 120
+    resp, _ = _get_flavors(sess, [_response(200, b'{"flavors": []}')])
+    assert resp.json() == {"flavors": []}
+    assert cache.stats["misses"] == 2
+
+
+def test_revalidation_with_download_date(cache):
+    """Test that responses without validators are revalidated with their date."""
+    sess = keystone_client.Session()
+    date = "Wed, 21 Oct 2015 07:28:00 GMT"
+    _get_flavors(sess, [_response(200, FLAVORS, {"Date": date})])
+
+    cache._clock.now += 120
+    resp, m = _get_flavors(sess, [_response(304)])
+    assert m.call_args.kwargs["headers"] == {"If-Modified-Since": date}
+    assert resp.content == FLAVORS
+    assert cache.stats["not_modified"] == 1
+
+
+def test_cached_responses_have_a_request(cache):
+    """Test that the responses served from the cache have their request."""
+    sess = keystone_client.Session()
+    _get_flavors(sess, [_response(200, FLAVORS, {"ETag": '"abc"'})])
+
+    resp, _ = _get_flavors(sess, [])
+    assert resp.request.method == "GET"
+    assert resp.request.url == "https://nova.example.org/v2.1/flavors/detail"
+
+    cache._clock.now += 120
+    not_modified = _response(304)
+    not_modified.request = requests.Request("GET", not_modified.url).prepare()
+    resp, _ = _get_flavors(sess, [not_modified])
+    assert resp.request is not_modified.request
+
+
+def test_cache_is_persisted(cache):
+    """Test that the cache is stored and loaded again in the next runs."""
+    sess = keystone_client.Session()
+    _get_flavors(sess, [_response(200, FLAVORS, {"ETag": '"abc"'})])
+    cache.save()
+
+    new = response_cache.ResponseCache(cache.path, max_age=60, clock=cache._clock)
+    new.load()
+    with mock.patch.object(response_cache, "get_cache", return_value=new):
+        resp, m = _get_flavors(sess, [])
+    assert m.call_count == 0
+    assert resp.content == FLAVORS
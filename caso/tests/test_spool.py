@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for the binary spool of records."""
+
+import datetime
+import marshal
+
+import pytest
+
+import caso.exception
+import caso.record
+import caso.record_batch
+from caso import spool
+
+
+@pytest.fixture
+def spool_path(tmp_path):
+    """Get the path of a spool file."""
+    return str(tmp_path / "records.spool")
+
+
+@pytest.fixture
+def all_records(
+    cloud_record_list,
+    ip_record_list,
+    accelerator_record_list,
+    storage_record_list,
+    energy_record,
+):
+    """Get records of all the types."""
+    return (
+        cloud_record_list
+        + ip_record_list
+        + accelerator_record_list
+        + storage_record_list
+        + [energy_record]
+    )
+
+
+def test_write_and_read(spool_path, all_records):
+    """Test that records of all the types are read as they were written."""
+    assert spool.write(spool_path, all_records) == len(all_records)
+    records = spool.read(spool_path)
+
+    assert records == all_records
+    for record, expected in zip(records, all_records):
+        assert type(record) is type(expected)
+        assert record.model_dump_json() == expected.model_dump_json()
+        assert record.ssm_message() == expected.ssm_message()
+
+
+def test_dates_and_durations(spool_path, cloud_record_list):
+    """Test that dates keep their time zone, and durations are kept."""
+    offset = datetime.timezone(datetime.timedelta(hours=2))
+    cloud_record_list[0].start_time = cloud_record_list[0].start_time.astimezone(offset)
+    cloud_record_list[1].end_time = None
+    cloud_record_list[1].start_time = datetime.datetime(2023, 5, 1, 10, 0, 0, 5)
+    cloud_record_list[1].wall_duration = 60
+    spool.write(spool_path, cloud_record_list)
+    first, second = spool.read(spool_path)
+
+    assert first.start_time == cloud_record_list[0].start_time
+    assert first.start_time.utcoffset() == datetime.timedelta(hours=2)
+    assert first.end_time.tzinfo is datetime.timezone.utc
+    assert second.start_time == datetime.datetime(2023, 5, 1, 10, 0, 0, 5)
+    assert second.end_time is None
+    assert second.wall_duration == 60
+    assert second.cpu_duration == 60 * second.cpu_count
+
+
+def test_write_batches(spool_path, cloud_record_list, ip_record):
+    """Test that several batches, as lists or record batches, can be written."""
+    with spool.SpoolWriter(spool_path) as writer:
+        writer.write(caso.record_batch.RecordBatch(cloud_record_list))
+        writer.write([ip_record])
+    assert writer.count == 3
+
+    with spool.SpoolReader(spool_path) as reader:
+        assert list(reader) == cloud_record_list + [ip_record]
+
+
+def test_write_unknown_record(spool_path, cloud_record, tmp_path):
+    """Test that unknown records are not written, keeping the previous spool."""
+    spool.write(spool_path, [cloud_record])
+    with pytest.raises(ValueError):
+        spool.write(spool_path, [cloud_record, "foo"])
+
+    assert spool.read(spool_path) == [cloud_record]
+    assert [p.name for p in tmp_path.iterdir()] == ["records.spool"]
+
+
+def test_read_other_fields(spool_path, ip_record):
+    """Test that spools written with other fields are mapped by their names."""
+    layout = spool._layout(caso.record.IPRecord)
+    names = tuple(n for n in layout.names if n != "user_dn") + ("foo",)
+    values = dict(zip(layout.names, marshal.loads(spool._dump(ip_record, layout))))
+    values["foo"] = "bar"
+    header = marshal.dumps((("ip", names),))
+    data = marshal.dumps(tuple(values[n] for n in names))
+    with open(spool_path, "wb") as f:
+        f.write(spool.MAGIC + spool._LENGTH.pack(len(header)) + header)
+        f.write(spool._FRAME.pack(0, len(data)) + data)
+
+    (record,) = spool.read(spool_path)
+    assert record.user_dn is None
+    assert record.uuid == ip_record.uuid
+    assert record.measure_time == ip_record.measure_time
+    assert "user_dn" not in record.model_fields_set
+
+
+@pytest.mark.parametrize(
+    "content", [b"", b"NOTASPOOL", spool.MAGIC + b"\x05\x00\x00\x00abc"]
+)
+def test_read_invalid_spool(spool_path, content):
+    """Test that files that are not spools cannot be read."""
+    with open(spool_path, "wb") as f:
+        f.write(content)
+    with pytest.raises(caso.exception.InvalidSpoolError):
+        spool.read(spool_path)
+
+
+def test_read_truncated_spool(spool_path, cloud_record_list):
+    """Test that truncated spools cannot be read."""
+    spool.write(spool_path, cloud_record_list)
+    with open(spool_path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 10)
+    with pytest.raises(caso.exception.InvalidSpoolError):
+        spool.read(spool_path)
@@ -16,12 +16,26 @@
 
 """Test for SSM messenger."""
 
+import json
+
 import pytest
 
 import caso.exception
+import caso.record_batch
 from caso.messenger import ssm
 
 
+@pytest.fixture
+def summaries_spooldir(tmp_path):
+    """Keep the usage of the cloud summaries in a temporary spool directory."""
+    ssm.CONF.set_override("spooldir", str(tmp_path))
+    # The fixtures are from 2023, keep their months
+    ssm.CONF.set_override("summary_months", 1200, group="ssm")
+    yield tmp_path
+    ssm.CONF.clear_override("spooldir")
+    ssm.CONF.clear_override("summary_months", group="ssm")
+
+
 def test_empty_records_does_nothing(monkeypatch):
     """Test that empty records do nothing."""
     with monkeypatch.context() as m:
@@ -62,7 +76,7 @@ def test_ip_records_pushed(monkeypatch, ip_record_list, expected_entries_ip):
     """Test that IP records are correctly rendered."""
 
     def mock_push(entries_cloud, entries_ip, entries_accelerator, entries_storage):
-        assert set(entries_ip) == set(expected_entries_ip)
+        assert entries_ip == [json.loads(e) for e in expected_entries_ip]
 
     with monkeypatch.context() as m:
         m.setattr("caso.utils.makedirs", lambda x: None)
@@ -79,7 +93,9 @@ def test_accelerator_records_pushed(
     """Test that Accelerator records are correctly rendered."""
 
     def mock_push(entries_cloud, entries_ip, entries_accelerator, entries_storage):
-        assert set(entries_accelerator) == set(expected_entries_accelerator)
+        assert entries_accelerator == [
+            json.loads(e) for e in expected_entries_accelerator
+        ]
 
     with monkeypatch.context() as m:
         m.setattr("caso.utils.makedirs", lambda x: None)
@@ -96,7 +112,8 @@ def test_storage_records_pushed(
     """Test that Storage records are correctly rendered."""
 
     def mock_push(entries_cloud, entries_ip, entries_accelerator, entries_storage):
-        assert set([s.decode() for s in entries_storage]) == set(
+        assert entries_storage == storage_record_list
+        assert set([s.ssm_message().decode() for s in entries_storage]) == set(
             expected_entries_storage
         )
 
@@ -109,6 +126,26 @@ def test_storage_records_pushed(
         messenger.push(storage_record_list)
 
 
+def test_record_batch_pushed(
+    monkeypatch, cloud_record_list, expected_entries_cloud, storage_record_list
+):
+    """Test that the records of a batch are rendered."""
+    batch = caso.record_batch.RecordBatch(cloud_record_list + storage_record_list)
+
+    def mock_push(entries_cloud, entries_ip, entries_accelerator, entries_storage):
+        assert set(entries_cloud) == set(expected_entries_cloud)
+        assert entries_ip == entries_accelerator == []
+        assert entries_storage is batch.records("storage")
+
+    with monkeypatch.context() as m:
+        m.setattr("caso.utils.makedirs", lambda x: None)
+        m.setattr("dirq.QueueSimple.QueueSimple", lambda x: None)
+        messenger = ssm.SSMMessenger()
+
+        m.setattr(messenger, "_push", mock_push)
+        messenger.push(batch)
+
+
 def test_cloud_ip_records_pushed(
     monkeypatch,
     cloud_record_list,
@@ -120,7 +157,7 @@ def test_cloud_ip_records_pushed(
 
     def mock_push(entries_cloud, entries_ip, entries_accelerator, entries_storage):
         assert set(entries_cloud) == set(expected_entries_cloud)
-        assert set(entries_ip) == set(expected_entries_ip)
+        assert entries_ip == [json.loads(e) for e in expected_entries_ip]
 
     with monkeypatch.context() as m:
         m.setattr("caso.utils.makedirs", lambda x: None)
@@ -155,8 +192,8 @@ def test_complete_cloud_message(
         messenger._push_message_cloud(expected_entries_cloud)
 
 
-def test_complete_ip_message(monkeypatch, expected_entries_ip, expected_message_ip):
-    """Test a complete cloud message."""
+def test_complete_ip_message(monkeypatch, ip_record_list, expected_message_ip):
+    """Test a complete IP message, built from the records."""
 
     def mock_add(message):
         assert message == expected_message_ip
@@ -167,13 +204,13 @@ def test_complete_ip_message(monkeypatch, expected_entries_ip, expected_message_
         messenger = ssm.SSMMessenger()
 
         m.setattr(messenger.queue, "add", mock_add)
-        messenger._push_message_ip(expected_entries_ip)
+        messenger._push_message_ip([r.ssm_usage_record() for r in ip_record_list])
 
 
 def test_complete_accelerator_message(
-    monkeypatch, expected_entries_accelerator, expected_message_accelerator
+    monkeypatch, accelerator_record_list, expected_message_accelerator
 ):
-    """Test a complete cloud message."""
+    """Test a complete accelerator message, built from the records."""
 
     def mock_add(message):
         print(message)
@@ -186,21 +223,122 @@ def test_complete_accelerator_message(
         messenger = ssm.SSMMessenger()
 
         m.setattr(messenger.queue, "add", mock_add)
-        messenger._push_message_accelerator(expected_entries_accelerator)
+        messenger._push_message_accelerator(
+            [r.ssm_usage_record() for r in accelerator_record_list]
+        )
 
 
 def test_complete_storage_message(
-    monkeypatch, expected_entries_storage, expected_message_storage
+    monkeypatch, storage_record_list, expected_message_storage
 ):
-    """Test a complete cloud message."""
+    """Test a complete storage message, built from the records."""
+    messages = []
 
-    def mock_add(message):
-        assert message.decode() == expected_message_storage
+    with monkeypatch.context() as m:
+        m.setattr("caso.utils.makedirs", lambda x: None)
+        m.setattr("dirq.QueueSimple.QueueSimple", lambda x: _MockQueue())
+        messenger = ssm.SSMMessenger()
+
+        m.setattr(messenger.queue, "add", messages.append)
+        # The records must not be parsed again
+        m.setattr("xml.etree.ElementTree.fromstring", None)
+        messenger._push_message_storage(storage_record_list)
+
+    assert [message.decode() for message in messages] == [expected_message_storage]
+
+
+def test_storage_records_pushed_in_chunks(monkeypatch, storage_record_list):
+    """Test that storage records are pushed in messages of max_size records."""
+    messages = []
 
     with monkeypatch.context() as m:
         m.setattr("caso.utils.makedirs", lambda x: None)
         m.setattr("dirq.QueueSimple.QueueSimple", lambda x: _MockQueue())
         messenger = ssm.SSMMessenger()
 
-        m.setattr(messenger.queue, "add", mock_add)
-        messenger._push_message_storage(expected_entries_storage)
+        m.setattr(messenger.queue, "add", messages.append)
+        ssm.CONF.set_override("max_size", 1, group="ssm")
+        try:
+            messenger.push(storage_record_list * 2)
+        finally:
+            ssm.CONF.clear_override("max_size", group="ssm")
+
+    assert len(messages) == 4
+    for message, record in zip(messages, storage_record_list * 2):
+        assert message.count(b"<sr:StorageUsageRecord>") == 1
+        assert str(record.uuid).encode() in message
+
+
+@pytest.mark.parametrize(
+    "cloud_messages,records,summaries", [("summaries", 0, 1), ("both", 1, 1)]
+)
+def test_cloud_summaries_pushed(
+    monkeypatch,
+    summaries_spooldir,
+    cloud_record_list,
+    cloud_messages,
+    records,
+    summaries,
+):
+    """Test that cloud records are pushed as summaries if configured."""
+    messages = []
+
+    with monkeypatch.context() as m:
+        m.setattr("caso.utils.makedirs", lambda x: None)
+        m.setattr("dirq.QueueSimple.QueueSimple", lambda x: _MockQueue())
+        messenger = ssm.SSMMessenger()
+
+        m.setattr(messenger.queue, "add", messages.append)
+        ssm.CONF.set_override("cloud_messages", cloud_messages, group="ssm")
+        try:
+            messenger.push(cloud_record_list)
+        finally:
+            ssm.CONF.clear_override("cloud_messages", group="ssm")
+
+    messages = [message.decode() for message in messages]
+    summary_messages = [
+        message
+        for message in messages
+        if message.startswith("APEL-cloud-summary-message: v0.4\n")
+    ]
+    assert len(summary_messages) == summaries
+    assert len(messages) - len(summary_messages) == records
+    assert summary_messages[0].count("NumberOfVMs: 1") == 2
+
+
+def test_cloud_summaries_hold_the_whole_month(
+    monkeypatch, summaries_spooldir, cloud_record_list
+):
+    """Test that the summaries of overlapping pushes hold the whole month."""
+    first, second = cloud_record_list
+    second.fqan = first.fqan
+    second.status = first.status
+    messages = []
+
+    with monkeypatch.context() as m:
+        m.setattr("caso.utils.makedirs", lambda x: None)
+        m.setattr("dirq.QueueSimple.QueueSimple", lambda x: _MockQueue())
+        messenger = ssm.SSMMessenger()
+
+        m.setattr(messenger.queue, "add", messages.append)
+        ssm.CONF.set_override("cloud_messages", "summaries", group="ssm")
+        try:
+            messenger.push([first, second])
+            # The first VM is extracted again with more usage, but not the
+            # second one (e.g. it was already delivered)
+            first = first.model_copy(deep=True)
+            first.wall_duration += 3600
+            first.cpu_duration += 3600
+            messenger.push([first])
+        finally:
+            ssm.CONF.clear_override("cloud_messages", group="ssm")
+
+    messages = [message.decode() for message in messages]
+    assert len(messages) == 2
+    assert "NumberOfVMs: 2" in messages[0].split("\n")
+    summary = messages[1].split("\n")
+    assert "NumberOfVMs: 2" in summary
+    wall = first.wall_duration + second.wall_duration
+    assert f"WallDuration: {wall}" in summary
+    cpu = first.cpu_duration + second.cpu_duration
+    assert f"CpuDuration: {cpu}" in summary
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for the aggregation of cloud records into summary records."""
+
+import datetime
+
+import caso.record
+import caso.record_batch
+from caso import summary
+
+
+def test_summaries_group_records(cloud_record_list):
+    """Test that records are grouped by their VO, user, status and image."""
+    records = cloud_record_list + [cloud_record_list[0].model_copy(deep=True)]
+    summaries = summary.summarize(records)
+
+    assert len(summaries) == 2
+    first, second = summaries
+    assert isinstance(first, caso.record.CloudSummaryRecord)
+    assert (first.year, first.month) == (2023, 5)
+    assert first.fqan == "VO 1 FQAN"
+    assert first.number_of_vms == 2
+    assert first.wall_duration == 2 * cloud_record_list[0].wall_duration
+    assert first.cpu_duration == 2 * cloud_record_list[0].cpu_duration
+    assert first.cpu_count == 16
+    assert first.memory == 32
+    assert first.public_ip_count == 14
+    assert second.fqan == "VO 2 FQAN"
+    assert second.number_of_vms == 1
+    assert second.status == "completed"
+
+
+def test_summaries_start_times(cloud_record_list):
+    """Test that the earliest and latest start times of a group are kept."""
+    cloud_record_list[1].fqan = cloud_record_list[0].fqan
+    cloud_record_list[1].status = cloud_record_list[0].status
+    (record,) = summary.summarize(cloud_record_list)
+
+    assert record.earliest_start_time == cloud_record_list[1].start_time_epoch
+    assert record.latest_start_time == cloud_record_list[0].start_time_epoch
+
+
+def test_summaries_month(cloud_record_list):
+    """Test that running records are accounted until the measure time."""
+    cloud_record_list[0].end_time = None
+    measure_time = datetime.datetime(2023, 6, 1, 1, tzinfo=datetime.timezone.utc)
+    cloud_record_list[0].wall_duration = int(
+        (measure_time - cloud_record_list[0].start_time).total_seconds()
+    )
+    aggregator = summary.CloudSummaryAggregator(measure_time)
+    aggregator.update(cloud_record_list)
+
+    assert aggregator.records == 2
+    assert len(aggregator) == 3
+    months = [(s.year, s.month, s.fqan) for s in aggregator.summaries()]
+    assert months == [
+        (2023, 5, "VO 1 FQAN"),
+        (2023, 6, "VO 1 FQAN"),
+        (2023, 5, "VO 2 FQAN"),
+    ]
+    assert aggregator.summaries()[1].wall_duration == 3600
+
+
+def test_monthly_usage():
+    """Test that the usage of a VM is divided among the months it ran."""
+    start = datetime.datetime(2023, 1, 31, 12, tzinfo=datetime.timezone.utc)
+    end = datetime.datetime(2023, 3, 1, 12, tzinfo=datetime.timezone.utc)
+    wall = int((end - start).total_seconds())
+    usage = summary.monthly_usage(
+        int(start.timestamp()), int(end.timestamp()), wall, 2 * wall
+    )
+
+    assert usage == [
+        (2023, 1, 12 * 3600, 24 * 3600),
+        (2023, 2, 28 * 86400, 56 * 86400),
+        (2023, 3, 12 * 3600, 24 * 3600),
+    ]
+    # The durations of a VM that was suspended are divided proportionally
+    usage = summary.monthly_usage(int(start.timestamp()), int(end.timestamp()), 7, 1)
+    assert [u[2] for u in usage] == [0, 7, 0]
+    assert sum(u[3] for u in usage) == 1
+
+
+def test_summary_ssm_message(cloud_record_list):
+    """Test the SSM message of a summary record."""
+    (record,) = summary.summarize(cloud_record_list[:1])
+    lines = record.ssm_message().split("\n")
+
+    assert lines == sorted(lines)
+    assert "VO: VO 1 FQAN" in lines
+    assert "Month: 5" in lines
+    assert "NumberOfVMs: 1" in lines
+    assert f"EarliestStartTime: {cloud_record_list[0].start_time_epoch}" in lines
+    assert not any(line.startswith("Benchmark") for line in lines)
+
+
+def _store(tmp_path, months=3):
+    measure_time = datetime.datetime(2023, 6, 1, 1, tzinfo=datetime.timezone.utc)
+    return summary.CloudSummaryStore(
+        str(tmp_path / "summaries.sqlite"), months=months, measure_time=measure_time
+    )
+
+
+def test_store_keeps_the_latest_usage_of_each_vm(tmp_path, cloud_record_list):
+    """Test that VMs added again in overlapping periods are only counted once."""
+    first, second = cloud_record_list
+    second.fqan = first.fqan
+    second.status = first.status
+    store = _store(tmp_path)
+    assert store.update(cloud_record_list) == [(2023, 5)]
+    store.close()
+
+    older, newer = first.model_copy(deep=True), first.model_copy(deep=True)
+    older.wall_duration -= 3600
+    newer.wall_duration += 3600
+    store = _store(tmp_path)
+    store.update([newer])
+    store.update([older])
+    (record,) = store.summaries([(2023, 5)])
+    store.close()
+
+    assert record.number_of_vms == 2
+    assert record.wall_duration == newer.wall_duration + second.wall_duration
+    assert record.cpu_count == first.cpu_count + second.cpu_count
+    assert record.earliest_start_time == second.start_time_epoch
+    assert record.latest_start_time == first.start_time_epoch
+    assert record == summary.summarize([newer, second])[0]
+
+
+def test_store_groups(tmp_path, cloud_record_list):
+    """Test that the store groups the usage as the aggregator does."""
+    store = _store(tmp_path)
+    store.update(cloud_record_list)
+
+    summaries = store.summaries([(2023, 5)])
+    assert sorted(summaries, key=lambda s: s.fqan) == summary.summarize(
+        cloud_record_list
+    )
+    assert store.summaries([(2023, 4)]) == []
+
+
+def test_store_old_months(tmp_path, cloud_record_list):
+    """Test that the usage of the months that are not kept is evicted."""
+    store = _store(tmp_path, months=2)
+    store.update(cloud_record_list)
+    store.close()
+
+    store = _store(tmp_path, months=1)
+    assert store.update(cloud_record_list) == []
+    assert store.skipped == 2
+    assert store.evict() == 2
+    assert store.summaries([(2023, 5)]) == []
+
+
+def test_store_divides_the_usage_among_months(tmp_path, cloud_record):
+    """Test that the usage of a VM running for months is not counted twice."""
+    measure_time = datetime.datetime(2023, 6, 1, 1, tzinfo=datetime.timezone.utc)
+    cloud_record.start_time = datetime.datetime(
+        2023, 3, 15, tzinfo=datetime.timezone.utc
+    )
+    cloud_record.end_time = None
+    wall = int((measure_time - cloud_record.start_time).total_seconds())
+    cloud_record.wall_duration = wall
+    cloud_record.cpu_duration = 2 * wall - 1
+    store = summary.CloudSummaryStore(
+        str(tmp_path / "summaries.sqlite"), months=4, measure_time=measure_time
+    )
+
+    months = store.update([cloud_record])
+    summaries = store.summaries(months)
+    store.close()
+
+    assert months == [(2023, 3), (2023, 4), (2023, 5), (2023, 6)]
+    assert [s.number_of_vms for s in summaries] == [1, 1, 1, 1]
+    assert [s.wall_duration for s in summaries] == [
+        17 * 86400,
+        30 * 86400,
+        31 * 86400,
+        3600,
+    ]
+    assert sum(s.wall_duration for s in summaries) == wall
+    assert sum(s.cpu_duration for s in summaries) == 2 * wall - 1
+    assert summaries == summary.summarize([cloud_record], measure_time)
+
+
+def test_store_reads_the_columns_of_batches(tmp_path, cloud_record_list):
+    """Test that the usage of the records of a batch is read from its columns."""
+    batch = caso.record_batch.RecordBatch(cloud_record_list)
+    store = _store(tmp_path)
+    store.update(batch)
+    summaries = store.summaries([(2023, 5)])
+    store.close()
+
+    assert sorted(summaries, key=lambda s: s.fqan) == summary.summarize(
+        cloud_record_list
+    )
+    # The columns built by the store are shared with the batch
+    assert ("cloud", "wall_duration") in batch._columns
+    wall = batch.column("cloud", "wall_duration")
+    assert list(wall) == [r.wall_duration for r in cloud_record_list]
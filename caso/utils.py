@@ -16,6 +16,7 @@
 
 """Generic utility functions for cASO."""
 
+import datetime
 import errno
 import os
 import os.path
@@ -36,3 +37,29 @@ def makedirs(path):
                 raise
         else:
             raise
+
+
+def as_utc(date):
+    """Get an aware UTC datetime from a date, taking naive dates as UTC.
+
+    cASO handles naive datetimes as UTC, but the timestamp() method of naive
+    datetimes uses the local time zone, so they must be converted before
+    getting their timestamp.
+
+    :param date: Naive (UTC) or aware datetime.
+    """
+    if date.tzinfo is None:
+        return date.replace(tzinfo=datetime.timezone.utc)
+    return date.astimezone(datetime.timezone.utc)
+
+
+def utc_timestamp(date):
+    """Get the POSIX timestamp of a date, taking naive dates as UTC."""
+    return as_utc(date).timestamp()
+
+
+def utc_from_timestamp(timestamp):
+    """Get the naive UTC datetime of a POSIX timestamp."""
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).replace(
+        tzinfo=None
+    )